@@ -11,20 +11,54 @@ queries on a web-hosted MySQL database to retrieve as-yet unprinted
 turn, with a subsequent operation on the database marking each row as printed as
 it is written to the OUT endpoint.
 
+The script waits for the job notification WebSend.py broadcasts when it
+queues a job, and polls the database in case a notification is lost:
+straight away after a poll that found jobs, then every PRINT_JOB_POLL_PERIOD
+seconds, backing off to every --max-poll-period seconds while there is
+nothing to print.  One database connection is kept open between polls.
+
+Jobs are stored as binary (optionally compressed) or, for jobs queued by the
+original examples, as hex text.  Each job is streamed from the database with
+a server side cursor and decoded a chunk at a time as it is written to the
+printer.  Fetching, decoding and printing run as a pipeline of threads, so
+the next job is read while the printer is busy with the last; --prefetch
+sets how far ahead the fetch and decode stages may get.
+
+Jobs are claimed in the database with the print token kept in
+PRINT_TOKEN_FILE, and journalled as printing before they are written, so no
+job is printed twice after a crash or power cut.  A job cut off by a crash
+is reported when the script restarts and treated as printed, or printed
+again with --reprint-interrupted.  Printed jobs are deleted from the
+database in batches.  Ctrl-C prints the connection, pipeline and polling
+metrics.
+
+The shared parts are in ../nfc/pipsta/web_print: poller.py, pool.py,
+fetch.py, payload.py, pipeline.py, claims.py and completion.py.
+
 Copyright (c) 2014, Able Systems Ltd. All rights reserved.
 """
 
 import argparse
+import contextlib
+import os
 import platform
 import signal
+import socket
 import sys
-import time
 
 from usb.core import USBError
 import usb.core
 import usb.util
 
 import MySQLdb
+import MySQLdb.cursors
+
+# The job notifier and connection pool are shared with the other web examples
+# through the 'pipsta' package that lives alongside the NFC example.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, 'nfc'))
+from pipsta.web_print import claims, completion, fetch, notifier, pipeline, \
+    poller, pool
 
 # Query for printer serial number
 QUERY_SERIAL_NUMBER = b'\x1dI\x06' # GS,'I',6
@@ -46,11 +80,60 @@ DB_CONFIG = {
 }
 
 PRINTER_SERIAL_NUMBER_MAX_LENGTH = 10
+
+# The statements are kept constant so the server sees the same query text
+# every poll.  The printers jobs that no one else holds a live claim on are
+# claimed first, which renews the claims the token already holds.  A jobs
+# chunks are deleted along with it.
+CLAIM_JOBS = '''
+UPDATE printdata
+SET claim_token = %s, claim_expires = NOW() + INTERVAL %s SECOND
+WHERE printer_id = %s
+    AND (claim_token IS NULL OR claim_token = %s OR claim_expires < NOW())'''
+SELECT_UNPRINTED_JOBS = '''
+SELECT job_id, payload_format, chunked
+FROM printdata
+WHERE printer_id = %s AND claim_token = %s'''
+DELETE_PRINTED_JOBS = '''
+DELETE d, c
+FROM printdata AS d
+LEFT JOIN printdata_chunks AS c ON d.job_id = c.job_id
+WHERE d.job_id IN ({})'''
+
+# Printed jobs not yet deleted from the database are recorded here, and the
+# print token the jobs are claimed with is kept alongside
+JOURNAL_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'printed_jobs.journal')
+PRINT_TOKEN_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                'print_token')
 PRINT_JOB_POLL_PERIOD = 3
+PRINT_JOB_MAX_POLL_PERIOD = 300
+
+# The job query and the updates that mark jobs complete share a pooled
+# connection, which is kept open between polls.  The fetch stage of the
+# pipeline borrows the second while the updates are made.
+# pylint: disable=W0142
+POOL = pool.ConnectionPool(lambda: MySQLdb.connect(**DB_CONFIG),
+                           lost_errors=(MySQLdb.OperationalError,))
+PIPELINE = None
+POLLER = None
 
 def parse_arguments():
-    '''This scripts expects no arguments, offers help text and that is all.'''
+    '''Parses the prefetch depth of the print pipeline and the longest
+    wait between polls.
+    '''
     parser = argparse.ArgumentParser(description='Polls the print server')
+    parser.add_argument('--prefetch', type=int,
+                        default=pipeline.DEFAULT_DEPTH,
+                        help='items each stage of the print pipeline may '
+                        'get ahead of the next')
+    parser.add_argument('--max-poll-period', type=float,
+                        default=PRINT_JOB_MAX_POLL_PERIOD,
+                        help='longest wait (seconds) between polls of the '
+                        'database while there are no jobs')
+    parser.add_argument('--reprint-interrupted', action='store_true',
+                        help='print jobs cut off by a crash again, rather '
+                        'than treating them as printed')
     return parser.parse_args()
 
 def purge_usb_input(usb_in):
@@ -125,57 +208,70 @@ def get_printer_id(ep_in, ep_out):
     return ''.join([chr(x) for
                     x in ep_in.read(PRINTER_SERIAL_NUMBER_MAX_LENGTH)]).strip()
 
-def process_print_jobs(printer_id, ep_out):
-    '''Connects to the print job database using a set of credentials (URL, port,
-    user name, password and database name) provided.  The printers serial number
-    is used as an id to look up any print jobs outstanding.
+def fetch_stage(jobs):
+    '''The fetch stage of the print pipeline, streams each job from the
+    database a piece at a time.
+    '''
+    return fetch.fetch_jobs(POOL, MySQLdb.cursors.SSCursor, 'printdata', jobs)
+
+def process_print_jobs(printer_id, token, ep_out, recorder, jobs,
+                       lease=claims.DEFAULT_LEASE):
+    '''Borrows a connection to the print job database from the pool (which
+    connects using the set of credentials (URL, port, user name, password and
+    database name) provided).  The printers serial number is used as an id to
+    claim any print jobs outstanding with the print token, which are then run
+    through the jobs pipeline and written to the printer.  Each job is
+    journalled by the recorder as it starts printing and once printed, and
+    deleted from the database in batches.  Returns the number of jobs
+    printed.
     '''
-    conn = None
-    unprinted_jobs_cursor = None
-    mark_job_printed_cursor = None
+    printed = 0
     try:
-        # pylint: disable=W0142
-        conn = MySQLdb.connect(**DB_CONFIG)
-        unprinted_jobs_cursor = conn.cursor()
-        mark_job_printed_cursor = conn.cursor()
-
-        # Send a MySQL query to retrieve any unprinted data.  Note that the
-        # parameter handling has been left to the MySQL API.  Leaving this to
-        # the database minimises the risk of purposful (or accidental) SQL
-        # injection attacks caused by malformed queries.
-        try:
-            unprinted_jobs_cursor.execute(
-                "SELECT print_data, job_id " \
-                "FROM printdata " \
-                "WHERE printer_id = %s", printer_id)
-        except MySQLdb.Error as e:
-            print('Failed to retrieve any unprinted jobs: ' + str(e))
-            raise
-
-        # Loop to collect and print all of the unprinted
-        for row in unprinted_jobs_cursor:
-            ep_out.write(row[0].decode('hex'))
-            ep_out.write(FEED_PAST_CUTTER)
-
-            # Execute a MySQL 'query' to mark this row as printed thereafter
+        # Write any completions left over from the last drain first
+        recorder.flush()
+
+        with POOL.connection() as conn:
+            unprinted_jobs_cursor = conn.cursor()
+
+            # Send a MySQL query to retrieve any unprinted data.  Note that the
+            # parameter handling has been left to the MySQL API.  Leaving this
+            # to the database minimises the risk of purposful (or accidental)
+            # SQL injection attacks caused by malformed queries.
             try:
-                mark_job_printed_cursor.execute(
-                    "DELETE FROM printdata WHERE job_id = %s", (row[1],))
+                POOL.execute(unprinted_jobs_cursor, CLAIM_JOBS,
+                             (token, lease, printer_id, token))
+                POOL.execute(unprinted_jobs_cursor, SELECT_UNPRINTED_JOBS,
+                             (printer_id, token))
+                rows = unprinted_jobs_cursor.fetchall()
             except MySQLdb.Error as e:
-                print('Failed to mark job as completed: ' + str(e))
+                print('Failed to retrieve any unprinted jobs: ' + str(e))
                 raise
-        
-        conn.commit()
+            finally:
+                unprinted_jobs_cursor.close()
+
+        # Print all of the unprinted jobs as they come out of the pipeline,
+        # the recorder writes each batch while the next job is fetched
+        rows = [row for row in rows if not recorder.is_pending(row[0])]
+        printing = None
+        with contextlib.closing(jobs.run(rows)) as items:
+            for (job_id, data) in items:
+                if data is not None:
+                    if job_id != printing:
+                        recorder.start(job_id)
+                        printing = job_id
+                    ep_out.write(data)
+                else:
+                    ep_out.write(FEED_PAST_CUTTER)
+                    recorder.record(job_id)
+                    printing = None
+                    printed += 1
+
+        recorder.flush()
 
     except MySQLdb.Error as err:
-        print(err)
-    finally:
-        if unprinted_jobs_cursor:
-            unprinted_jobs_cursor.close()
-        if mark_job_printed_cursor:
-            mark_job_printed_cursor.close()
-        if conn:
-            conn.close()  # Clean-up: Close the database
+        print('Failed to process print jobs: ' + str(err))
+
+    return printed
 
 
 def signal_handler(signum, frame):
@@ -186,16 +282,24 @@ def signal_handler(signum, frame):
     terminal on the raspberry pi (http://linuxmanpages.com/man7/signal.7.php).
     """
     del signum, frame # intentionally unused delete them to make it obvious
+    print(POOL.stats())
+    if PIPELINE:
+        print(PIPELINE.report())
+    if POLLER:
+        print(POLLER.stats())
+    POOL.close()
     sys.exit()
 
 def main():
     '''Looks up any print jobs in the print database that have this printers id
     assigned to them, prints them out and marks the job as complete.
     '''
+    global PIPELINE, POLLER # pylint: disable=W0603
+
     if platform.system() != 'Linux':
         sys.exit('This script has only been written for Linux')
         
-    parse_arguments()
+    args = parse_arguments()
 
     signal.signal(signal.SIGINT, signal_handler)
     (printer_in, printer_out) = connect_to_printer()
@@ -204,12 +308,41 @@ def main():
     assert printer_id != None
     assert printer_id != ''
 
+    # Wait to be told about new work, checking the database every so often
+    # in case a notification was missed.  If the notification port cannot be
+    # opened fall back to polling the database.
+    try:
+        listener = notifier.Listener()
+    except socket.error as err:
+        print('Job notifications unavailable, polling instead: ' + str(err))
+        listener = None
+
+    recorder = completion.CompletionRecorder(POOL, DELETE_PRINTED_JOBS, (),
+                                             JOURNAL_FILE)
+    for job_id in recorder.resolve_interrupted(args.reprint_interrupted):
+        print('Job {} was interrupted by a crash and {}'.format(
+            job_id, 'will be printed again' if args.reprint_interrupted
+            else 'is treated as printed'))
+    token = claims.load_token(PRINT_TOKEN_FILE)
+
+    # The claims must outlast the longest wait between polls, which renew
+    # them
+    lease = max(claims.DEFAULT_LEASE, 2 * args.max_poll_period)
+    PIPELINE = pipeline.Pipeline([('fetch', fetch_stage),
+                                  ('decode', fetch.decode_jobs)],
+                                 args.prefetch)
+
+    POLLER = poller.AdaptivePoller(PRINT_JOB_POLL_PERIOD,
+                                   args.max_poll_period)
+
     # check for any outstanding print jobs
-    process_print_jobs(printer_id, printer_out)
-    # got to sleep for a while, when awoken check for more work and sleep again
+    POLLER.record(process_print_jobs(printer_id, token, printer_out,
+                                     recorder, PIPELINE, lease))
+
     while True:
-        time.sleep(PRINT_JOB_POLL_PERIOD)
-        process_print_jobs(printer_id, printer_out)
+        POLLER.wait(listener, printer_id)
+        POLLER.record(process_print_jobs(printer_id, token, printer_out,
+                                         recorder, PIPELINE, lease))
 
 if __name__ == '__main__':
     main()
@@ -6,16 +6,30 @@ implementations based on this code.
 
 This script takes the supplied filename and copies the contents of that to
 a new print job on the configured print job database.  The job is restricted
-to the printer ID supplied.
+to the printer ID supplied.  Once the job is committed a notification is
+broadcast so a waiting WebPrint.py picks it up straight away.
+
+The job is stored as binary (see pipsta/web_print/payload.py), use --hex to
+store it as hex text for printers still running the original WebPrint.py.
+The file is read and stored a chunk at a time, as ordered chunk rows the
+printer streams back (or, with --hex, in the job row itself), see
+pipsta/web_print/submit.py, so jobs of any size are sent in constant memory.
 
 Copyright (c) 2014 Able Systems Limited. All rights reserved.
 '''
 import argparse
-import binascii
+import os
 import sys
 
 import MySQLdb
 
+# The job notifier, payload formats and job submission are shared with the
+# other web examples through the 'pipsta' package that lives alongside the NFC
+# example.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, 'nfc'))
+from pipsta.web_print import notifier, payload, submit
+
 PRINTER_SERIAL_NUMBER_MAX_LENGTH = 10
 
 # DB_NAME specific constants
@@ -39,6 +53,9 @@ def parse_args():
                         help='id of printer the job should be sent to')
     parser.add_argument('file', type=argparse.FileType('rb'),
                         help='a file to send to the printer')
+    parser.add_argument('--hex', action='store_true',
+                        help='store the job as hex text, for printers still '
+                        'running the original examples')
     return parser.parse_args()
 
 # Create a connection to the database and get a cursor to
@@ -50,30 +67,29 @@ def connect_to_db():
     dbc = MySQLdb.connect(**DB_CONFIG)
     return (dbc, dbc.cursor())
 
-def insert_data(db_conn, cursor, printdata, printer_id):
-    '''Creates a new print job in the database'''
+def insert_data(db_conn, cursor, job_file, printer_id,
+                payload_format=payload.FORMAT_RAW):
+    '''Creates a new print job in the database from the contents of the
+    file and returns its job id, which the database assigns (job_id is an
+    AUTO_INCREMENT column).
+    '''
+    # Hex jobs are for printers running the original examples, which only
+    # read the job row
+    chunked = payload_format != payload.FORMAT_HEX
     try:
-        cursor.execute("INSERT INTO printdata(print_data, printer_id) " \
-              "VALUES (%s, %s)", (printdata, printer_id))
+        cursor.execute("INSERT INTO printdata(print_data, printer_id, " \
+              "payload_format, chunked) VALUES ('', %s, %s, %s)",
+              (printer_id, payload_format, chunked))
+        job_id = cursor.lastrowid
+        submit.store_payload(cursor, 'printdata', job_id, job_file, chunked,
+                             payload_format, MySQLdb.Binary)
         db_conn.commit()
+        notifier.notify([printer_id])
+        return job_id
     except MySQLdb.Error as ex:
         print('Error inserting data: ' + str(ex))
         raise
 
-
-def read_uid(cursor):
-    '''Obtains the next unique job id from the database'''
-    try:
-        cursor.execute("SELECT MAX(job_id) AS job FROM printdata")
-        job = cursor.fetchone()
-        if job is not None and job[0] is not None:
-            return job[0] + 1
-    except MySQLdb.Error as e:
-        print('Error reading UID: ' + e)
-        raise
-
-    return 0
-
 def main():
     '''Sends the contents of the supplied file to the print job database with
     the supplied printer serial number.
@@ -90,18 +106,16 @@ def main():
 
     try:
         (db_conn, cursor) = connect_to_db()
-        read_uid(cursor)
-        job = ""
+        if args.hex:
+            payload_format = payload.FORMAT_HEX
+        else:
+            payload_format = payload.FORMAT_RAW
 
         with args.file:
-            # Get data from file
-            for data in args.file:
-                data = binascii.hexlify(data)
-                job += data
-
-            insert_data(db_conn, cursor, job, args.printer_id)
+            job_id = insert_data(db_conn, cursor, args.file, args.printer_id,
+                                 payload_format)
 
-        print("Print job created!")
+        print("Print job {} created!".format(job_id))
 
     except MySQLdb.Error as ex:
         print('Print job cancelled due to a previous error')
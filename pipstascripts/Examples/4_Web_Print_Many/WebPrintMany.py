@@ -9,21 +9,56 @@ This script connects to the print job database and identifies all of the jobs
 destined for this printer.  If the job specifies any credentials then the
 printer is queried to verify if it has matching credentials
 
+The queue is the MySQL database in DB_CONFIG or, with --sqlite, an SQLite
+file shared with WebSendMany.py --sqlite.  The script waits for the job
+notification WebSendMany.py broadcasts, and polls the database in case a
+notification is lost: straight away after a poll that found new jobs, then
+every PRINT_JOB_POLL_PERIOD seconds, backing off to every --max-poll-period
+seconds while there is nothing to print.  One pooled database connection
+serves the job queries and the updates, and is kept open between polls.
+
+New jobs are claimed with the print token kept in the spool and streamed
+into a local spool on the Pi.  A printer thread prints them from there, so
+the printer carries on through a short network outage.  The highest
+priority jobs are printed first, then by default the printer is shared
+fairly between the credentials the jobs were sent with; --schedule and
+--share choose how.  A job is marked printing in the spool before it is
+written, so no job is printed twice after a crash or power cut.  A job cut
+off by a crash is reported when the script restarts and treated as
+printed, or printed again with --reprint-interrupted.  Printed jobs are
+marked printed in the database in batches.
+
+The credentials loaded on the printer are read every poll.  The database
+is only told them when they change, and matches them to the jobs itself.
+
+The shared parts are in ../nfc/pipsta/web_print: backend.py, poller.py,
+spool.py, scheduler.py, claims.py, fetch.py and payload.py.
+
 Copyright (c) 2014, Able Systems Ltd. All rights reserved.
 '''
 
 import argparse
+import array
+import functools
+import os
 import platform
 import signal
+import socket
+import sqlite3
 import sys
+import threading
 import time
 
 from usb.core import USBError
 import usb.core
 import usb.util
 
-import MySQLdb
-
+# The job notifier and print job queue are shared with the other web examples
+# through the 'pipsta' package that lives alongside the NFC example.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, 'nfc'))
+from pipsta.web_print import backend, claims, notifier, payload, poller, \
+    scheduler, spool
 
 # Query for printer serial number
 QUERY_SERIAL_NUMBER = b'\x1dI\x06' # GS,'I',6
@@ -37,6 +72,8 @@ PIPSTA_USB_PRODUCT_ID = 0xA053
 PRINTER_SERIAL_NUMBER_MAX_LENGTH = 10
 PRINTER_CREDENTIALS_MAX_LENGTH = 65536
 PRINT_JOB_POLL_PERIOD = 3
+PRINT_JOB_MAX_POLL_PERIOD = 300
+ACKNOWLEDGE_PERIOD = 2
 
 # DB_NAME specific constants
 # Insert your database connection credentials here.
@@ -49,9 +86,44 @@ DB_CONFIG = {
   'port': ????,
 }
 
+# The print job queue, in MySQL (DB_CONFIG) or with --sqlite in an SQLite file.
+# Its pooled connection serves both the job queries and the updates that mark
+# jobs complete, and is kept open between polls.
+JOB_QUEUE = None
+
+# Jobs waiting to print, and printed jobs not yet marked printed in the
+# database, are kept here
+SPOOL_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          'print_spool.db')
+JOB_SPOOL = None
+POLLER = None
+PRINTER_CREDENTIALS = None
+
+# What the jobs are shared between when scheduling
+SHARE_BY_CREDENTIALS = 'credentials'
+SHARE_BY_GROUP = 'group'
+
 def parse_arguments():
-    '''This scripts expects no arguments, offers help text and that is all.'''
+    '''Parses the job queue, scheduling and polling options'''
     parser = argparse.ArgumentParser(description='Polls the print server')
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='take jobs from an SQLite print job database '
+                        'rather than MySQL')
+    parser.add_argument('--schedule', choices=scheduler.POLICIES,
+                        default=scheduler.POLICY_DRR,
+                        help='the order jobs of the same priority are '
+                        'printed in (default drr, fair shares)')
+    parser.add_argument('--share',
+                        choices=[SHARE_BY_CREDENTIALS, SHARE_BY_GROUP],
+                        default=SHARE_BY_CREDENTIALS,
+                        help='what the printer is shared fairly between')
+    parser.add_argument('--max-poll-period', type=float,
+                        default=PRINT_JOB_MAX_POLL_PERIOD,
+                        help='longest wait (seconds) between polls of the '
+                        'database while there are no jobs')
+    parser.add_argument('--reprint-interrupted', action='store_true',
+                        help='print jobs cut off by a crash again, rather '
+                        'than treating them as printed')
     return parser.parse_args()
     
 def purge_usb_input(usb_in):
@@ -126,122 +198,219 @@ def get_printer_id(ep_in, ep_out):
     return ''.join([chr(x) for
                     x in ep_in.read(PRINTER_SERIAL_NUMBER_MAX_LENGTH)]).strip()
 
-def get_credentials(ep_in, ep_out):
-    '''Requests the NFC credentials from the printer and then returns the
-    credentials.  If no credentials are loaded on the printer then a None
-    is returned.
+class PrinterCredentials(object):
+    '''The NFC credentials loaded on the printer, for one connection to it.
+    The printer has no status that says its credentials have changed, so
+    they are read every poll, but into a buffer kept for the connection,
+    and are only split into a new list when they differ from the last read.
     '''
-    result = None
-
-    try:
-        ep_out.write(QUERY_CREDENTIALS)
-        result = ep_in.read(PRINTER_CREDENTIALS_MAX_LENGTH)
-    except usb.core.USBError as err:
-        if 'timed out' in err.args[1]:
-            pass
-        else:
-            exc_info = sys.exc_info()
-            raise exc_info[0](exc_info[1]).with_traceback(exc_info[2])
-
-    if not result:
-        return None
-
-    return ''.join([chr(x) for x in result]).split(',')
-
-
-def process_print_jobs(ep_in, ep_out):
-    '''Looks up any print jobs for the Pipsta connected and filters the
-    jobs by the supplied credentials (if any exist) and finally prints any
-    outstanding jobs.
+    def __init__(self, ep_in, ep_out):
+        self.__ep_in = ep_in
+        self.__ep_out = ep_out
+        self.__buffer = array.array('B', [0]) * PRINTER_CREDENTIALS_MAX_LENGTH
+        self.__raw = None
+        self.credentials = None
+        self.reads = 0
+        self.changes = 0
+
+    def read(self):
+        '''Requests the NFC credentials from the printer and returns them as
+        a list, the same list as last time if they have not changed.  If no
+        credentials are loaded on the printer then None is returned.
+        '''
+        try:
+            self.__ep_out.write(QUERY_CREDENTIALS)
+            length = self.__ep_in.read(self.__buffer)
+        except USBError as err:
+            if 'timed out' not in str(err):
+                raise
+            length = 0
+
+        self.reads += 1
+        raw = self.__buffer[:length].tostring()
+        if raw != self.__raw:
+            self.__raw = raw
+            self.credentials = raw.split(',') if raw else None
+            self.changes += 1
+        return self.credentials
+
+    def stats(self):
+        '''Returns a one line summary of the credential reads'''
+        return 'credentials reads={} changes={}'.format(self.reads,
+                                                        self.changes)
+
+
+def job_share(share_by, group_id, credentials):
+    '''Returns the share a job is scheduled under'''
+    if share_by == SHARE_BY_GROUP:
+        return str(group_id)
+    return credentials or ''
+
+def spool_print_jobs(printer_credentials, printer_id, job_queue, job_spool,
+                     usb_lock, share_by=SHARE_BY_CREDENTIALS,
+                     lease=claims.DEFAULT_LEASE):
+    '''Marks the jobs printed since the last call as printed in the
+    database, then claims any print jobs for the Pipsta connected, filters
+    the jobs by the supplied credentials (if any exist) and copies any that
+    are not already spooled into the spool for the printer thread.  Returns
+    the number of jobs spooled.
     '''
+    spooled = 0
     try:
-        printer_id = get_printer_id(ep_in, ep_out)
-        credentials = get_credentials(ep_in, ep_out)
+        with usb_lock:
+            credentials = printer_credentials.read()
     except USBError as err:
         # Failed to connect to a printer, abort
-        return
-    
-    # The with statement is used to manage connections to the database and to
-    # manage database cursors.  SQLErrors are caught to help diagnose database
-    # issues.  USBError's are not expected so are not handled explicitly, the
-    # use 'while-statements' ensures that no matter what the database
-    # connections will be tidied up.  The pyusb library claims to always leave
-    # the usb in a correct state on exit.
-    #
-    # Everytime a call is made to MySQLdb.connect in a with statement a cursor
-    # is returned for use on the database.  To get multiple cursors multiple
-    # calls to MySQLdb.connect are made.
-    
-    # pylint: disable=W0142
-    with MySQLdb.connect(**DB_CONFIG) as unprinted_jobs_cursor:
+        return spooled
+
+    # Each call to the queue borrows a connection from its pool.  Database
+    # errors are caught to help diagnose database issues, a connection that
+    # has been lost is dropped by the pool and replaced on the next poll,
+    # while the printer thread carries on printing the jobs already spooled.
+    try:
+        job_spool.acknowledge(functools.partial(job_queue.mark_printed,
+                                                printer_id))
+
+        # If the printer has credentials then the database uses these (along
+        # with the printer ID) to filter the print jobs.  If there are no
+        # credentials then it looks for print jobs that don't require any
+        # credentials and that are intended for this printer.  The jobs are
+        # claimed with the spools print token, which also renews the claims
+        # already held.
+        rows = job_queue.outstanding_jobs(printer_id, credentials,
+                                          job_spool.token, lease)
+
+        # Stream each new job into the spool, jobs already spooled (including
+        # those printed but not yet marked printed) are skipped
+        for (job_id, payload_format, chunked, priority, group_id,
+             job_credentials) in rows:
+            if job_spool.contains(job_id):
+                continue
+
+            if job_spool.add(job_id, payload_format,
+                             job_queue.job_pieces(job_id, chunked), priority,
+                             job_share(share_by, group_id, job_credentials)):
+                spooled += 1
+
+    # Print any database errors, and any errors from the spool
+    except job_queue.errors + (sqlite3.Error,) as err:
+        print(err)
+
+    return spooled
+
+def print_spooled_jobs(job_spool, ep_out, usb_lock):
+    '''Prints the spooled jobs in the order the spool's scheduler chooses,
+    waiting for more when the spool is empty.  This runs in its own thread,
+    the USB lock keeps the credentials queries out of the middle of a job.
+    Spool errors are printed and the thread carries on, so a busy spool
+    never stops the printing for good.
+    '''
+    while True:
         try:
-            # If the printer has credentials then use these (along with the
-            # printer ID) to filter the print jobs.  If there are no credentials
-            # then look for print jobs that don't require any credentials and
-            # that are intended for this printer. 
-            if credentials:
-                format_strings = ','.join(['%s'] * len(credentials))
-                unprinted_jobs_cursor.execute('''
-SELECT print_data, job_id
-FROM printdata_v2 AS d
-INNER JOIN printer_jobs AS j ON  d.print_group_id = j.group_id
-WHERE printer_id = %s AND printed = FALSE AND credentials IN (%s)''' %
-('%s', format_strings), (printer_id,) + tuple(credentials))
-            else:
-                unprinted_jobs_cursor.execute('''
-SELECT print_data, job_id
-FROM printdata_v2 AS d
-INNER JOIN printer_jobs AS j ON d.print_group_id = j.group_id
-WHERE printer_id = %s AND printed = FALSE AND credentials IS NULL''',
-printer_id)    
-            # Obtain the 1st print job intended for this printer and with a set
-            # of credentials that match.
-            row = unprinted_jobs_cursor.fetchone()
-            
-            # Print the job, mark it as complete and collect the next print job
-            while row:
-                with MySQLdb.connect(**DB_CONFIG) as mark_job_printed_cursor:
-                    ep_out.write(row[0].decode('hex'))
+            job = job_spool.next_job()
+            if job is None:
+                job_spool.wait(PRINT_JOB_POLL_PERIOD)
+                continue
+
+            (job_id, payload_format) = job
+            job_spool.start_printing(job_id)
+            try:
+                with usb_lock:
+                    payload.write_stream(ep_out, job_spool.pieces(job_id),
+                                         payload_format)
                     ep_out.write(FEED_PAST_CUTTER)
-                    mark_job_printed_cursor.execute('''
-UPDATE printdata_v2 AS d
-INNER JOIN printer_jobs AS j ON d.print_group_id = j.group_id
-SET printed = TRUE
-WHERE job_id = %s AND printer_id = %s AND printed = FALSE''',
-(row[1], printer_id))
-                    # Retrieve the next row
-                    row = unprinted_jobs_cursor.fetchone()
-
-        # Format and print any database errors (along with executed statement)
-        except MySQLdb.Error as err:
-            # pylint: disable=W0212
-            print(unprinted_jobs_cursor._last_executed)
-            print(err)
+            except USBError as err:
+                # The job goes back in the spool and is printed again
+                print('Failed to print job {}: {}'.format(job_id, err))
+                job_spool.retry(job_id)
+                time.sleep(PRINT_JOB_POLL_PERIOD)
+                continue
+
+            job_spool.mark_printed(job_id)
+        except sqlite3.Error as err:
+            print('Spool error: {}'.format(err))
+            time.sleep(PRINT_JOB_POLL_PERIOD)
 
 def signal_handler(sig_int, frame):
     '''This signal handler negates the need for super user rights when ending
     this application usgin the 'kill' command.
     '''
     del sig_int, frame
+    if JOB_QUEUE:
+        print(JOB_QUEUE.pool.stats())
+        JOB_QUEUE.pool.close()
+    if PRINTER_CREDENTIALS:
+        print(PRINTER_CREDENTIALS.stats())
+    if JOB_SPOOL:
+        print(JOB_SPOOL.stats())
+    if POLLER:
+        print(POLLER.stats())
     sys.exit()
 
 def main():
     '''Connect to the printer and the database at regular intervals.  If there
-    are any valid print jobs outstanding then print them off.
+    are any valid print jobs outstanding then spool them and print them off.
     '''
+    global JOB_QUEUE, JOB_SPOOL # pylint: disable=W0603
+    global POLLER, PRINTER_CREDENTIALS # pylint: disable=W0603
+
     if platform.system() != 'Linux':
         sys.exit('This script has only been written for Linux')
     
-    parse_arguments()
+    args = parse_arguments()
+    if args.sqlite:
+        JOB_QUEUE = backend.SQLiteBackend(args.sqlite)
+    else:
+        JOB_QUEUE = backend.MySQLBackend(DB_CONFIG)
         
     signal.signal(signal.SIGINT, signal_handler)
     ep_in, ep_out = connect_to_printer()
-    process_print_jobs(ep_in, ep_out)
-    
-    # go to sleep for a while, when awoken check for more work and sleep again
+    printer_id = get_printer_id(ep_in, ep_out)
+    PRINTER_CREDENTIALS = PrinterCredentials(ep_in, ep_out)
+
+    # Wait to be told about new work, checking the database every so often
+    # in case a notification was missed.  If the notification port cannot be
+    # opened fall back to polling the database.
+    try:
+        listener = notifier.Listener()
+    except socket.error as err:
+        print('Job notifications unavailable, polling instead: ' + str(err))
+        listener = None
+
+    # Jobs left in the spool by the last run are printed (or acknowledged)
+    # first
+    JOB_SPOOL = spool.Spool(SPOOL_FILE, scheduler.Scheduler(args.schedule))
+    for job_id in JOB_SPOOL.recover_interrupted(args.reprint_interrupted):
+        print('Job {} was interrupted by a crash and {}'.format(
+            job_id, 'will be printed again' if args.reprint_interrupted
+            else 'is treated as printed'))
+    usb_lock = threading.Lock()
+    printer = threading.Thread(target=print_spooled_jobs,
+                               args=(JOB_SPOOL, ep_out, usb_lock))
+    printer.daemon = True
+    printer.start()
+
+    # The claims must outlast the longest wait between polls, which renew
+    # them
+    lease = max(claims.DEFAULT_LEASE, 2 * args.max_poll_period)
+    POLLER = poller.AdaptivePoller(PRINT_JOB_POLL_PERIOD,
+                                   args.max_poll_period)
+    POLLER.record(spool_print_jobs(PRINTER_CREDENTIALS, printer_id,
+                                   JOB_QUEUE, JOB_SPOOL, usb_lock, args.share,
+                                   lease))
+
     while True:
-        time.sleep(PRINT_JOB_POLL_PERIOD)
-        process_print_jobs(ep_in, ep_out)
+        # Come back sooner if there are jobs printing, or printed, to
+        # acknowledge
+        if JOB_SPOOL.depth() or JOB_SPOOL.printed_jobs():
+            limit = ACKNOWLEDGE_PERIOD
+        else:
+            limit = None
+
+        POLLER.wait(listener, printer_id, limit)
+        POLLER.record(spool_print_jobs(PRINTER_CREDENTIALS, printer_id,
+                                       JOB_QUEUE, JOB_SPOOL, usb_lock,
+                                       args.share, lease))
 
 if __name__ == '__main__':
     main()
@@ -7,14 +7,48 @@ implementations based on this code.
 
 A print job is created based on the supplied data file (to print) the printer
 serial number (',' seperated list of target printers) and a list of credentials
-the printer must have for the job to be executed
+the printer must have for the job to be executed.  The job is added for every
+printer in one transaction, its group id is taken from the print_group_seq
+sequence created by pipsta/web_print/schema.py.  With --sqlite the job is
+queued in an SQLite database file instead, for WebPrintMany.py --sqlite
+(see pipsta/web_print/backend.py).  Once the job is committed
+a notification is broadcast so any waiting WebPrintMany.py picks it up
+straight away.
+
+The job is stored as binary (see pipsta/web_print/payload.py), use
+--compress to store it zlib compressed, which suits raster graphics, or
+--hex to store it as hex text for printers still running the original
+WebPrintMany.py.  The file is read and stored a chunk at a time, as ordered
+chunk rows the printers stream back (or, with --hex, in the job row itself),
+see pipsta/web_print/submit.py, so jobs of any size are sent in constant
+memory.  Jobs sent with a higher --priority are printed before any others
+waiting at the printer.
+
+The file is sent as printer bytes unless a --type is given.  Text, banner
+and QR-Code jobs take the text or data from the file, and image jobs take
+an image file.  These are rendered here, with the raster encoder the print
+examples use (see pipsta/web_print/render.py), and stored as the bytes the
+printer is sent, so the printers only stream them.  Rendered graphics are
+stored zlib compressed unless --hex is given.
+
+Each run of this script is a new python process and a new database
+connection, to send many jobs run WebSendService.py and post them to it.
 
 Copyright (c) 2014 Able Systems Limited. All rights reserved.
 """
 import argparse
-import binascii
+import io
+import os
+import sys
+import time
 
-import MySQLdb
+# The job notifier, payload formats and print job queue are shared with the
+# other web examples through the 'pipsta' package that lives alongside the NFC
+# example.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, 'nfc'))
+from pipsta.graphics import raster
+from pipsta.web_print import backend, notifier, payload, render
 
 # DB_NAME specific constants
 # Insert your database connection credentials here.
@@ -34,63 +68,109 @@ def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('printer_id', nargs='+',
                         help='id of printer the job should be sent to')
-    parser.add_argument('file', type=argparse.FileType('r'),
+    parser.add_argument('file', type=argparse.FileType('rb'),
                         help='a file to send to the printer')
     parser.add_argument('-c', '--credentials', help='credentials string')
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='queue the job in an SQLite print job database '
+                        'rather than MySQL')
+    parser.add_argument('-p', '--priority', type=int, default=0,
+                        help='jobs with a higher priority are printed first '
+                        '(default 0)')
+    stored_as = parser.add_mutually_exclusive_group()
+    stored_as.add_argument('--compress', action='store_true',
+                           help='store the job zlib compressed')
+    stored_as.add_argument('--hex', action='store_true',
+                           help='store the job as hex text, for printers '
+                           'still running the original examples')
+    parser.add_argument('-t', '--type', choices=render.TYPES,
+                        default=render.TYPE_RAW,
+                        help='render the file as a job of this type before '
+                        'it is stored (default raw, printer bytes)')
+    parser.add_argument('--font',
+                        help='a truetype font file for banner jobs')
+    parser.add_argument('--trim', choices=raster.TRIM_MODES,
+                        default=raster.TRIM_NONE,
+                        help='crop the blank margins of banner and image '
+                        'jobs')
+    parser.add_argument('--height', type=int,
+                        help='the most dot lines a QR-Code job may take')
+    parser.add_argument('--max-pixels', type=int,
+                        default=render.MAX_INPUT_PIXELS,
+                        help='the largest image (in pixels) that will be '
+                        'decoded')
     return parser.parse_args()
 
-def insert_data(db_conn, printdata, printer_ids, credentials=None):
-    """Uses the database connection supplied, inserts a print job into the
-    database.
+def render_job(args):
+    """Renders the file as a job of the type requested and returns a file
+    object holding the printer bytes.  Exits with the reason if the file
+    cannot be rendered."""
+    start = time.time()
+    try:
+        data = render.render(args.type, args.file, args.font, args.trim,
+                             args.height, args.max_pixels)
+    except (IOError, ValueError) as err:
+        sys.exit('The job could not be rendered: {}'.format(err))
+    print('Rendered {} job, {} bytes in {:.3f}s'.format(
+        args.type, len(data), time.time() - start))
+    return io.BytesIO(data)
+
+def insert_data(job_queue, job_file, printer_ids, credentials=None,
+                payload_format=payload.FORMAT_RAW, priority=0):
+    """Uses the print job queue supplied, inserts a print job into the
+    database from the contents of the file and returns its group id.  A job
+    for one printer or fifty takes the same round trips to the database: the
+    next group id, the printers (sent as a single multi-row INSERT by
+    executemany), the job row, one insert per chunk of the payload and the
+    commit.  Hex jobs are for printers running the original examples, which
+    only read the job row, so are appended to it instead.
     """
     try:
-        cursor = db_conn.cursor()
-        cursor.execute("SELECT COALESCE(MAX(group_id),0) FROM printer_jobs")
-        group_id = cursor.fetchone()[0] + 1
-
-        for printer_id in printer_ids:
-            if credentials == None:
-                cursor.execute(
-                    "INSERT INTO printer_jobs VALUES(%s, %s, FALSE, NULL);",
-                    (group_id, printer_id))
-            else:
-                cursor.execute(
-                    "INSERT INTO printer_jobs VALUES(%s, %s, FALSE, %s);",
-                    (group_id, printer_id, credentials))
-
-        cursor.execute(
-            "INSERT INTO printdata_v2 VALUES (null, %s, %s);",
-            (printdata, group_id))
-        db_conn.commit()
-    except MySQLdb.Error as err:
+        group_id = job_queue.submit(job_file, printer_ids, credentials,
+                                    payload_format, priority)
+    except job_queue.errors as err:
         print(err)
+        return None
+
+    notifier.notify(printer_ids)
+    return group_id
 
 def main():
     """Main loop for the application.  Connects to the database and stores a
     new print job.
     """
     args = parse_arguments()
-    db_conn = None
+    job_queue = None
 
     try:
-        # pylint: disable=W0142
-        db_conn = MySQLdb.connect(**DB_CONFIG)
+        if args.sqlite:
+            job_queue = backend.SQLiteBackend(args.sqlite, size=1)
+        else:
+            job_queue = backend.MySQLBackend(DB_CONFIG, size=1)
 
-        with args.file:
-            job = ""
-            # Get data from file
-            for data in args.file:
-                job += binascii.hexlify(data)
+        if args.hex:
+            payload_format = payload.FORMAT_HEX
+        elif args.compress or args.type in render.RASTER_TYPES:
+            payload_format = payload.FORMAT_ZLIB
+        else:
+            payload_format = payload.FORMAT_RAW
 
-            if args.credentials:
-                insert_data(db_conn, job, args.printer_id, args.credentials)
+        with args.file:
+            if args.type == render.TYPE_RAW:
+                job_file = args.file
             else:
-                insert_data(db_conn, job, args.printer_id)
+                job_file = render_job(args)
+            group_id = insert_data(job_queue, job_file, args.printer_id,
+                                   args.credentials, payload_format,
+                                   args.priority)
 
-        print("Print job created!")
+        if group_id:
+            print("Print job group {} created!".format(group_id))
+        else:
+            print('Print job cancelled due to a previous error')
     finally:
-        if db_conn:
-            db_conn.close()
+        if job_queue:
+            job_queue.pool.close()
 
 if __name__ == '__main__':
     main()
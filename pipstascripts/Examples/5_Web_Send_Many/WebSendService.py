@@ -0,0 +1,101 @@
+# WebSendService.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+"""This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Runs a small HTTP service that queues print jobs for WebPrintMany.py, for
+programs that send more jobs than it is sensible to start WebSendMany.py for
+one at a time.  The service keeps its connections to the print job database
+open, and each client can send job after job over one HTTP connection -
+
+    curl --data-binary @job.bin 'http://localhost:8631/jobs?printer=000000001'
+    curl 'http://localhost:8631/jobs/42'
+
+A batch of jobs can be queued in one request and one transaction, jobs can
+be rendered from text, banner, QR-Code and image requests as WebSendMany.py
+--type does, and the state of each job on its printers can be asked for;
+see pipsta/web_print/service.py for the requests.  As with WebSendMany.py
+the queue is the MySQL database in DB_CONFIG or, with --sqlite, an SQLite
+database file.
+
+The service is not authenticated, so by default it only listens on the
+local machine (use --host to change that).  Stop it with Ctrl-C, which
+prints the service and connection pool metrics.
+
+Copyright (c) 2015 Able Systems Limited. All rights reserved.
+"""
+import argparse
+import os
+import signal
+import sys
+
+# The print job queue and job service are shared with the other web examples
+# through the 'pipsta' package that lives alongside the NFC example.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, 'nfc'))
+from pipsta.web_print import backend, service
+
+# DB_NAME specific constants
+# Insert your database connection credentials here.
+# Refer to Pipsta documents PIPSTA010..PIPSTA012
+DB_CONFIG = {
+  'user': 'user_name_db',
+  'passwd': 'password',
+  'host': 'host_ip_address',
+  'db': 'user_name_db',
+  'port': ????,
+}
+
+# Connections kept open to the database, more are opened while more clients
+# than this are sending jobs at once
+POOL_SIZE = 4
+
+SERVER = None
+
+def parse_arguments():
+    """Parses the arguments the user supplies, returning the verified list
+    of arguments.  Any errors are pointed out to the user.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost',
+                        help='the address to listen on (default localhost)')
+    parser.add_argument('--port', type=int, default=service.DEFAULT_PORT,
+                        help='the port to listen on (default {})'.format(
+                            service.DEFAULT_PORT))
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='queue the jobs in an SQLite print job database '
+                        'rather than MySQL')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not log each request')
+    return parser.parse_args()
+
+def signal_handler(sig_int, frame):
+    """Prints the metrics and stops the service"""
+    del sig_int, frame
+    if SERVER:
+        print(SERVER.stats())
+        print(SERVER.job_queue.pool.stats())
+        SERVER.job_queue.pool.close()
+    sys.exit()
+
+def main():
+    """Opens the print job queue and serves job requests until stopped"""
+    global SERVER # pylint: disable=W0603
+
+    args = parse_arguments()
+    if args.sqlite:
+        job_queue = backend.SQLiteBackend(args.sqlite, size=POOL_SIZE)
+    else:
+        job_queue = backend.MySQLBackend(DB_CONFIG, size=POOL_SIZE)
+
+    SERVER = service.JobServer((args.host, args.port), job_queue,
+                               quiet=args.quiet)
+    signal.signal(signal.SIGINT, signal_handler)
+    print('Serving print jobs on http://{}:{}{}'.format(
+        args.host, args.port, service.JOBS_PATH))
+    SERVER.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,18 @@ library (in this case Pillow - see http://pillow.readthedocs.org/index.html)
 to:
 	load an image file,
 	scale it to fit the page,
-	Save and reopen (with dither) 
+	dither it
 	and finally print the image using single dot graphics.
 
+Photos are often far larger than the 384 dots the printer can use, so the
+image is decoded as close to the paper width as the file format allows.
+JPEG files are decoded at a reduced scale (1/2, 1/4 or 1/8) by the JPEG
+library itself, other formats are decoded once and reduced in a single
+resize.  Images that would decode to more than --max-pixels pixels are
+refused before any pixels are decoded.  The decode time and the peak memory
+used by the process are logged.  The loader is shared with the web print
+job renderer (see ../nfc/pipsta/graphics/images.py).
+
 Note that dithering must happen AFTER the resizing to avoid a resize on the
 dithered pixels giving rise to an inconsistent/mottled patter
 
@@ -30,17 +39,18 @@ Copyright (c) 2015, Able Systems Ltd. All rights reserved.
 import argparse
 import logging
 import platform
-import struct
 import os
 import sys
-import time
 import inspect
 
-from bitarray import bitarray
 import usb.core
 import usb.util
 
-from PIL import Image, ImageDraw
+# The image loader and raster encoder are shared with the other examples
+# through the 'pipsta' package that lives alongside the NFC example.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, 'nfc'))
+from pipsta.graphics import images, raster
 
 
 #import struct
@@ -52,15 +62,14 @@ PIPSTA_USB_VENDOR_ID = 0x0483
 PIPSTA_USB_PRODUCT_ID = 0xA053
 
 # Printer commands
-SET_FONT_MODE_3 = b'\x1b!\x03'
 SET_LED_MODE = b'\x1bX\x2d'
 FEED_PAST_CUTTER = b'\n' * 5
-SELECT_SDL_GRAPHICS = b'\x1b*\x08'
 
 
 DOTS_PER_LINE = 384
 BYTES_PER_DOT_LINE = DOTS_PER_LINE/8
-USB_BUSY = 66
+
+MAX_INPUT_PIXELS = images.MAX_INPUT_PIXELS
 
 
 def setup_logging():
@@ -120,40 +129,23 @@ def setup_usb():
     return ep_out, dev
 
 
-def convert_image(image):
-    '''Takes the bitmap and converts it to PIPSTA 24-bit image format'''
-    imagebits = bitarray(image.getdata(), endian='big')
-    LOGGER.info("Done decoding!")
-    # pylint: disable=E1101
-    imagebits.invert()
-    return imagebits.tobytes()
-
-
-def print_image(device, ep_out, data):
-    '''Reads the data and sends it a dot line at once to the printer
+def print_image(device, ep_out, data, mode=raster.MODE_AUTO,
+                trim=raster.TRIM_NONE):
+    '''Trims the blank margins from the data as requested, encodes it in
+    the graphics mode requested and sends it to the printer
     '''
     LOGGER.debug('Start print')
     try:
-        ep_out.write(SET_FONT_MODE_3)
-        cmd = struct.pack('3s2B', SELECT_SDL_GRAPHICS,
-                      (DOTS_PER_LINE / 8) & 0xFF,
-                      (DOTS_PER_LINE / 8) / 256)
-        # Arbitrary command length, set to minimum acceptable 24x8 dots this figure
-        # should give mm of print
-        lines = len(data)//BYTES_PER_DOT_LINE
-        start = 0
-        for line in range (0, lines):    
-            start = line * BYTES_PER_DOT_LINE
-            # intentionally +1 for slice operation below
-            end = start + BYTES_PER_DOT_LINE
-            # ...to end (end not included)            
-            ep_out.write(b''.join([cmd, data[start:end]]))
-        
-	    res = device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
-	    while res[0] == USB_BUSY:
-                time.sleep(0.01)
-                res = device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
-                LOGGER.debug('End print')
+        trimmed = raster.trim_margins(data, BYTES_PER_DOT_LINE, trim)
+        job = raster.encode(trimmed.data, BYTES_PER_DOT_LINE, mode)
+        LOGGER.debug('Printing in {} mode'.format(job.mode))
+        raster.send(device, ep_out, job)
+        LOGGER.debug('End print')
+        if trim != raster.TRIM_NONE and trimmed.lines_saved():
+            LOGGER.info('Trimmed {} dot lines, saving {:.1f}mm of paper and '
+                        '{:.2f}s of printing'.format(trimmed.lines_saved(),
+                                                     trimmed.mm_saved(),
+                                                     trimmed.seconds_saved()))
     finally:
         #ep_out.write(RESTORE_DARKNESS)
         pass
@@ -166,17 +158,26 @@ def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('filename', help='the image file to print',
                         nargs='?', default=default_file)
+    parser.add_argument('--mode', choices=raster.MODES,
+                        default=raster.MODE_AUTO,
+                        help='the graphics mode to print in')
+    parser.add_argument('--trim', choices=raster.TRIM_MODES,
+                        default=raster.TRIM_NONE,
+                        help='crop the blank margins before printing')
+    parser.add_argument('--max-pixels', type=int, default=MAX_INPUT_PIXELS,
+                        help='the largest image (in pixels) that will be '
+                        'decoded')
     return parser.parse_args()
 
-def load_image(filename):
-    '''Loads an image from the named png file.  Note that the extension must
-    be omitted from the parameter.
+def find_image(filename):
+    '''Returns the path to the image, looking alongside the script if the
+    file is not found relative to the current directory.
     '''
     if not os.path.isfile(filename):
         root_dir = os.path.dirname(os.path.abspath(inspect.stack()[-1][1]))
         filename = os.path.join(root_dir, filename)
-        
-    return Image.open(filename).convert('1')
+
+    return filename
 
 def main():        
     '''This is the main loop where arguments are parsed, connections
@@ -198,20 +199,13 @@ def main():
 
     # Print it out
     try:
-        im = Image.open(args.filename) # Open colour image
-     
-        # From http://stackoverflow.com/questions/273946/
-        #/how-do-i-resize-an-image-using-pil-and-maintain-its-aspect-ratio
-        wpercent = (DOTS_PER_LINE/float(im.size[0]))
-        hsize = int((float(im.size[1])*float(wpercent)))
-        im = im.resize((DOTS_PER_LINE,hsize), Image.ANTIALIAS)
-        im.save("temp.png") # Save temporary colour image
-        
-        im = load_image("temp.png") # Reopen image (with dither)
-        
-        print_data = convert_image(im)
+        # Scale and dither in memory, rather than through a temporary file
+        im = images.load_image(find_image(args.filename), DOTS_PER_LINE,
+                               args.max_pixels, LOGGER)
+
+        print_data = images.to_raster(im)
         usb_out.write(SET_LED_MODE + b'\x00')
-        print_image(device, usb_out, print_data)
+        print_image(device, usb_out, print_data, args.mode, args.trim)
         usb_out.write(FEED_PAST_CUTTER)
     finally:
         # Ensure the LED is not in test mode
@@ -18,9 +18,7 @@ Copyright (c) 2015, Able Systems Ltd. All rights reserved.
 
 import argparse
 import platform
-import struct
 import sys
-import time
 import os
 import inspect
 
@@ -31,21 +29,24 @@ import usb.util
 from PIL import Image, ImageDraw, ImageFont, ImageChops
 import qrcode
 
+# The raster encoder is shared with the other examples through the 'pipsta'
+# package that lives alongside the NFC example.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, 'nfc'))
+from pipsta.graphics import raster
+
 # USB specific constant definitions
 PIPSTA_USB_VENDOR_ID = 0x0483
 PIPSTA_USB_PRODUCT_ID = 0xA053
 
 # Printer commands
-SET_FONT_MODE_3 = b'\x1b!\x03'
 SET_LED_MODE = b'\x1bX\x2d'
 FEED_PAST_CUTTER = b'\n' * 5
-SELECT_SDL_GRAPHICS = b'\x1b*\x08'
 
 # Printer constants
 MAX_PRINTER_DOTS_PER_LINE = 384
 DOTS_PER_LINE = 384
 BYTES_PER_DOT_LINE = DOTS_PER_LINE/8
-USB_BUSY = 66
 
 DEFAULT_FONT = '/usr/share/fonts/truetype/freefont/FreeSansBold.ttf'
 
@@ -94,28 +95,16 @@ class Pipsta:
         if self.__bulk_out is None:
             raise IOError('Could not find an endpoint to print to')
 
-    def print_image(self, data):
-        '''Reads the data and sends it a dot line at once to the printer
+    def print_image(self, data, mode=raster.MODE_AUTO,
+                    trim=raster.TRIM_NONE):
+        '''Trims the blank margins from the data as requested, encodes it
+        in the graphics mode requested and sends it to the printer.  Returns
+        the TrimmedRaster so the caller can report what was saved.
         '''
-        self.write(SET_FONT_MODE_3)
-        cmd = struct.pack('3s2B', SELECT_SDL_GRAPHICS,
-                      (DOTS_PER_LINE / 8) & 0xFF,
-                      (DOTS_PER_LINE / 8) / 256)
-        # Arbitrary command length, set to minimum acceptable 24x8 dots
-        # this figure should give mm of print
-        lines = len(data)//BYTES_PER_DOT_LINE
-        start = 0
-        for line in range (0, lines):    
-            start = line * BYTES_PER_DOT_LINE
-            # intentionally +1 for slice operation below
-            end = start + BYTES_PER_DOT_LINE
-            # ...to end (end not included)            
-            self.write(b''.join([cmd, data[start:end]]))
-        
-            res = self.__device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
-            while res[0] == USB_BUSY:
-                time.sleep(0.01)
-                res = self.__device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
+        trimmed = raster.trim_margins(data, BYTES_PER_DOT_LINE, trim)
+        raster.send(self.__device, self.__bulk_out,
+                    raster.encode(trimmed.data, BYTES_PER_DOT_LINE, mode))
+        return trimmed
 
     def write(self, data):
         '''Send the supplied data to the pipsta'''
@@ -162,6 +151,12 @@ def parse_arguments():
                         nargs='?', default=default_pupil)
     parser.add_argument('msg', help='the message to the pupil',
                         nargs='?', default=default_msg)
+    parser.add_argument('--mode', choices=raster.MODES,
+                        default=raster.MODE_AUTO,
+                        help='the graphics mode to print in')
+    parser.add_argument('--trim', choices=raster.TRIM_MODES,
+                        default=raster.TRIM_NONE,
+                        help='crop the blank margins before printing')
     return parser.parse_args()
 
 def prepare_banknote_image():
@@ -243,7 +238,12 @@ def main():
     # statement so any printer errors (indicated by the LEDs) are not
     # masked by the flashing green state.
     if print_data:
-        pipsta.print_image(print_data)
+        trimmed = pipsta.print_image(print_data, args.mode, args.trim)
+        if args.trim != raster.TRIM_NONE and trimmed.lines_saved():
+            print('Trimmed {} dot lines, saving {:.1f}mm of paper and '
+                  '{:.2f}s of printing'.format(trimmed.lines_saved(),
+                                               trimmed.mm_saved(),
+                                               trimmed.seconds_saved()))
         pipsta.write(FEED_PAST_CUTTER)
         
 if __name__ == '__main__':
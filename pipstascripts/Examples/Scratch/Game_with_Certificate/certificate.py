@@ -16,7 +16,6 @@ import inspect
 import logging
 import os
 import platform
-import struct
 import sys
 
 from bitarray import bitarray
@@ -29,6 +28,12 @@ from PIL import ImageDraw
 from PIL import ImageFont
 import scratch
 
+# The raster encoder is shared with the other examples through the 'pipsta'
+# package that lives alongside the NFC example.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, os.pardir, 'nfc'))
+from pipsta.graphics import raster
+
 
 # USB specific constant definitions
 PIPSTA_USB_VENDOR_ID = 0x0483
@@ -42,10 +47,6 @@ SET_TEXT_DOUBLE_WIDTH = b'\x1b!\x20'
 SET_TEXT_UNDERLINED = b'\x1b!\x80'
 SET_TEXT_DOUBLE_HEIGHT_AND_WIDTH = b'\x1b!\x30'
 START_BARCODE_3OF9 = b'\x1dk\x04'
-SET_SPOOLING_MODE = b'\x1bL'
-UNSET_SPOOLING_MODE = b'\x1dL'
-SET_FONT_MODE_3 = b'\x1b!\x03'
-SELECT_32BIT_GRAPHICS = b'\x1b*\x20'
 
 MAX_PRINTER_DOTS_PER_LINE = 384
 
@@ -141,100 +142,40 @@ def validate_image(image):
            'image width exceeds paper width'
 
 def convert_image_to_printer_format(image):
-    '''Takes an image and converts the data into something that the Pipsta
-    printer recognises.
+    '''Takes an image and converts the data into a packed raster, one bit
+    per dot with a set bit being a black dot.
     '''
-    (width, height) = image.size
-    area = width * height
-
     # Convert to bitarray for manipulation
     imagebits = bitarray(image.getdata())
     # required as img has white = true (as RGB all = 255), and we are
     # rendering black dots
     # pylint: disable=E1101
     imagebits.invert()
+    return imagebits.tobytes()
 
-    printbits = bitarray(area)
-    # This loop converts standard image orientation to single dot graphics,
-    # populating printbits with imagebits
-    LOGGER.debug("Starting decode to print dots (size={})".format(image.size))
-    for image_bit_index in range(0, area):
-        width_times_byte_height = width << 3
-        width_times_bit_height = width_times_byte_height * 3
-        print_col = image_bit_index % width
-        char_row = image_bit_index // width_times_bit_height
-        print_byte = ((image_bit_index % width_times_bit_height) //
-                      (width_times_byte_height)) + (3 * print_col)
-        print_bit = (image_bit_index % width_times_byte_height) // width
-        print_bit_index = print_bit + (print_byte * 8) + \
-                          (char_row * width_times_bit_height)
-        printbits[print_bit_index] = imagebits[image_bit_index]
-
-    LOGGER.debug("Done decoding!")
-    return printbits
-
-def print_image(print_data, cr_period, ep_out):
-    '''Sends the prepared printer data to the printer.  If a CR need sending
-    inbetween each row then the cr_period is non-zero and is used to
-    indicate when to send the CR.
+def print_image(print_data, width, ep_out):
+    '''Sends the prepared raster to the printer as spooled 24 dot high
+    bands.  Each band that stops short of the paper width is ended with a
+    line feed, so graphics narrower than the paper still stack correctly.
     '''
     # Into contiguous graphics mode, if graphics are too large (causing
-    # corruption then remove the ESC,'L' and GS,'L' command pair.
+    # corruption then use raster.MODE_SDL instead.
+    job = raster.encode(print_data, width // 8, raster.MODE_BAND24)
+    LOGGER.debug("Sending {} bytes of graphics".format(job.wire_bytes()))
     try:
-        send_command(SET_SPOOLING_MODE, ep_out)
-        send_command(SET_FONT_MODE_3, ep_out)
-        print_bytes = print_data.tobytes()
-    
-        blocksize = 0xC0 * 6
-        n_1 = (blocksize // 0x18) & 0xFF  # number of 24 bit 'strips' to render
-        n_2 = (blocksize // 0x18) // 256
-        send_cr = False
-        
-        # Arbitrary command length, set to minimum acceptable 24x8 dots
-        for block in range(0, len(print_data) / blocksize):
-            # Process width into two byte variables
-            cmd = struct.pack('3s2B', SELECT_32BIT_GRAPHICS, n_1, n_2)
-            start = (block * blocksize) // 8
-            end = ((block + 1) * blocksize) // 8
-            
-            for byte_index in range(start, end):
-                cmd += print_bytes[byte_index]
-                if cr_period and byte_index % cr_period == 0:
-                    send_cr = True
-                else:
-                    send_cr = False
-                    
-            if send_cr == True:
-                send_command('\n', ep_out)
-                send_cr = False
-                
-            send_command(cmd, ep_out)
+        for data, dummy in job.transfers[:-1]:
+            send_command(data, ep_out)
     finally:
-        # Exit contiguous mode, see previous ESC,'L'
-        send_command(UNSET_SPOOLING_MODE, ep_out)
+        # Exit contiguous mode, the job ends with the GS,'L' that matches
+        # the ESC,'L' it started with
+        send_command(job.transfers[-1][0], ep_out)
         
 def send_image(image, ep_out):
     '''Performs some sanity checks and then sends the image supplied to the
     printer.
     '''
     validate_image(image)
-    (width, height) = image.size
-    
-    if(width < MAX_PRINTER_DOTS_PER_LINE and height > 24):
-        # Limitation of this approach: force Carriage Return for graphics >24
-        # dots high after their width. If you wish to use inline graphics (i.e.
-        # graphics succeeded by text), create separate 24 dot high graphics for
-        # each line. Fire CR after single character line graphics width.
-        cr_period = (width * 24 / 8) 
-    else:
-        cr_period = 0
-        
-    # This loop converts standard image orientation to single dot graphics,
-    # populating printbits with imagebits
-    sendable = convert_image_to_printer_format(image)
-    
-    # Into contiguous graphics mode
-    print_image(sendable, cr_period, ep_out)
+    print_image(convert_image_to_printer_format(image), image.size[0], ep_out)
 
 def listen(scratch_connection):
     '''Polls the scratch connection for a message, when one is received
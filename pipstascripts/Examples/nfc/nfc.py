@@ -5,17 +5,38 @@
 for an NFC demo.  The software enacts an operation based on the 
 credentials stored on the Pipsta.
 
+The printer stays connected (and its interface claimed) between checks,
+so each check for new credentials is a single short read rather than a
+reset and reconnection of the printer.  The printer is only reconnected
+after a dispatched job has used it, or if it stops answering.  It is
+checked straight away after it has dispatched a job, then every
+PRINT_JOB_POLL_PERIOD seconds, backing off to every --max-poll-period
+seconds while nothing is presented (see pipsta/web_print/poller.py).  If
+the printer has an interrupt IN endpoint the wait between checks is a read
+of it, so anything the printer signals there brings the next check
+forward.
+
+A tap is dispatched as soon as it is seen.  The time from the tap to its
+dispatch is logged for each tap, and its percentiles are printed when the
+script is stopped.  The tap itself cannot be seen, only the check that
+found it, so the time is measured from the check before, which found
+nothing, and is an upper bound.
+
 Copyright (c) 2014, Able Systems Ltd. All rights reserved.
 '''
 
 import argparse
+import array
+import collections
+import math
 import platform
 import signal
 import sys
-import time
 import struct
 import re
+import time
 import pipsta
+from pipsta.web_print import poller
 
 from usb.core import USBError
 import usb.backend.libusb0 as libusb0
@@ -44,18 +65,88 @@ PIPSTA_USB_PRODUCT_ID = 0xA053
 
 PRINTER_SERIAL_NUMBER_MAX_LENGTH = 10
 PRINTER_CREDENTIALS_MAX_LENGTH = 1024
-PRINT_JOB_POLL_PERIOD = 3
+# A check is one short read on the open connection, so it can be frequent
+PRINT_JOB_POLL_PERIOD = 0.2
+PRINT_JOB_MAX_POLL_PERIOD = 1
+CREDENTIALS_READ_TIMEOUT = 100 # ms
+RECONNECT_PERIOD = 1
+
+TAP_LATENCY_HISTORY = 1000
+TAP_LATENCY_PERCENTILES = [50, 95, 99]
+
+POLLER = None
+TAP_LATENCY = None
 
 def parse_arguments():
-    '''This scripts expects no arguments, offers help text and that is all.'''
+    '''Parses the longest wait between checks of the printer'''
     parser = argparse.ArgumentParser(description='Polls the print server')
+    parser.add_argument('--max-poll-period', type=float,
+                        default=PRINT_JOB_MAX_POLL_PERIOD,
+                        help='longest wait (seconds) between checks of the '
+                        'printer while no credentials are presented')
     return parser.parse_args()
 
+class TapLatency(object):
+    '''Keeps the times (seconds) from the most recent taps to their
+    dispatch.
+    '''
+    def __init__(self, history=TAP_LATENCY_HISTORY):
+        self.latencies = collections.deque(maxlen=history)
+        self.taps = 0
+
+    def record(self, seconds):
+        '''Records the latency of a tap'''
+        self.latencies.append(seconds)
+        self.taps += 1
+
+    def percentile(self, percent):
+        '''Returns the nearest rank percentile of the recorded latencies'''
+        ordered = sorted(self.latencies)
+        rank = int(math.ceil(percent / 100.0 * len(ordered)))
+        return ordered[max(rank - 1, 0)]
+
+    def stats(self):
+        '''Returns a one line summary of the tap latencies'''
+        if not self.latencies:
+            return 'taps=0'
+        return 'taps={} tap-to-dispatch {} max={:.0f}ms'.format(
+            self.taps, ' '.join('p{}={:.0f}ms'.format(
+                percent, self.percentile(percent) * 1000)
+                                 for percent in TAP_LATENCY_PERCENTILES),
+            max(self.latencies) * 1000)
+
+
+def endpoint_matcher(direction, endpoint_type):
+    '''Returns a find_descriptor() match for an endpoint'''
+    return lambda e: (
+        usb.util.endpoint_direction(e.bEndpointAddress) == direction and
+        usb.util.endpoint_type(e.bmAttributes) == endpoint_type)
+
 class PipstaPrinter():
 
     def __init__(self):
+        self.dev = None
         self.ep_in = None
         self.ep_out = None
+        self.ep_notify = None
+        self.polled = None
+        self.__buffer = array.array('B', [0]) * PRINTER_CREDENTIALS_MAX_LENGTH
+
+    @property
+    def connected(self):
+        '''True while the printer is connected'''
+        return self.dev is not None
+
+    def disconnect(self):
+        '''Releases the printer, for a dispatched job to use it or to
+        reconnect it.
+        '''
+        if self.dev is not None:
+            try:
+                usb.util.dispose_resources(self.dev)
+            except USBError as unused:
+                pass
+        self.dev = self.ep_in = self.ep_out = self.ep_notify = None
         
     def purge_usb_input(self):
         '''Removes any data from the usb input that may be left over from a
@@ -109,11 +200,33 @@ class PipstaPrinter():
         )
 
         self.ep_in = usb.util.find_descriptor(
-            intf,
-            custom_match=lambda e:
-            usb.util.endpoint_direction(e.bEndpointAddress) ==
-            usb.util.ENDPOINT_IN
-        )
+            intf, custom_match=endpoint_matcher(usb.util.ENDPOINT_IN,
+                                                usb.util.ENDPOINT_TYPE_BULK))
+
+        # The Pipsta only has bulk endpoints at present, an interrupt IN
+        # endpoint is used to wake the poll loop if the firmware has one
+        self.ep_notify = usb.util.find_descriptor(
+            intf, custom_match=endpoint_matcher(usb.util.ENDPOINT_IN,
+                                                usb.util.ENDPOINT_TYPE_INTR))
+
+        if self.ep_out is None or self.ep_in is None:
+            raise IOError('Could not find the printer endpoints')
+
+        self.dev = dev
+        self.polled = time.time()
+
+    def wait(self, timeout, printer_id=None):
+        '''Waits up to timeout seconds for the printer to signal on its
+        interrupt IN endpoint, as a listener for poller.wait().  Returns True
+        if the printer signalled.
+        '''
+        del printer_id
+        try:
+            self.ep_notify.read(self.ep_notify.wMaxPacketSize,
+                                max(int(timeout * 1000), 1))
+            return True
+        except USBError as unused:
+            return False
 
     def get_serial_number(self):
         '''Requests the printer ID from the printer and then returns the
@@ -128,17 +241,20 @@ class PipstaPrinter():
         '''Requests the NFC credentials from the printer and then returns the
         credentials.  If no credentials are loaded on the printer then a None
         is returned.
-        '''
-        result = None
 
+        The credentials are read into a buffer kept for the connection, with
+        a short timeout.  Errors other than a timeout are raised so the
+        printer can be reconnected.
+        '''
         try:
             self.ep_out.write(QUERY_CREDENTIALS)
-            result = self.ep_in.read(PRINTER_CREDENTIALS_MAX_LENGTH)
-        except usb.core.USBError as unused:
-            pass
-        except AttributeError as unused:
-            pass
+            length = self.ep_in.read(self.__buffer, CREDENTIALS_READ_TIMEOUT)
+        except USBError as err:
+            if 'timed out' not in str(err):
+                raise
+            length = 0
 
+        result = self.__buffer[:length].tostring()
         if not result or result[0] == '\0':
             return None
 
@@ -152,7 +268,7 @@ class PipstaPrinter():
                        """, re.VERBOSE) 
         results = [ 
             (m.group(1), m.group(2).strip('"')) 
-            for m in r.finditer(''.join([chr(x) for x in result]).strip()) 
+            for m in r.finditer(result.strip()) 
         ] 
         return dict(results)
 
@@ -172,18 +288,25 @@ class PipstaPrinter():
 def process_print_jobs(printer):
     '''Looks up any print jobs for the Pipsta connected and filters the
     jobs by the supplied credentials (if any exist) and finally prints any
-    outstanding jobs.
+    outstanding jobs.  Returns True if a job was sent to the printer.  The
+    printer is disconnected if it stops answering, or to dispatch a job.
     '''
-    credentials = None
-
     try:
         credentials = printer.get_credentials()
-    except USBError as unused:
-        #Failed to connect to a printer, abort
-        pass
-    
+        if credentials:
+            printer.erase_credentials()
+    except USBError as err:
+        # The printer has stopped answering, it is reconnected before the
+        # next check
+        print('Lost the printer - {}'.format(err))
+        printer.disconnect()
+        return False
+
+    # The credentials were not there when the printer was last checked
+    tapped = printer.polled
+    printer.polled = time.time()
+
     if credentials:
-        printer.erase_credentials()
         print(credentials)
 
         if 'method' in credentials.keys():
@@ -192,64 +315,80 @@ def process_print_jobs(printer):
             method_name = method_name[7:]
 
             if method_name in pipsta.__dict__.keys():
-                print('Sending job to printer')
                 module = pipsta.__dict__[method_name]
                 text   = credentials['field']
 
                 if 'send_to_printer' in dir(module):
+                    # The job connects to the printer itself
+                    printer.disconnect()
+                    latency = time.time() - tapped
+                    TAP_LATENCY.record(latency)
+                    print('Sending job to printer, {:.0f}ms after the '
+                          'tap'.format(latency * 1000))
                     while True:
                         try:
                             module.send_to_printer(text)
-                            return
+                            return True
                         except AttributeError as e:
                             print('AttributeError retry - {}'.format(e))
             else:
                 print('No recognised API')
+    return False
 
 def signal_handler(sig_int, frame):
     '''This signal handler negates the need for super user rights when ending
     this application using the 'kill' command.
     '''
     del sig_int, frame
+    if POLLER:
+        print(POLLER.stats())
+    if TAP_LATENCY:
+        print(TAP_LATENCY.stats())
     sys.exit()
 
-def connect_to_printer():
-    printer = PipstaPrinter()
-
+def connect_to_printer(printer):
+    '''Connects the printer and sets it up to read NFC credentials, trying
+    again every RECONNECT_PERIOD seconds until it succeeds.
+    '''
     while True:
         try:
             printer.connect()
             printer.set_nfc_settings(0x23)
-            return printer
-        except IOError as unused:
-            pass
-        finally:
-            pass
+            return
+        except (IOError, USBError) as unused:
+            printer.disconnect()
+            time.sleep(RECONNECT_PERIOD)
 
 
 def main():
     '''Connect to the printer and the database at regular intervals.  If there
     are any valid print jobs outstanding then print them off.
     '''
+    global POLLER, TAP_LATENCY # pylint: disable=W0603
+
     if platform.system() != 'Linux':
         sys.exit('This script has only been written for Linux')
     
-    parse_arguments()
+    args = parse_arguments()
         
     signal.signal(signal.SIGINT, signal_handler)
+    POLLER = poller.AdaptivePoller(PRINT_JOB_POLL_PERIOD, args.max_poll_period)
+    TAP_LATENCY = TapLatency()
+    printer = PipstaPrinter()
 
-    try:
-        process_print_jobs(connect_to_printer())
-    except AttributeError as unused:
-        pass # A mismatch of libusb seems to have a missing method
-
-    # go to sleep for a while, when awoken check for more work and sleep again
+    # check for work, then wait on the printer until the next check is due
     while True:
-        time.sleep(PRINT_JOB_POLL_PERIOD)
+        if not printer.connected:
+            connect_to_printer(printer)
+
         try:
-            process_print_jobs(connect_to_printer())
+            POLLER.record(process_print_jobs(printer))
         except AttributeError as unused:
-            pass # libusb issue, see above
+            # A mismatch of libusb seems to have a missing method
+            POLLER.record(False)
+
+        if printer.connected:
+            POLLER.wait(printer if printer.ep_notify else None)
 
 if __name__ == '__main__':
     main()
@@ -16,10 +16,9 @@ Copyright (c) 2014, Able Systems Ltd. All rights reserved.
 
 import argparse
 import logging
+import os
 import platform
-import struct
 import sys
-import time
 
 from bitarray import bitarray
 import usb.core
@@ -27,6 +26,12 @@ import usb.util
 
 from PIL import Image, ImageFont, ImageDraw
 
+# When run as a script the 'pipsta' package (two levels up) is not on the
+# path, add it so the shared raster encoder can be found.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, os.pardir))
+from pipsta.graphics import raster
+
 
 #import struct
 MAX_PRINTER_DOTS_PER_LINE = 384
@@ -37,16 +42,13 @@ PIPSTA_USB_VENDOR_ID = 0x0483
 PIPSTA_USB_PRODUCT_ID = 0xA053
 
 # Printer commands
-SET_FONT_MODE_3 = b'\x1b!\x03'
 SET_LED_MODE = b'\x1bX\x2d'
 FEED_PAST_TEARBAR = b'\n' * 5
-SELECT_SDL_GRAPHICS = b'\x1b*\x08'
 SET_DARKNESS_LIGHT = b'\x1bX\x42\x50'
 RESTORE_DARKNESS = b'\x1bX\x42\x55'
 
 DOTS_PER_LINE = 384
 BYTES_PER_DOT_LINE = DOTS_PER_LINE / 8
-USB_BUSY = 66
 DEFAULT_FONT = '/usr/share/fonts/truetype/freefont/FreeSansBold.ttf'
 
 def setup_logging():
@@ -114,32 +116,25 @@ def convert_image(image):
     return imagebits.tobytes()
 
 
-def print_image(device, ep_out, data):
-    '''Reads the bitarray data and send it (block-by-block) to the
+def print_image(device, ep_out, data, mode=raster.MODE_AUTO,
+                trim=raster.TRIM_NONE):
+    '''Trims the blank margins from the bitarray data as requested, encodes
+    it in the graphics mode requested and sends it (block-by-block) to the
     printer.
     '''
     LOGGER.debug('Start print')
     try:
         ep_out.write(SET_DARKNESS_LIGHT)
-        ep_out.write(SET_FONT_MODE_3)
-        cmd = struct.pack('3s2B', SELECT_SDL_GRAPHICS,
-                      (DOTS_PER_LINE / 8) & 0xFF,
-                      (DOTS_PER_LINE / 8) / 256)
-        # Arbitrary command length, set to minimum acceptable 24x8 dots
-        # this figure should give mm of print
-        lines = len(data)//BYTES_PER_DOT_LINE
-        start = 0
-        for line in range (0, lines):    
-            start = line * BYTES_PER_DOT_LINE
-            # intentionally +1 for slice operation below
-            end = start + BYTES_PER_DOT_LINE
-            # ...to end (end not included)            
-            ep_out.write(b''.join([cmd, data[start:end]]))
-            res = device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
-            while res[0] == USB_BUSY:
-                time.sleep(0.01)
-                res = device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
-                LOGGER.debug('End print')
+        trimmed = raster.trim_margins(data, BYTES_PER_DOT_LINE, trim)
+        job = raster.encode(trimmed.data, BYTES_PER_DOT_LINE, mode)
+        LOGGER.debug('Printing in {} mode'.format(job.mode))
+        raster.send(device, ep_out, job)
+        LOGGER.debug('End print')
+        if trim != raster.TRIM_NONE and trimmed.lines_saved():
+            LOGGER.info('Trimmed {} dot lines, saving {:.1f}mm of paper and '
+                        '{:.2f}s of printing'.format(trimmed.lines_saved(),
+                                                     trimmed.mm_saved(),
+                                                     trimmed.seconds_saved()))
     finally:
         ep_out.write(RESTORE_DARKNESS)
 
@@ -154,6 +149,12 @@ def parse_arguments():
     parser.add_argument('font', type=argparse.FileType('r'),
                         help='a truetype font file', nargs='?',
                         default=DEFAULT_FONT)
+    parser.add_argument('--mode', choices=raster.MODES,
+                        default=raster.MODE_AUTO,
+                        help='the graphics mode to print in')
+    parser.add_argument('--trim', choices=raster.TRIM_MODES,
+                        default=raster.TRIM_NONE,
+                        help='crop the blank margins before printing')
     return parser.parse_args()
 
 def get_best_fit_font(font_file_name, text_to_print):
@@ -189,17 +190,15 @@ def main():
         
     args = parse_arguments()
     setup_logging()
-    __send_to_printer(args.font.name, args.text)
+    __send_to_printer(args.font.name, args.text, args.mode, args.trim)
 
 def send_to_printer(text):
     '''This is the API call made by the nfc_server to perform a banner print'''
     __send_to_printer(DEFAULT_FONT, text)
 
-def __send_to_printer(font_name, text):
-    '''In here printer connections are established, fonts are loaded,
-    images are processed and the result is printed out.'''
-    usb_out, device = setup_usb()
-    usb_out.write(SET_LED_MODE + b'\x01')
+def create_banner_image(font_name, text):
+    '''Loads the best fitting font and draws the text as a banner that runs
+    along the length of the paper.'''
     font = get_best_fit_font(font_name, text)
     
     (image_width, __unused) = font.getsize(text)
@@ -215,16 +214,25 @@ def __send_to_printer(font_name, text):
     draw = ImageDraw.Draw(image)
     offset = font.getoffset(text)
     draw.text((-offset[0], -offset[1]), text, font=font, fill=1)
-    # Rotate the image to be oriented along the length of the paper
-    # with the left-most character being printed first
-    banner = image.transpose(Image.ROTATE_270)
     # Enable the following line if you want to stash/review the image 
     #image.save("temp.png")
 
+    # Rotate the image to be oriented along the length of the paper
+    # with the left-most character being printed first
+    return image.transpose(Image.ROTATE_270)
+
+def __send_to_printer(font_name, text, mode=raster.MODE_AUTO,
+                      trim=raster.TRIM_NONE):
+    '''In here printer connections are established, fonts are loaded,
+    images are processed and the result is printed out.'''
+    usb_out, device = setup_usb()
+    usb_out.write(SET_LED_MODE + b'\x01')
+    banner = create_banner_image(font_name, text)
+
     try:
         print_data = convert_image(banner)
         usb_out.write(SET_LED_MODE + b'\x00')
-        print_image(device, usb_out, print_data)
+        print_image(device, usb_out, print_data, mode, trim)
         usb_out.write(FEED_PAST_TEARBAR)
     finally:
         # Ensure the LED is not in test mode
@@ -0,0 +1,130 @@
+# benchmark.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Compares the graphics modes of the raster encoder on a corpus of typical
+print jobs.  For each job and mode the bytes put on the USB bus, the
+number of USB transfers (bulk writes plus status polls) and the print
+time estimated by the encoders printing model are reported, along with
+the mode MODE_AUTO would pick.  The 'sdl-full' rows show the original
+fixed width single dot line encoding for comparison.
+
+No printer is needed, the corpus is built from the images shipped with
+the examples, a couple of QR-Codes and a banner, each prepared the same
+way the examples prepare them.  Run from the 'nfc' folder with -
+
+    python -m pipsta.graphics.benchmark
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import argparse
+import os
+
+from PIL import Image, ImageChops
+
+from pipsta.banner_print import banner
+from pipsta.graphics import raster
+from pipsta.qr_print import qr
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            os.pardir, os.pardir, os.pardir)
+
+CORPUS_IMAGES = [
+    '8_Image_Print/image.png',
+    '8_Image_Print/scratch_logo.png',
+    '8_Image_Print/wide.png',
+    '8_Image_Print/programetc.png',
+    '9_Merit_Printer/banknote90a.png',
+    'Scratch/Game_with_Certificate/TopFlourish.png',
+    'Scratch/Game_with_Certificate/MidFlourish.png',
+    'Scratch/Game_with_Certificate/scratch.png',
+]
+
+CORPUS_QR_CODES = [
+    'http://www.pipsta.co.uk',
+    'This is a QR-Code generated by Pipsta.',
+]
+
+CORPUS_BANNER = 'My First Pipsta Banner!'
+
+def parse_arguments():
+    '''Parse the arguments passed to the benchmark, the only option is the
+    font used for the banner in the corpus.'''
+    parser = argparse.ArgumentParser(
+        description='Compares the graphics modes on a corpus of print jobs')
+    parser.add_argument('--font', default=banner.DEFAULT_FONT,
+                        help='a truetype font file for the banner job')
+    return parser.parse_args()
+
+def image_to_raster(image):
+    '''Scales the image to the paper width, dithers it and returns the
+    packed raster (as image_print.py prepares its images).'''
+    hsize = int(image.size[1] * raster.DOTS_PER_LINE / float(image.size[0]))
+    image = image.resize((raster.DOTS_PER_LINE, hsize), Image.ANTIALIAS)
+    return ImageChops.invert(image.convert('1')).tobytes()
+
+def load_corpus(font_name):
+    '''Returns a list of (name, packed raster) tuples for the benchmark.
+    The banner is left out if the font cannot be found.'''
+    corpus = []
+    for name in CORPUS_IMAGES:
+        image = Image.open(os.path.join(EXAMPLES_DIR, name))
+        corpus.append((name, image_to_raster(image)))
+
+    for text in CORPUS_QR_CODES:
+        corpus.append(('qr: ' + text[:24], qr.qr_raster(text)))
+
+    if os.path.isfile(font_name):
+        image = banner.create_banner_image(font_name, CORPUS_BANNER)
+        corpus.append(('banner: ' + CORPUS_BANNER, image.tobytes()))
+    else:
+        print('Font {} not found, the banner job is skipped'.format(font_name))
+
+    return corpus
+
+def main():
+    '''Encodes each job in the corpus in every mode and reports the cost of
+    sending and printing it.'''
+    args = parse_arguments()
+    row = '{:<40} {:<9} {:>6} {:>9} {:>9} {:>8}'
+    print(row.format('job', 'mode', 'lines', 'bytes', 'transfers', 'time/s'))
+
+    totals = {}
+    for name, data in load_corpus(args.font):
+        auto_mode = raster.encode(data).mode
+        jobs = [('sdl-full', raster.encode(data, mode=raster.MODE_SDL,
+                                           trim=False))]
+        jobs += [(mode, raster.encode(data, mode=mode))
+                 for mode in [raster.MODE_SDL, raster.MODE_BAND24]]
+
+        for label, job in jobs:
+            if label == auto_mode:
+                label += ' *'
+            print(row.format(name[:40], label, job.dot_lines,
+                             job.wire_bytes(), job.usb_transfers(),
+                             '{:.3f}'.format(job.estimated_time())))
+            total = totals.setdefault(label.split()[0], [0, 0, 0.0])
+            total[0] += job.wire_bytes()
+            total[1] += job.usb_transfers()
+            total[2] += job.estimated_time()
+
+        auto_total = totals.setdefault(raster.MODE_AUTO, [0, 0, 0.0])
+        auto_job = dict(jobs)[auto_mode]
+        auto_total[0] += auto_job.wire_bytes()
+        auto_total[1] += auto_job.usb_transfers()
+        auto_total[2] += auto_job.estimated_time()
+
+    print('')
+    for label in ['sdl-full', raster.MODE_SDL, raster.MODE_BAND24,
+                  raster.MODE_AUTO]:
+        (wire, transfers, seconds) = totals[label]
+        print(row.format('total', label, '', wire, transfers,
+                         '{:.3f}'.format(seconds)))
+    print('(* = mode chosen by {})'.format(raster.MODE_AUTO))
+
+if __name__ == '__main__':
+    main()
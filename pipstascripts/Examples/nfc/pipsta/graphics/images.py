@@ -0,0 +1,85 @@
+# images.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+The image loader shared by image_print.py and the web print job renderer.
+An image file is scaled to the paper width keeping its aspect ratio,
+dithered to 1 bit and converted to the packed raster the raster encoder
+(raster.py) takes -
+
+    image = images.load_image('photo.jpg')
+    data = images.to_raster(image)
+
+Photos are often far larger than the paper width, so an image is decoded
+as close to that width as the file format allows.  Image.open() only reads
+the header, so the size can be checked and, for JPEG files, a reduced scale
+decode (1/2, 1/4 or 1/8) asked for with draft() before any pixels are
+decoded.  Images that would decode to more than max_pixels pixels are
+refused with a ValueError, so a small file cannot expand into more memory
+than the Pi has.
+
+Note that dithering happens AFTER the resizing, as a resize of the dithered
+pixels gives rise to an inconsistent/mottled pattern.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import resource
+import time
+
+from bitarray import bitarray
+from PIL import Image
+
+from pipsta.graphics import raster
+
+# The largest image (in decoded pixels) that will be loaded, roughly a 24MP
+# photo.  JPEG files are checked after the reduced scale has been chosen.
+MAX_INPUT_PIXELS = 24 * 1000 * 1000
+
+
+def peak_memory_kb():
+    '''Returns the peak resident memory of the process in KB (Linux)'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def load_image(image_file, width=raster.DOTS_PER_LINE,
+               max_pixels=MAX_INPUT_PIXELS, logger=None):
+    '''Loads the image (a path or file object), scales it to width dots
+    keeping its aspect ratio and dithers it to 1 bit.  If a logger is given
+    the decode time and peak memory are logged to it.
+    '''
+    start = time.time()
+    image = Image.open(image_file)
+    (src_width, src_height) = image.size
+    height = max(int(src_height * width / float(src_width)), 1)
+
+    if image.format == 'JPEG':
+        # The JPEG library can decode straight to greyscale at 1/2, 1/4 or
+        # 1/8 scale, draft() picks the smallest scale no smaller than asked.
+        image.draft('L', (width, height))
+
+    if image.size[0] * image.size[1] > max_pixels:
+        raise ValueError('Image is {}x{} pixels, the limit is {}'.format(
+            image.size[0], image.size[1], max_pixels))
+
+    decoded_size = image.size
+    image = image.resize((width, height), Image.ANTIALIAS).convert('1')
+
+    if logger:
+        logger.info('Decoded {}x{} image at {}x{} in {:.3f}s, peak memory '
+                    '{}KB'.format(src_width, src_height, decoded_size[0],
+                                  decoded_size[1], time.time() - start,
+                                  peak_memory_kb()))
+    return image
+
+def to_raster(image):
+    '''Returns the packed raster of a 1 bit image, a set bit being a black
+    dot.
+    '''
+    # Pillow stores white as 1, the printer prints a dot for each 1
+    imagebits = bitarray(image.getdata(), endian='big')
+    # pylint: disable=E1101
+    imagebits.invert()
+    return imagebits.tobytes()
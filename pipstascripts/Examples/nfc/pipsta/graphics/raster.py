@@ -0,0 +1,301 @@
+# raster.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+The raster encoder shared by the graphics examples.  The examples all
+prepare their image as a packed 1-bit raster (one bit per dot, a set bit
+being a black dot, each dot line padded to a whole number of bytes) and
+this module turns that raster into the printer commands that render it.
+
+Two graphics modes are supported -
+
+    sdl     Single dot line graphics, one ESC,'*',8,nL,nH command per dot
+            line where nL,nH is the number of bytes of graphics that
+            follow.  The printer status is polled after every line.
+    band24  24 dot high bands sent as ESC,'*',32,nL,nH commands of 3 byte
+            columns (as used by certificate.py), spooled between ESC,'L'
+            and GS,'L'.
+
+In both modes the printer leaves the remainder of a line (or band) blank,
+so the blank bytes on the right hand side are not sent.  MODE_AUTO picks
+whichever mode the printing model below estimates to be quickest.
+
+Before encoding, trim_margins() can crop the blank dot lines from the top
+and bottom of a raster (TRIM_ROWS), and optionally re-centre what is left
+across the paper (TRIM_CENTRE), which saves paper and head time on images
+with wide white margins.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import struct
+import time
+
+from PIL import Image
+
+DOTS_PER_LINE = 384
+BYTES_PER_DOT_LINE = DOTS_PER_LINE // 8
+DOTS_PER_BAND = 24
+BYTES_PER_BAND_COLUMN = DOTS_PER_BAND // 8
+COLUMNS_PER_BAND_COMMAND = 48
+USB_BUSY = 66
+
+# Printer commands
+SET_FONT_MODE_3 = b'\x1b!\x03'
+SELECT_SDL_GRAPHICS = b'\x1b*\x08'
+SELECT_32BIT_GRAPHICS = b'\x1b*\x20'
+SET_SPOOLING_MODE = b'\x1bL'
+UNSET_SPOOLING_MODE = b'\x1dL'
+
+# A blank dot line must still be sent to feed the paper by one dot, the
+# shortest command the printer accepts carries a single byte of graphics.
+MIN_BYTES_PER_COMMAND = 1
+
+MODE_AUTO = 'auto'
+MODE_SDL = 'sdl'
+MODE_BAND24 = 'band24'
+MODES = [MODE_AUTO, MODE_SDL, MODE_BAND24]
+
+TRIM_NONE = 'none'
+TRIM_ROWS = 'rows'
+TRIM_CENTRE = 'centre'
+TRIM_MODES = [TRIM_NONE, TRIM_ROWS, TRIM_CENTRE]
+
+# The printing model used to compare the modes.  Each bulk write or status
+# poll costs at least one USB frame, the data itself moves at roughly the
+# full-speed bulk rate and the head feeds the paper at its nominal speed.
+# The printer buffers data, so sending and printing overlap.
+USB_TRANSFER_TIME = 0.001
+USB_BYTES_PER_SECOND = 1000000
+DOTS_PER_MM = 8
+HEAD_MM_PER_SECOND = 50
+
+
+class EncodedRaster(object):
+    '''The printer commands that render a raster in one of the graphics
+    modes, grouped into the USB bulk transfers used to send them.  Each
+    transfer is a (data, poll) pair, poll being set if the printer status
+    must be polled (and any busy state waited out) after the transfer.
+    '''
+    def __init__(self, mode, dot_lines):
+        self.mode = mode
+        self.dot_lines = dot_lines
+        self.transfers = []
+
+    def add(self, data, poll=False):
+        '''Appends a transfer to the encoded raster'''
+        self.transfers.append((data, poll))
+
+    def wire_bytes(self):
+        '''Returns the number of bytes put on the USB bus'''
+        return sum(len(data) for data, dummy in self.transfers)
+
+    def usb_transfers(self):
+        '''Returns the number of bulk writes plus status polls needed'''
+        return len(self.transfers) + \
+               sum(1 for dummy, poll in self.transfers if poll)
+
+    def host_time(self):
+        '''Returns the modelled time (seconds) spent on the USB bus'''
+        return self.usb_transfers() * USB_TRANSFER_TIME + \
+               self.wire_bytes() / float(USB_BYTES_PER_SECOND)
+
+    def head_time(self):
+        '''Returns the modelled time (seconds) the head takes to print'''
+        return self.dot_lines / float(DOTS_PER_MM * HEAD_MM_PER_SECOND)
+
+    def estimated_time(self):
+        '''Returns the modelled time (seconds) to print the raster'''
+        return max(self.host_time(), self.head_time())
+
+
+class TrimmedRaster(object):
+    '''A packed raster with its blank margins cropped, along with the
+    number of dot lines it had before trimming.
+    '''
+    def __init__(self, data, bytes_per_line, lines_before):
+        self.data = data
+        self.lines = len(data) // bytes_per_line
+        self.lines_before = lines_before
+
+    def lines_saved(self):
+        '''Returns the number of dot lines cropped from the raster'''
+        return self.lines_before - self.lines
+
+    def mm_saved(self):
+        '''Returns the length of paper (mm) saved by trimming'''
+        return self.lines_saved() / float(DOTS_PER_MM)
+
+    def seconds_saved(self):
+        '''Returns the modelled head time (seconds) saved by trimming'''
+        return self.mm_saved() / HEAD_MM_PER_SECOND
+
+
+def sdl_command(width):
+    '''Returns the ESC,'*',8 header for a dot line of width bytes'''
+    return struct.pack('3s2B', SELECT_SDL_GRAPHICS, width & 0xFF, width // 256)
+
+def band_command(columns):
+    '''Returns the ESC,'*',32 header for a band of the number of columns'''
+    return struct.pack('3s2B', SELECT_32BIT_GRAPHICS, columns & 0xFF,
+                       columns // 256)
+
+def line_widths(data, bytes_per_line=BYTES_PER_DOT_LINE):
+    '''Returns the number of bytes that must be sent for each dot line of
+    the raster, that is up to and including the last byte with any dots
+    set.  The scan for the last dot is done by bytes.rstrip() so the work
+    stays in C rather than looping over every byte in python.
+    '''
+    lines = len(data) // bytes_per_line
+    return [max(len(data[start:start + bytes_per_line].rstrip(b'\x00')),
+                MIN_BYTES_PER_COMMAND)
+            for start in range(0, lines * bytes_per_line, bytes_per_line)]
+
+def trim_margins(data, bytes_per_line=BYTES_PER_DOT_LINE, trim=TRIM_ROWS):
+    '''Crops the blank dot lines from the top and bottom of the packed
+    raster and returns a TrimmedRaster.  With TRIM_CENTRE the blank columns
+    are dropped too and the dots re-centred across the line.  The bounding
+    box of the dots is found by Pillow's getbbox() rather than by scanning
+    the raster in python.  A raster with no dots at all is left as it is.
+    '''
+    width = bytes_per_line * 8
+    lines = len(data) // bytes_per_line
+    data = data[:lines * bytes_per_line]
+
+    if trim == TRIM_NONE or lines == 0:
+        return TrimmedRaster(data, bytes_per_line, lines)
+    elif trim not in TRIM_MODES:
+        raise ValueError('Unknown trim mode: {}'.format(trim))
+
+    image = Image.frombytes('1', (width, lines), data)
+    bbox = image.getbbox()
+    if bbox is None:
+        return TrimmedRaster(data, bytes_per_line, lines)
+
+    (left, top, right, bottom) = bbox
+    if trim == TRIM_ROWS:
+        trimmed = data[top * bytes_per_line:bottom * bytes_per_line]
+    else:
+        centred = Image.new('1', (width, bottom - top), 0)
+        centred.paste(image.crop(bbox), ((width - (right - left)) // 2, 0))
+        trimmed = centred.tobytes()
+
+    return TrimmedRaster(trimmed, bytes_per_line, lines)
+
+def encode_sdl(data, bytes_per_line=BYTES_PER_DOT_LINE, trim=True):
+    '''Converts the packed raster into a list of SDL graphics commands, one
+    per dot line.  If trim is set then the trailing blank bytes of each
+    line are dropped and the shortest valid command is sent instead.
+    '''
+    lines = len(data) // bytes_per_line
+
+    if trim:
+        widths = line_widths(data, bytes_per_line)
+    else:
+        widths = [bytes_per_line] * lines
+
+    commands = []
+    for line, width in enumerate(widths):
+        start = line * bytes_per_line
+        commands.append(b''.join([sdl_command(width),
+                                  data[start:start + width]]))
+
+    return commands
+
+def to_bands(data, bytes_per_line=BYTES_PER_DOT_LINE):
+    '''Converts the packed raster into 24 dot high bands.  Each band is a
+    string of 3 byte columns, left to right, with the top dot of each
+    column in the most significant bit of its first byte.  The raster is
+    padded with blank lines to a whole number of bands, a raster with no
+    dot lines has no bands.
+
+    Rather than shuffle the bits in python the raster is loaded into a
+    Pillow image and transposed, so each column becomes a packed row.
+    '''
+    width = bytes_per_line * 8
+    lines = len(data) // bytes_per_line
+    if lines == 0:
+        return []
+
+    padded_lines = -(-lines // DOTS_PER_BAND) * DOTS_PER_BAND
+    padding = b'\x00' * ((padded_lines - lines) * bytes_per_line)
+
+    image = Image.frombytes('1', (width, padded_lines),
+                            data[:lines * bytes_per_line] + padding)
+    columns = image.transpose(Image.ROTATE_270).transpose(
+        Image.FLIP_LEFT_RIGHT)
+
+    return [columns.crop((top, 0, top + DOTS_PER_BAND, width)).tobytes()
+            for top in range(0, padded_lines, DOTS_PER_BAND)]
+
+def encode_band24(data, bytes_per_line=BYTES_PER_DOT_LINE, trim=True):
+    '''Encodes the raster as spooled 24 dot bands, one transfer per band.
+    Bands that stop short of the paper width (because the raster is
+    narrower than the paper, or trim has dropped the blank columns on the
+    right) are ended with a line feed, full width bands wrap by themselves.
+    '''
+    bands = to_bands(data, bytes_per_line)
+    job = EncodedRaster(MODE_BAND24, len(bands) * DOTS_PER_BAND)
+    job.add(SET_SPOOLING_MODE + SET_FONT_MODE_3)
+
+    for band in bands:
+        if trim:
+            columns = -(-len(band.rstrip(b'\x00')) // BYTES_PER_BAND_COLUMN)
+        else:
+            columns = bytes_per_line * 8
+
+        commands = []
+        for start in range(0, columns, COLUMNS_PER_BAND_COMMAND):
+            count = min(COLUMNS_PER_BAND_COMMAND, columns - start)
+            commands.append(band_command(count))
+            commands.append(band[start * BYTES_PER_BAND_COLUMN:
+                                 (start + count) * BYTES_PER_BAND_COLUMN])
+
+        if columns < DOTS_PER_LINE:
+            commands.append(b'\n')
+
+        job.add(b''.join(commands))
+
+    job.add(UNSET_SPOOLING_MODE)
+    return job
+
+def encode(data, bytes_per_line=BYTES_PER_DOT_LINE, mode=MODE_AUTO,
+           trim=True):
+    '''Encodes the packed raster in the requested graphics mode, returning
+    an EncodedRaster.  MODE_AUTO encodes the raster in each mode and keeps
+    the one the printing model estimates to be quickest (fewest bytes if
+    they tie).
+    '''
+    if mode == MODE_SDL:
+        job = EncodedRaster(MODE_SDL, len(data) // bytes_per_line)
+        job.add(SET_FONT_MODE_3)
+        for cmd in encode_sdl(data, bytes_per_line, trim):
+            job.add(cmd, poll=True)
+        return job
+    elif mode == MODE_BAND24:
+        return encode_band24(data, bytes_per_line, trim)
+    elif mode == MODE_AUTO:
+        return min([encode(data, bytes_per_line, MODE_SDL, trim),
+                    encode(data, bytes_per_line, MODE_BAND24, trim)],
+                   key=lambda job: (job.estimated_time(), job.wire_bytes()))
+
+    raise ValueError('Unknown graphics mode: {}'.format(mode))
+
+def wait_while_busy(device):
+    '''Polls the printer status until the printer is no longer busy'''
+    res = device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
+    while res[0] == USB_BUSY:
+        time.sleep(0.01)
+        res = device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
+
+def send(device, ep_out, job):
+    '''Writes the encoded raster to the printers bulk out endpoint, polling
+    the printer status wherever the encoding asks for it.
+    '''
+    for data, poll in job.transfers:
+        ep_out.write(data)
+        if poll:
+            wait_while_busy(device)
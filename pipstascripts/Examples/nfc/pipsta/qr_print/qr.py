@@ -6,32 +6,39 @@ purposes only. Able Systems takes no responsibility for any system
 implementations based on this code.
 
 This example's using a python library to generate a QR-Code and then printing
-this code to the PIPSTA connected to the Raspberry-Pi.  This code uses the
-Pillow library (see http://pillow.readthedocs.org/index.html).
+this code to the PIPSTA connected to the Raspberry-Pi.
+
+The QR-Code matrix is scaled up by a whole number of dots per module
+straight into the packed raster the printer needs, so the modules stay
+crisp rather than being resampled and re-dithered.  Matrices are cached by
+payload, so printing the same data again (e.g. repeated NFC taps) skips
+the encoding altogether.
 
 Copyright (c) 2014 Able Systems Limited. All rights reserved.
 '''
 
 import argparse
+from collections import OrderedDict
 import logging
+import os
 import platform
-import struct
 import sys
-import time
 
 from bitarray import bitarray
 import usb.core
 import usb.util
 
-from PIL import Image
 import qrcode
 
-MAX_PRINTER_DOTS_PER_LINE = 384
+# When run as a script the 'pipsta' package (two levels up) is not on the
+# path, add it so the shared raster encoder can be found.
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, os.pardir))
+from pipsta.graphics import raster
+
 LOGGER = logging.getLogger('qr.py')
-SET_FONT_MODE_3 = b'\x1b!\x03'
 SET_LED_MODE = b'\x1bX\x2d'
 FEED_PAST_TEARBAR = b'\n' * 5
-SELECT_SDL_GRAPHICS = b'\x1b*\x08'
 
 # USB specific constant definitions
 PIPSTA_USB_VENDOR_ID = 0x0483
@@ -40,7 +47,13 @@ PIPSTA_USB_PRODUCT_ID = 0xA053
 DOTS_PER_LINE = 384
 BYTES_PER_DOT_LINE = DOTS_PER_LINE / 8
 
-USB_BUSY = 66
+# QR-Code constants.  The default error correction matches that used by
+# qrcode.make(), QR-Codes fitted to a height use the lowest level.
+QR_BORDER = 4
+MIN_DOTS_PER_MODULE = 3
+MATRIX_CACHE_SIZE = 32
+DEFAULT_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_M
+FIT_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_L
 
 
 def parse_arguments():
@@ -50,6 +63,12 @@ def parse_arguments():
                     nargs='?', default='Some example text')
     parser.add_argument('--file', type=argparse.FileType('rb'),
                         help='a file to convert to barcode')
+    parser.add_argument('--mode', choices=raster.MODES,
+                        default=raster.MODE_AUTO,
+                        help='the graphics mode to print in')
+    parser.add_argument('--height', type=int,
+                        help='the most dot lines the QR-Code may use, it '
+                        'is made as small as it can be to suit')
     return parser.parse_args()
 
 
@@ -115,56 +134,104 @@ def setup_usb():
     return ep_out, dev
 
 
-def pad_image(image):
-    '''Scale image to cover whole width whilst ensuring the aspect ratio is
-    maintained.
-    '''
-    ratio = (384000 / image.size[0])
-    # Fill width, at nearest 24 dot height to give closest aspect ratio
-    new_size = ((384, ((image.size[1] * ratio) / 1000 // 24) * 24))
-    return image.resize(new_size, Image.ANTIALIAS)
-
-def validate_image(image):
-    '''Ensures the image dimensions are compatible with the printer.'''
-    assert image.size[0] % 8 == 0, 'Width must be divisible by 8.'
-    assert image.size[1] % 24 == 0, 'Height must be divisible by 24.'
-    assert image.size[0] <= MAX_PRINTER_DOTS_PER_LINE, \
-           'QR-Code width exceeds paper width'
-
-def convert_image_to_printer_format(image):
-    '''Takes the bitmap and converts it to PIPSTA 24-bit image format'''
-    imagebits = bitarray(image.getdata(), endian='big')
-    LOGGER.info("Done decoding!")
-    # pylint: disable=E1101
-    imagebits.invert()
-    return imagebits.tobytes()
-
-def print_image(ep_out, device, data):
-    '''Sends the prepared printer data to the printer.  If a CR need sending
-    inbetween each row then the cr_period is non-zero and is used to
-    indicate when to send the CR
+class MatrixCache(object):
+    '''A least recently used cache of QR-Code matrices, keyed by the data
+    encoded and the error correction level.'''
+    def __init__(self, size):
+        self.__size = size
+        self.__matrices = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, data, error_correction):
+        '''Returns the matrix for the data, encoding it only if it is not
+        already in the cache.  A DataOverflowError is raised if the data
+        will not fit in a QR-Code at the error correction level.'''
+        key = (data, error_correction)
+
+        try:
+            matrix = self.__matrices.pop(key)
+            self.hits += 1
+        except KeyError:
+            matrix = make_matrix(data, error_correction)
+            self.misses += 1
+            if len(self.__matrices) >= self.__size:
+                self.__matrices.popitem(last=False)
+
+        # (Re)inserting the key makes it the most recently used
+        self.__matrices[key] = matrix
+        return matrix
+
+MATRIX_CACHE = MatrixCache(MATRIX_CACHE_SIZE)
+
+def make_matrix(data, error_correction):
+    '''Encodes the data as a QR-Code using the smallest version that will
+    hold it.  Returns the matrix (including the border) as a list of rows
+    of booleans, True being a dark module.'''
+    code = qrcode.QRCode(error_correction=error_correction, border=QR_BORDER)
+    code.add_data(data)
+    code.make(fit=True)
+    return code.get_matrix()
+
+def fit_matrix(data, max_height):
+    '''Returns the matrix for a QR-Code of the data to fit max_height dot
+    lines.  The lowest error correction level gives the smallest QR-Code,
+    which leaves the most dots for each module, so a warning is logged if
+    even that does not fit at the minimum module size.'''
+    matrix = MATRIX_CACHE.get(data, FIT_ERROR_CORRECTION)
+    if len(matrix) * MIN_DOTS_PER_MODULE > max_height:
+        LOGGER.warning('QR-Code does not fit in {} dot lines'.format(
+            max_height))
+    return matrix
+
+def matrix_to_raster(matrix, max_height=None):
+    '''Scales the matrix by the largest whole number of dots per module
+    that fits the paper width (and max_height if supplied) and returns it,
+    centred on the paper, as a packed raster.'''
+    modules = len(matrix)
+    dots_per_module = DOTS_PER_LINE // modules
+    if max_height:
+        dots_per_module = min(dots_per_module, max_height // modules)
+    dots_per_module = max(dots_per_module, 1)
+
+    left_margin = (DOTS_PER_LINE - modules * dots_per_module) // 2
+    right_margin = DOTS_PER_LINE - modules * dots_per_module - left_margin
+    dark = bitarray([True] * dots_per_module, endian='big')
+    light = bitarray([False] * dots_per_module, endian='big')
+
+    # Each row of modules is built once as a dot line and then repeated
+    # for the height of the module
+    lines = []
+    for row in matrix:
+        line = bitarray([False] * left_margin, endian='big')
+        for module in row:
+            line.extend(dark if module else light)
+        line.extend([False] * right_margin)
+        lines.append(line.tobytes() * dots_per_module)
+
+    return b''.join(lines)
+
+def qr_raster(data, max_height=None):
+    '''Returns the packed raster for a QR-Code of the data.  If max_height
+    is given the QR-Code is fitted to that many dot lines (see
+    fit_matrix()), otherwise the qrcode library default is used.'''
+    if max_height:
+        matrix = fit_matrix(data, max_height)
+    else:
+        matrix = MATRIX_CACHE.get(data, DEFAULT_ERROR_CORRECTION)
+
+    LOGGER.debug('QR-Code matrix cache hits={} misses={}'.format(
+        MATRIX_CACHE.hits, MATRIX_CACHE.misses))
+    return matrix_to_raster(matrix, max_height)
+
+def print_image(ep_out, device, data, mode=raster.MODE_AUTO):
+    '''Sends the prepared printer data to the printer in the graphics mode
+    requested.  The blank bytes to the right of the QR-Code are not sent,
+    the left margin is.
     '''
-    # Into contiguous graphics mode
-    ep_out.write(SET_FONT_MODE_3)
-    cmd = struct.pack('3s2B', SELECT_SDL_GRAPHICS,
-                      (DOTS_PER_LINE / 8) & 0xFF,
-                      (DOTS_PER_LINE / 8) / 256)
-
-    # Arbitrary command length, set to minimum acceptable 24x8 dots this figure
-    # should give mm of print
-    lines = len(data)//BYTES_PER_DOT_LINE
-    start = 0
-    
-    for line in range (0, lines):    
-        start = line * BYTES_PER_DOT_LINE
-        # intentionally +1 for slice operation below
-        end = start + BYTES_PER_DOT_LINE
-        # ...to end (end not included)            
-        ep_out.write(b''.join([cmd, data[start:end]]))
-        res = device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
-        while res[0] == USB_BUSY:
-            time.sleep(0.01)
-            res = device.ctrl_transfer(0xC0, 0x0E, 0x020E, 0, 2)
+    job = raster.encode(data, BYTES_PER_DOT_LINE, mode)
+    LOGGER.debug('Printing in {} mode'.format(job.mode))
+    raster.send(device, ep_out, job)
 
 def main():
     '''The main function of the script.  This creates a QR code and then prints
@@ -189,20 +256,20 @@ def main():
     else:
         data = args.text
 
-    send_to_printer([data])
+    send_to_printer(data, args.mode, args.height)
 
-def send_to_printer(data):
+def send_to_printer(data, mode=raster.MODE_AUTO, max_height=None):
     '''Opens a USB connection to the printer, prepares an image of the QRCode
-    and sends it to the printer.'''
+    and sends it to the printer.  This is also the API call made by the
+    nfc_server to perform a QR-Code print.'''
     print('qr.py - ' + str(data))
     usb_out, device = setup_usb()
     
     try:
         usb_out.write(SET_LED_MODE + b'\x01')
-        image = pad_image(qrcode.make(data))
-        validate_image(image)
+        print_data = qr_raster(data, max_height)
         usb_out.write(SET_LED_MODE + b'\x00')
-        print_image(usb_out, device, convert_image_to_printer_format(image))
+        print_image(usb_out, device, print_data, mode)
         usb_out.write(FEED_PAST_TEARBAR)
     except qrcode.exceptions.DataOverflowError as dummy:
         LOGGER.error("Too much data was provided for printing")
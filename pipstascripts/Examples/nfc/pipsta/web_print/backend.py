@@ -0,0 +1,488 @@
+# backend.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+The print job queue used by WebSendMany.py and WebPrintMany.py, held in
+either MySQL or SQLite.
+
+MySQLBackend is the queue on the web hosted MySQL database the examples
+are written for, created and upgraded by schema.py.  SQLiteBackend keeps
+the same queue in an SQLite database file, which it creates, so the
+examples (and the benchmarks) can be run on one machine without a MySQL
+server: point WebSendMany.py and WebPrintMany.py at the same file with
+--sqlite.
+
+Both give the same operations, each borrowing a connection from the
+backends connection pool (see pool.py) for its own transaction -
+
+    queue = backend.SQLiteBackend('print_jobs.db')
+    group_id = queue.submit(job_file, ['000000001'])
+    for (job_id, payload_format, chunked, priority, group_id,
+         credentials) in queue.outstanding_jobs('000000001', None, token):
+        for piece in queue.job_pieces(job_id, chunked):
+            ...
+    queue.mark_printed('000000001', [job_id])
+    for (printer_id, printed, claimed) in queue.job_status(group_id):
+        ...
+
+submit_many() queues a batch of jobs in a single transaction, which saves a
+commit (and, for SQLite, a sync to disk) for each job.
+
+Given a print token (see claims.py) outstanding_jobs() first claims the
+printers outstanding jobs that no one else holds a live claim on, which
+renews the claims the token already holds, and then only returns the jobs
+claimed with the token.  The claims are kept in printer_job_claims, as
+printer_jobs cannot gain columns (see schema.py).
+
+The credentials a printer holds are kept in printer_credentials and joined
+to the jobs by the job queries, so the statements are the same whatever
+(and however many) credentials the printer holds, and the database can
+cache them.  The backend remembers the credentials it last stored for each
+printer and only rewrites them when the printer's credentials change.
+
+Database errors are raised as they are, catch queue.errors.  MySQLdb is
+only imported by MySQLBackend, so the SQLite queue does not need it.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import sqlite3
+
+from pipsta.web_print import claims, fetch, payload, pool, schema, submit
+
+# The printers credentials joined to the job queries, and the filter appended
+# to them.  A printer holding credentials gets the jobs sent with one of
+# them, a printer holding none gets the jobs sent without credentials.
+CREDENTIALS_JOIN = '''
+LEFT JOIN printer_credentials AS pc
+    ON pc.printer_id = j.printer_id AND pc.credential = j.credentials'''
+CREDENTIALS_MATCH = '''(pc.credential IS NOT NULL
+    OR (j.credentials IS NULL AND NOT EXISTS (
+        SELECT * FROM printer_credentials AS held
+        WHERE held.printer_id = j.printer_id)))'''
+
+
+class Backend(object):
+    '''A print job queue in a database.  Subclasses supply the connection,
+    the statements for their database and the parameter placeholder.
+    '''
+    placeholder = '%s'
+    errors = ()
+    lost_errors = ()
+
+    JOB_TABLE = 'printdata_v2'
+
+    SELECT_JOBS = None
+    CLAIM_JOBS = None
+    CLAIM_CONFLICT = ''
+    SELECT_CLAIMED_JOBS = None
+    MARK_PRINTED = None
+    DELETE_CREDENTIALS = None
+    INSERT_CREDENTIAL = None
+    SELECT_STATUS = None
+    NEXT_GROUP_ID = None
+    INSERT_PRINTER = None
+    INSERT_JOB = None
+    APPEND_PAYLOAD = None
+    INSERT_CHUNK = None
+    SELECT_PAYLOAD = None
+    SELECT_CHUNKS = None
+
+    def __init__(self, size=pool.DEFAULT_POOL_SIZE):
+        self.pool = pool.ConnectionPool(self.connect, size,
+                                        lost_errors=self.lost_errors)
+        self.__credentials = {}
+        self.credential_updates = 0
+
+    def connect(self):
+        '''Returns a new connection to the database'''
+        raise NotImplementedError
+
+    def upgrade(self, conn):
+        '''Creates or upgrades the queue tables'''
+        raise NotImplementedError
+
+    def streaming_cursor(self, conn):
+        '''Returns a cursor that reads rows from the database as they are
+        fetched.
+        '''
+        return conn.cursor()
+
+    def submit(self, job_file, printer_ids, credentials=None,
+               payload_format=payload.FORMAT_RAW, priority=0):
+        '''Queues the contents of the file as a job for each of the printers
+        and returns its group id.  The file is stored a chunk at a time, in
+        chunk rows or, for hex jobs, in the job row.
+        '''
+        return self.submit_many([(job_file, printer_ids, credentials,
+                                  payload_format, priority)])[0]
+
+    def submit_many(self, jobs):
+        '''Queues a list of jobs, each given as the arguments to submit(), in
+        one transaction and returns their group ids.
+        '''
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            group_ids = [self.__store(cursor, *job) for job in jobs]
+            cursor.close()
+        return group_ids
+
+    def __store(self, cursor, job_file, printer_ids, credentials=None,
+                payload_format=payload.FORMAT_RAW, priority=0):
+        '''Inserts a job in the callers transaction, returns its group id'''
+        chunked = payload_format != payload.FORMAT_HEX
+        self.pool.execute(cursor, self.NEXT_GROUP_ID)
+        group_id = cursor.lastrowid
+
+        cursor.executemany(self.INSERT_PRINTER,
+                           [(group_id, printer_id, credentials)
+                            for printer_id in printer_ids])
+
+        self.pool.execute(cursor, self.INSERT_JOB,
+                          (group_id, payload_format, chunked, priority))
+        job_id = cursor.lastrowid
+        submit.store_payload(
+            cursor, self.JOB_TABLE, job_id, job_file, chunked,
+            payload_format, self.binary, self.pool.execute,
+            self.INSERT_CHUNK if chunked else self.APPEND_PAYLOAD)
+        return group_id
+
+    def outstanding_jobs(self, printer_id, credentials, token=None,
+                         lease=claims.DEFAULT_LEASE):
+        '''Returns the jobs still to print on the printer, sent with one of
+        its credentials or, if it has none, sent without credentials, as a
+        list of (job_id, payload_format, chunked, priority, group_id,
+        credentials).  Given a print token the jobs are claimed for lease
+        seconds first, in the same transaction, and only the jobs claimed
+        with the token are returned.  The printers credentials are stored
+        first if they have changed.
+        '''
+        credentials = frozenset(credentials or ())
+        changed = self.__credentials.get(printer_id) != credentials
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if changed:
+                self.__store_credentials(cursor, printer_id, credentials)
+
+            if token is None:
+                self.pool.execute(cursor, self.SELECT_JOBS + CREDENTIALS_MATCH,
+                                  (printer_id,))
+            else:
+                self.pool.execute(cursor, self.CLAIM_JOBS + CREDENTIALS_MATCH +
+                                  self.CLAIM_CONFLICT,
+                                  (token, lease, printer_id, token))
+                self.pool.execute(cursor,
+                                  self.SELECT_CLAIMED_JOBS + CREDENTIALS_MATCH,
+                                  (printer_id, token))
+            rows = cursor.fetchall()
+            cursor.close()
+
+        # Only once they are committed
+        if changed:
+            self.__credentials[printer_id] = credentials
+            self.credential_updates += 1
+        return rows
+
+    def __store_credentials(self, cursor, printer_id, credentials):
+        '''Replaces the credentials stored for the printer, in the callers
+        transaction.
+        '''
+        self.pool.execute(cursor, self.DELETE_CREDENTIALS, (printer_id,))
+        if credentials:
+            cursor.executemany(self.INSERT_CREDENTIAL,
+                               [(printer_id, credential)
+                                for credential in sorted(credentials)])
+
+    def job_pieces(self, job_id, chunked):
+        '''Generates the stored payload of a job a piece at a time, as it is
+        read from the database.
+        '''
+        with self.pool.connection() as conn:
+            cursor = self.streaming_cursor(conn)
+            try:
+                if chunked:
+                    statement = self.SELECT_CHUNKS
+                else:
+                    statement = self.SELECT_PAYLOAD
+                self.pool.execute(cursor, statement, (job_id,))
+                for row in iter(cursor.fetchone, None):
+                    yield row[0]
+            finally:
+                cursor.close()
+
+    def mark_printed(self, printer_id, job_ids):
+        '''Marks the jobs printed by the printer in a single statement'''
+        if not job_ids:
+            return
+        statement = self.MARK_PRINTED.format(
+            ','.join([self.placeholder] * len(job_ids)))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            self.pool.execute(cursor, statement,
+                              (printer_id,) + tuple(job_ids))
+            cursor.close()
+
+    def job_status(self, group_id):
+        '''Returns the state of a job group on each of its printers, as a
+        list of (printer_id, printed, claimed), claimed being true while a
+        printer holds a live claim on the job.  The list is empty if there
+        is no such group.
+        '''
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            self.pool.execute(cursor, self.SELECT_STATUS, (group_id,))
+            rows = [(printer_id, bool(printed), bool(claimed))
+                    for (printer_id, printed, claimed) in cursor.fetchall()]
+            cursor.close()
+        return rows
+
+    @staticmethod
+    def binary(data):
+        '''Wraps a payload for the database module'''
+        return data
+
+
+class MySQLBackend(Backend):
+    '''The print job queue in MySQL, connect_args are passed to
+    MySQLdb.connect().
+    '''
+    SELECT_JOBS = '''
+SELECT job_id, payload_format, chunked, priority, print_group_id, credentials
+FROM printdata_v2 AS d
+INNER JOIN printer_jobs AS j ON d.print_group_id = j.group_id''' + \
+        CREDENTIALS_JOIN + '''
+WHERE j.printer_id = %s AND printed = FALSE AND '''
+    CLAIM_JOBS = '''
+INSERT INTO printer_job_claims
+    (group_id, printer_id, claim_token, claim_expires)
+SELECT j.group_id, j.printer_id, %s, NOW() + INTERVAL %s SECOND
+FROM printer_jobs AS j
+LEFT JOIN printer_job_claims AS c
+    ON c.group_id = j.group_id AND c.printer_id = j.printer_id''' + \
+        CREDENTIALS_JOIN + '''
+WHERE j.printer_id = %s AND j.printed = FALSE
+    AND (c.claim_token IS NULL OR c.claim_token = %s
+         OR c.claim_expires < NOW())
+    AND '''
+    CLAIM_CONFLICT = '''
+ON DUPLICATE KEY UPDATE claim_token = VALUES(claim_token),
+    claim_expires = VALUES(claim_expires)'''
+    SELECT_CLAIMED_JOBS = '''
+SELECT job_id, payload_format, chunked, priority, print_group_id, credentials
+FROM printdata_v2 AS d
+INNER JOIN printer_jobs AS j ON d.print_group_id = j.group_id
+INNER JOIN printer_job_claims AS c
+    ON c.group_id = j.group_id AND c.printer_id = j.printer_id''' + \
+        CREDENTIALS_JOIN + '''
+WHERE j.printer_id = %s AND printed = FALSE AND claim_token = %s AND '''
+    MARK_PRINTED = '''
+UPDATE printdata_v2 AS d
+INNER JOIN printer_jobs AS j ON d.print_group_id = j.group_id
+SET printed = TRUE
+WHERE printer_id = %s AND printed = FALSE AND job_id IN ({})'''
+    DELETE_CREDENTIALS = '''
+DELETE FROM printer_credentials WHERE printer_id = %s'''
+    INSERT_CREDENTIAL = '''
+INSERT INTO printer_credentials (printer_id, credential) VALUES (%s, %s)'''
+    SELECT_STATUS = '''
+SELECT j.printer_id, j.printed, COALESCE(c.claim_expires > NOW(), FALSE)
+FROM printer_jobs AS j
+LEFT JOIN printer_job_claims AS c
+    ON c.group_id = j.group_id AND c.printer_id = j.printer_id
+WHERE j.group_id = %s
+ORDER BY j.printer_id'''
+    # MySQL has no sequences, so print_group_seq holds the last group id
+    # used in a single row.  LAST_INSERT_ID(expr) both increments it
+    # atomically and hands the new value back as the statement's insert id.
+    NEXT_GROUP_ID = '''
+UPDATE print_group_seq SET group_id = LAST_INSERT_ID(group_id + 1)'''
+    INSERT_PRINTER = '''
+INSERT INTO printer_jobs (group_id, printer_id, printed, credentials)
+VALUES (%s, %s, FALSE, %s)'''
+    INSERT_JOB = '''
+INSERT INTO printdata_v2
+    (print_data, print_group_id, payload_format, chunked, priority)
+VALUES ('', %s, %s, %s, %s)'''
+    APPEND_PAYLOAD = submit.APPEND_PAYLOAD.format(Backend.JOB_TABLE)
+    INSERT_CHUNK = submit.INSERT_CHUNK.format(Backend.JOB_TABLE)
+    SELECT_PAYLOAD = fetch.SELECT_PAYLOAD.format('printdata_v2')
+    SELECT_CHUNKS = fetch.SELECT_CHUNKS.format('printdata_v2')
+
+    def __init__(self, connect_args, size=pool.DEFAULT_POOL_SIZE):
+        import MySQLdb
+        import MySQLdb.cursors
+        self.__mysqldb = MySQLdb
+        self.__connect_args = connect_args
+        self.errors = (MySQLdb.Error,)
+        self.lost_errors = (MySQLdb.OperationalError,)
+        Backend.__init__(self, size)
+
+    def connect(self):
+        '''Returns a new connection to MySQL'''
+        # pylint: disable=W0142
+        return self.__mysqldb.connect(**self.__connect_args)
+
+    def upgrade(self, conn):
+        '''Applies any schema migrations the database is missing'''
+        return schema.upgrade(conn)
+
+    def streaming_cursor(self, conn):
+        '''Returns a server side cursor'''
+        return conn.cursor(self.__mysqldb.cursors.SSCursor)
+
+    def binary(self, data):
+        '''Wraps a payload as a MySQL binary string'''
+        return self.__mysqldb.Binary(data)
+
+
+class SQLiteBackend(Backend):
+    '''The print job queue in an SQLite database file, which is created if
+    need be.  The file is in WAL mode so the printers can read the queue
+    while jobs are added.
+    '''
+    placeholder = '?'
+    errors = (sqlite3.Error,)
+    lost_errors = ()
+
+    # Booleans are written as 1 and 0, older versions of SQLite have no
+    # TRUE and FALSE.
+    CREATE_TABLES = [
+        '''
+CREATE TABLE IF NOT EXISTS print_group_seq (
+    group_id INTEGER PRIMARY KEY AUTOINCREMENT
+)''',
+        '''
+CREATE TABLE IF NOT EXISTS printer_jobs (
+    group_id INTEGER NOT NULL,
+    printer_id TEXT NOT NULL,
+    printed INTEGER NOT NULL DEFAULT 0,
+    credentials TEXT NULL
+)''',
+        '''
+CREATE TABLE IF NOT EXISTS printdata_v2 (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    print_data BLOB NOT NULL,
+    print_group_id INTEGER NOT NULL,
+    payload_format INTEGER NOT NULL DEFAULT 0,
+    chunked INTEGER NOT NULL DEFAULT 0,
+    priority INTEGER NOT NULL DEFAULT 0
+)''',
+        '''
+CREATE TABLE IF NOT EXISTS printdata_v2_chunks (
+    job_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    chunk BLOB NOT NULL,
+    PRIMARY KEY (job_id, seq)
+)''',
+        '''
+CREATE TABLE IF NOT EXISTS printer_job_claims (
+    group_id INTEGER NOT NULL,
+    printer_id TEXT NOT NULL,
+    claim_token TEXT NOT NULL,
+    claim_expires TEXT NOT NULL,
+    PRIMARY KEY (group_id, printer_id)
+)''',
+        '''
+CREATE TABLE IF NOT EXISTS printer_credentials (
+    printer_id TEXT NOT NULL,
+    credential TEXT NOT NULL,
+    PRIMARY KEY (printer_id, credential)
+)''',
+    ] + ['CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(*index)
+         for index in schema.INDEXES if index[1] != 'printdata']
+
+    SELECT_JOBS = '''
+SELECT job_id, payload_format, chunked, priority, print_group_id, credentials
+FROM printdata_v2 AS d
+INNER JOIN printer_jobs AS j ON d.print_group_id = j.group_id''' + \
+        CREDENTIALS_JOIN + '''
+WHERE j.printer_id = ? AND printed = 0 AND '''
+    # Times are kept as SQLite datetime() strings, which sort in time order.
+    # INSERT OR REPLACE takes the place of ON DUPLICATE KEY UPDATE.
+    CLAIM_JOBS = '''
+INSERT OR REPLACE INTO printer_job_claims
+    (group_id, printer_id, claim_token, claim_expires)
+SELECT j.group_id, j.printer_id, ?, datetime('now', '+' || ? || ' seconds')
+FROM printer_jobs AS j
+LEFT JOIN printer_job_claims AS c
+    ON c.group_id = j.group_id AND c.printer_id = j.printer_id''' + \
+        CREDENTIALS_JOIN + '''
+WHERE j.printer_id = ? AND j.printed = 0
+    AND (c.claim_token IS NULL OR c.claim_token = ?
+         OR c.claim_expires < datetime('now'))
+    AND '''
+    CLAIM_CONFLICT = ''
+    SELECT_CLAIMED_JOBS = '''
+SELECT job_id, payload_format, chunked, priority, print_group_id, credentials
+FROM printdata_v2 AS d
+INNER JOIN printer_jobs AS j ON d.print_group_id = j.group_id
+INNER JOIN printer_job_claims AS c
+    ON c.group_id = j.group_id AND c.printer_id = j.printer_id''' + \
+        CREDENTIALS_JOIN + '''
+WHERE j.printer_id = ? AND printed = 0 AND claim_token = ? AND '''
+    MARK_PRINTED = '''
+UPDATE printer_jobs
+SET printed = 1
+WHERE printer_id = ? AND printed = 0 AND group_id IN (
+    SELECT print_group_id FROM printdata_v2 WHERE job_id IN ({}))'''
+    DELETE_CREDENTIALS = '''
+DELETE FROM printer_credentials WHERE printer_id = ?'''
+    INSERT_CREDENTIAL = '''
+INSERT INTO printer_credentials (printer_id, credential) VALUES (?, ?)'''
+    SELECT_STATUS = '''
+SELECT j.printer_id, j.printed, COALESCE(c.claim_expires > datetime('now'), 0)
+FROM printer_jobs AS j
+LEFT JOIN printer_job_claims AS c
+    ON c.group_id = j.group_id AND c.printer_id = j.printer_id
+WHERE j.group_id = ?
+ORDER BY j.printer_id'''
+    NEXT_GROUP_ID = '''
+INSERT INTO print_group_seq DEFAULT VALUES'''
+    INSERT_PRINTER = '''
+INSERT INTO printer_jobs (group_id, printer_id, printed, credentials)
+VALUES (?, ?, 0, ?)'''
+    INSERT_JOB = '''
+INSERT INTO printdata_v2
+    (print_data, print_group_id, payload_format, chunked, priority)
+VALUES (X'', ?, ?, ?, ?)'''
+    APPEND_PAYLOAD = '''
+UPDATE printdata_v2 SET print_data = print_data || ? WHERE job_id = ?'''
+    INSERT_CHUNK = '''
+INSERT INTO printdata_v2_chunks (job_id, seq, chunk) VALUES (?, ?, ?)'''
+    SELECT_PAYLOAD = '''
+SELECT print_data FROM printdata_v2 WHERE job_id = ?'''
+    SELECT_CHUNKS = '''
+SELECT chunk FROM printdata_v2_chunks WHERE job_id = ? ORDER BY seq'''
+
+    # Seconds to wait for another process to finish writing
+    BUSY_TIMEOUT = 30
+
+    def __init__(self, path, size=pool.DEFAULT_POOL_SIZE):
+        self.__path = path
+        Backend.__init__(self, size)
+        with self.pool.connection() as conn:
+            self.upgrade(conn)
+
+    def connect(self):
+        '''Returns a new connection to the database file, the pool may hand
+        it to any thread.
+        '''
+        conn = sqlite3.connect(self.__path, timeout=self.BUSY_TIMEOUT,
+                               check_same_thread=False)
+        conn.text_factory = bytes
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def upgrade(self, conn):
+        '''Creates any of the queue tables that are missing'''
+        for statement in self.CREATE_TABLES:
+            conn.execute(statement)
+
+    @staticmethod
+    def binary(data):
+        '''Wraps a payload as an SQLite BLOB'''
+        return sqlite3.Binary(data)
@@ -0,0 +1,944 @@
+# benchmark.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Benchmarks for the web print queue, run from the 'nfc' folder with -
+
+    python -m pipsta.web_print.benchmark BENCHMARK [options]
+
+where BENCHMARK is one of -
+
+    payload     Compares the payload formats used to store print jobs.  For
+                a banner job and a certificate job (rendered with the shared
+                raster encoder, as the examples print them) the size of the
+                stored payload and the time taken to encode it, and to
+                decode it a chunk at a time as the printers do, are reported
+                for each format and zlib compression level.  Run it on the
+                Pi to see the decode cost there.  No printer or database is
+                needed.
+
+    schema      Times the WebPrintMany.py job query, with and without the
+                indexes created by schema.py, as the number of printed jobs
+                in the queue grows to 10k, 100k and 1M.  It needs a MySQL
+                database (--host, --user, --passwd, --db) that it is free to
+                fill: the print job tables in it are emptied first.
+
+    stream      Stores jobs of 1MB, 4MB and 16MB in printdata, as chunk rows
+                and in the job row, and streams each back as WebPrint.py
+                does, reporting the time until the first bytes reach the
+                printer, the total time and the largest piece of the job
+                held in memory.  It needs a MySQL database, as for schema.
+
+    pipeline    Prints a queue of jobs through the WebPrint.py pipeline with
+                the database latency (--latency) and the speed of the
+                printer (--rate) simulated, first with the stages run one
+                after another and then pipelined at several prefetch
+                depths, reporting the time to drain the queue and the
+                utilisation of each stage.  No printer or database is
+                needed.
+
+    schedule    Simulates a printer working through a mixed queue (one
+                person queueing 300 tickets at once, forty people sending a
+                one page job each, a few certificates and some urgent
+                priority jobs) with each scheduling policy, and reports the
+                50th and 95th percentile wait of each kind of job.  No
+                printer or database is needed.
+
+    queue       Runs jobs through the whole WebSendMany.py to
+                WebPrintMany.py path on an SQLite print job queue (see
+                backend.py): submits --jobs jobs to --printers printers,
+                then for each printer claims its outstanding jobs,
+                streams them into a local spool, prints them to a null
+                printer and marks them printed, reporting the rate of each
+                phase.  The queue is in a temporary file unless --sqlite
+                names one.  No printer or MySQL server is needed.
+
+    poll        Simulates a fleet of printers, all started at once,
+                for a day of bursty jobs with one job notification in ten
+                lost, at the fixed periods the examples used and with the
+                adaptive poller (see poller.py) with and without jitter.
+                Reports the polls each printer makes an hour, the 50th and
+                95th percentile delay before a job is picked up and the
+                most polls the database sees in any one second.  No
+                printer or database is needed.
+
+    render      Renders a banner, a QR-Code and an image job as WebSendMany.py
+                --type does (see render.py), and reports the time taken to
+                render each against the time to decode the stored (zlib)
+                job, which is all that is left for the printer to do.  Run
+                it on the Pi to see the rendering time moved off it.  No
+                printer or database is needed.
+
+    service     A load generator for the job service (see service.py).
+                --clients threads each send their share of --jobs jobs over
+                one kept open HTTP connection, first a job a request and
+                then --bulk jobs a request, reporting the jobs queued a
+                second and the 50th and 95th percentile request time.  The
+                service is run in the benchmark on a temporary SQLite queue
+                unless --url names a running one.  For comparison the time
+                to queue --processes jobs with a new python process each, as
+                running WebSendMany.py does, is reported too.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import argparse
+import base64
+import collections
+import httplib
+import io
+import functools
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+import zlib
+
+from PIL import Image, ImageChops
+
+from pipsta.banner_print import banner
+from pipsta.graphics import raster
+from pipsta.web_print import backend, fetch, payload, pipeline, poller, \
+    pool, render, scheduler, schema, service, spool, submit
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            os.pardir, os.pardir, os.pardir)
+
+CERTIFICATE_IMAGES = [
+    'Scratch/Game_with_Certificate/TopFlourish.png',
+    'Scratch/Game_with_Certificate/scratch.png',
+    'Scratch/Game_with_Certificate/MidFlourish.png',
+]
+
+BANNER_TEXT = 'My First Pipsta Banner!'
+
+ZLIB_LEVELS = [1, 6, 9]
+
+# Decoding is repeated to get a measurable time for the smaller jobs
+DECODE_REPEATS = 10
+
+QUEUE_SIZES = [10000, 100000, 1000000]
+QUEUE_PRINTERS = 50
+QUEUE_CREDENTIALS = [None, 'staff', 'visitor', 'pupil']
+# The credentials held by the printer whose query is timed
+QUEUE_PRINTER_CREDENTIALS = ['staff', 'visitor']
+QUEUE_OUTSTANDING_JOBS = 10
+QUEUE_INSERT_BATCH = 5000
+QUERY_REPEATS = 20
+
+STREAM_JOB_SIZES = [1, 4, 16]
+MEGABYTE = 1024 * 1024
+STREAM_PRINTER_ID = 'benchmark'
+
+PIPELINE_JOBS = 10
+PIPELINE_PIECES = 4
+PIPELINE_DEPTHS = [1, 2, 8]
+DEFAULT_FETCH_LATENCY = 50
+DEFAULT_PRINTER_RATE = 256
+
+# Roughly the rate a Pipsta prints raster graphics at (bytes a second)
+SCHEDULE_PRINTER_RATE = 20 * 1024
+SCHEDULE_PERIOD = 60
+SCHEDULE_SEED = 2015
+SCHEDULE_PERCENTILES = [50, 95]
+
+DEFAULT_QUEUE_JOBS = 200
+DEFAULT_QUEUE_PRINTERS = 4
+QUEUE_JOB_SIZE = 64 * 1024
+
+POLL_PRINTERS = 50
+POLL_PERIOD = 3
+POLL_MAX_PERIOD = 300
+POLL_DAY = 24 * 60 * 60
+POLL_BURSTS = 40
+POLL_PRINT_TIME = 2
+POLL_FALLBACK_PERIOD = 30
+POLL_LOST_NOTIFICATIONS = 0.1
+POLL_SETTLE_TIME = 60
+
+RENDER_QR_DATA = b'http://www.pipsta.co.uk/'
+RENDER_IMAGE = 'Scratch/Game_with_Certificate/scratch.png'
+RENDER_REPEATS = 5
+
+DEFAULT_SERVICE_CLIENTS = 8
+DEFAULT_SERVICE_JOBS = 800
+DEFAULT_SERVICE_BULK = 50
+DEFAULT_SERVICE_PROCESSES = 20
+SERVICE_JOB_SIZE = 4 * 1024
+SERVICE_PRINTER_ID = 'benchmark'
+
+# Queues one job from a new process, as WebSendMany.py --sqlite FILE does
+SUBMIT_SCRIPT = '''
+import io, sys
+from pipsta.web_print import backend
+job_queue = backend.SQLiteBackend(sys.argv[1], size=1)
+job_queue.submit(io.BytesIO(b'\\0' * int(sys.argv[2])), [sys.argv[3]])
+job_queue.pool.close()
+'''
+
+
+def parse_arguments():
+    '''Parse the benchmark to run and its options'''
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for the web print queue')
+    benchmarks = parser.add_subparsers(dest='benchmark')
+
+    payload_parser = benchmarks.add_parser(
+        'payload', help='compares the payload formats on typical jobs')
+    payload_parser.add_argument('--font', default=banner.DEFAULT_FONT,
+                                help='a truetype font file for the banner job')
+
+    schema_parser = benchmarks.add_parser(
+        'schema', help='times the job query as the queue grows')
+    schema.add_connection_arguments(schema_parser)
+
+    stream_parser = benchmarks.add_parser(
+        'stream', help='times streaming chunked and single row jobs')
+    schema.add_connection_arguments(stream_parser)
+
+    pipeline_parser = benchmarks.add_parser(
+        'pipeline', help='compares the print pipeline with sequential '
+        'printing')
+    pipeline_parser.add_argument('--latency', type=int,
+                                 default=DEFAULT_FETCH_LATENCY,
+                                 help='ms to read each piece of a job')
+    pipeline_parser.add_argument('--rate', type=int,
+                                 default=DEFAULT_PRINTER_RATE,
+                                 help='KB/s the printer takes data at')
+
+    benchmarks.add_parser('schedule',
+                          help='compares the job scheduling policies')
+
+    queue_parser = benchmarks.add_parser(
+        'queue', help='runs jobs through an SQLite print job queue')
+    queue_parser.add_argument('--sqlite', metavar='FILE',
+                              help='the SQLite print job database to use '
+                              '(default a temporary file)')
+    queue_parser.add_argument('--jobs', type=int, default=DEFAULT_QUEUE_JOBS,
+                              help='jobs to submit')
+    queue_parser.add_argument('--printers', type=int,
+                              default=DEFAULT_QUEUE_PRINTERS,
+                              help='printers each job is sent to')
+
+    benchmarks.add_parser('poll',
+                          help='compares fixed and adaptive polling')
+
+    render_parser = benchmarks.add_parser(
+        'render', help='compares rendering jobs with decoding them')
+    render_parser.add_argument('--font', default=banner.DEFAULT_FONT,
+                               help='a truetype font file for the banner job')
+
+    service_parser = benchmarks.add_parser(
+        'service', help='sends jobs to the job service')
+    service_parser.add_argument('--url',
+                                help='the running job service to send the '
+                                'jobs to (default one run in the benchmark)')
+    service_parser.add_argument('--clients', type=int,
+                                default=DEFAULT_SERVICE_CLIENTS,
+                                help='clients sending jobs at once')
+    service_parser.add_argument('--jobs', type=int,
+                                default=DEFAULT_SERVICE_JOBS,
+                                help='jobs to send each way')
+    service_parser.add_argument('--bulk', type=int,
+                                default=DEFAULT_SERVICE_BULK,
+                                help='jobs in each bulk request')
+    service_parser.add_argument('--processes', type=int,
+                                default=DEFAULT_SERVICE_PROCESSES,
+                                help='jobs to queue a process at a time')
+    return parser.parse_args()
+
+def job_bytes(job):
+    '''Returns the bytes an EncodedRaster sends to the printer'''
+    return b''.join(data for data, dummy in job.transfers)
+
+def certificate_job():
+    '''Returns the printer bytes for the graphics of a certificate'''
+    data = []
+    for name in CERTIFICATE_IMAGES:
+        image = Image.open(os.path.join(EXAMPLES_DIR, name)).convert('1')
+        data.append(ImageChops.invert(image).tobytes())
+
+    return job_bytes(raster.encode(b''.join(data), mode=raster.MODE_BAND24))
+
+def banner_job(font_name):
+    '''Returns the printer bytes for a banner'''
+    image = banner.create_banner_image(font_name, BANNER_TEXT)
+    return job_bytes(raster.encode(image.tobytes()))
+
+def decode_time(stored, payload_format):
+    '''Returns the time (seconds) to decode the payload chunk by chunk'''
+    start = time.time()
+    for dummy in range(DECODE_REPEATS):
+        for dummy in payload.chunks(stored, payload_format):
+            pass
+    return (time.time() - start) / DECODE_REPEATS
+
+def payload_benchmark(args):
+    '''Stores each job in every format and reports the cost'''
+    jobs = [('certificate', certificate_job())]
+    if os.path.isfile(args.font):
+        jobs.append(('banner', banner_job(args.font)))
+    else:
+        print('Font {} not found, the banner job is skipped'.format(args.font))
+
+    row = '{:<12} {:<8} {:>9} {:>7} {:>10} {:>10}'
+    print(row.format('job', 'format', 'bytes', 'ratio', 'encode/ms',
+                     'decode/ms'))
+
+    for name, data in jobs:
+        formats = [('hex', payload.FORMAT_HEX, None),
+                   ('raw', payload.FORMAT_RAW, None)]
+        formats += [('zlib-{}'.format(level), payload.FORMAT_ZLIB, level)
+                    for level in ZLIB_LEVELS]
+
+        for label, payload_format, level in formats:
+            start = time.time()
+            if level is None:
+                stored = payload.encode(data, payload_format)
+            else:
+                stored = zlib.compress(data, level)
+            encode_time = time.time() - start
+
+            assert payload.decode(stored, payload_format) == data
+            print(row.format(name, label, len(stored),
+                             '{:.3f}'.format(len(stored) / float(len(data))),
+                             '{:.2f}'.format(encode_time * 1000),
+                             '{:.2f}'.format(
+                                 decode_time(stored, payload_format) * 1000)))
+
+def fill_queue(conn, first_group, last_group):
+    '''Adds printed jobs to the queue for the groups in the range, spread
+    across the printers and credentials.
+    '''
+    cursor = conn.cursor()
+    for start in range(first_group, last_group, QUEUE_INSERT_BATCH):
+        groups = range(start, min(start + QUEUE_INSERT_BATCH, last_group))
+        cursor.executemany(
+            'INSERT INTO printer_jobs VALUES (%s, %s, TRUE, %s)',
+            [(group, '{:09d}'.format(group % QUEUE_PRINTERS),
+              QUEUE_CREDENTIALS[group % len(QUEUE_CREDENTIALS)])
+             for group in groups])
+        cursor.executemany(
+            'INSERT INTO printdata_v2 (print_data, print_group_id, '
+            'payload_format) VALUES (%s, %s, %s)',
+            [(b'Printed job\n', group, payload.FORMAT_RAW)
+             for group in groups])
+        conn.commit()
+    cursor.close()
+
+def add_outstanding_jobs(conn, first_group):
+    '''Queues a few jobs for the printer whose query is timed, claimed with
+    its print token, and stores the credentials it holds.
+    '''
+    fill_queue(conn, first_group, first_group + QUEUE_OUTSTANDING_JOBS)
+    (printer_id, token) = schema.PRINTER_QUERIES[1][2][:2]
+    cursor = conn.cursor()
+    cursor.execute('UPDATE printer_jobs SET printed = FALSE, printer_id = %s '
+                   'WHERE group_id >= %s', (printer_id, first_group))
+    cursor.execute('INSERT INTO printer_job_claims (group_id, printer_id, '
+                   'claim_token, claim_expires) SELECT group_id, printer_id, '
+                   '%s, NOW() + INTERVAL 1 DAY FROM printer_jobs '
+                   'WHERE group_id >= %s', (token, first_group))
+    cursor.execute('DELETE FROM printer_credentials')
+    cursor.executemany('INSERT INTO printer_credentials (printer_id, '
+                       'credential) VALUES (%s, %s)',
+                       [(printer_id, credential)
+                        for credential in QUEUE_PRINTER_CREDENTIALS])
+    conn.commit()
+    cursor.close()
+
+def time_query(conn, statement, args):
+    '''Returns the mean time (seconds) to run and fetch the query'''
+    cursor = conn.cursor()
+    start = time.time()
+    for dummy in range(QUERY_REPEATS):
+        cursor.execute(statement, args)
+        cursor.fetchall()
+    elapsed = time.time() - start
+    cursor.close()
+    return elapsed / QUERY_REPEATS
+
+def schema_benchmark(args):
+    '''Times the WebPrintMany.py job query as the queue grows'''
+    conn = schema.connect(args)
+    (dummy, statement, query_args) = schema.PRINTER_QUERIES[1]
+    try:
+        schema.upgrade(conn)
+        cursor = conn.cursor()
+        cursor.execute('TRUNCATE TABLE printer_jobs')
+        cursor.execute('TRUNCATE TABLE printer_job_claims')
+        cursor.execute('TRUNCATE TABLE printdata_v2')
+
+        row = '{:>9} {:>12} {:>12} {:>14}'
+        print(row.format('jobs', 'indexed/ms', 'scanned/ms', 'rows examined'))
+
+        queued = 0
+        for size in QUEUE_SIZES:
+            # The outstanding jobs are re-added at the end of the queue, so
+            # they always follow the printed history.
+            cursor.execute('DELETE FROM printer_jobs WHERE printed = FALSE')
+            cursor.execute('DELETE FROM printer_job_claims')
+            conn.commit()
+            fill_queue(conn, queued, size)
+            add_outstanding_jobs(conn, size)
+            queued = size + QUEUE_OUTSTANDING_JOBS
+
+            indexed = time_query(conn, statement, query_args)
+            schema.drop_indexes(cursor)
+            examined = sum(step['rows'] or 0 for step in
+                           schema.explain(cursor, statement, query_args))
+            scanned = time_query(conn, statement, query_args)
+            schema.create_indexes(cursor)
+
+            print(row.format(size, '{:.2f}'.format(indexed * 1000),
+                             '{:.2f}'.format(scanned * 1000), examined))
+
+        problems = schema.check_plans(cursor)
+        print('Query plan check: {} problem(s)'.format(len(problems)))
+        for problem in problems:
+            print(problem)
+    finally:
+        conn.close()
+
+class NullPrinter(object):
+    '''Stands in for the printers bulk out endpoint, noting when the first
+    bytes are written.
+    '''
+    def __init__(self):
+        self.first_write = None
+        self.written = 0
+
+    def write(self, data):
+        '''Discards the data'''
+        if self.first_write is None:
+            self.first_write = time.time()
+        self.written += len(data)
+
+def store_stream_job(conn, data, chunked):
+    '''Queues a raw job in printdata and returns its job id'''
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO printdata (print_data, printer_id, "
+                   "payload_format, chunked) VALUES ('', %s, %s, %s)",
+                   (STREAM_PRINTER_ID, payload.FORMAT_RAW, chunked))
+    job_id = cursor.lastrowid
+    submit.store_payload(cursor, 'printdata', job_id, io.BytesIO(data),
+                         chunked)
+    conn.commit()
+    cursor.close()
+    return job_id
+
+def stream_job(job_pool, cursor, job_id, chunked):
+    '''Streams a job to a NullPrinter and returns the time to the first
+    write, the total time and the largest piece read.
+    '''
+    printer = NullPrinter()
+    largest = [0]
+
+    def pieces():
+        '''Notes the size of each piece as it is read'''
+        for piece in fetch.stored_pieces(job_pool, cursor, 'printdata',
+                                         job_id, chunked):
+            largest[0] = max(largest[0], len(piece))
+            yield piece
+
+    start = time.time()
+    try:
+        payload.write_stream(printer, pieces(), payload.FORMAT_RAW)
+    finally:
+        cursor.close()
+    return (printer.first_write - start, time.time() - start, largest[0])
+
+def stream_benchmark(args):
+    '''Times streaming jobs stored as chunk rows and in a single row'''
+    import MySQLdb
+    import MySQLdb.cursors
+
+    job_pool = pool.ConnectionPool(lambda: schema.connect(args),
+                                   lost_errors=(MySQLdb.OperationalError,))
+    with job_pool.connection() as conn:
+        schema.upgrade(conn)
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM printdata_chunks')
+        cursor.execute('DELETE FROM printdata')
+        cursor.close()
+
+    row = '{:>6} {:<7} {:>14} {:>10} {:>12}'
+    print(row.format('MB', 'stored', 'first byte/ms', 'total/ms',
+                     'largest/KB'))
+    for size in STREAM_JOB_SIZES:
+        data = os.urandom(size * MEGABYTE)
+        for label, chunked in [('chunks', True), ('row', False)]:
+            try:
+                with job_pool.connection() as conn:
+                    job_id = store_stream_job(conn, data, chunked)
+                with job_pool.connection() as conn:
+                    (first, total, largest) = stream_job(
+                        job_pool, conn.cursor(MySQLdb.cursors.SSCursor),
+                        job_id, chunked)
+            except MySQLdb.Error as err:
+                # A single row job bigger than max_allowed_packet
+                print(row.format(size, label, 'failed', '', '') + ' ' +
+                      str(err))
+                continue
+
+            print(row.format(size, label, '{:.1f}'.format(first * 1000),
+                             '{:.1f}'.format(total * 1000),
+                             largest // 1024))
+    job_pool.close()
+
+class SlowPrinter(object):
+    '''Stands in for the printers bulk out endpoint, taking as long as a
+    printer that takes rate bytes a second.
+    '''
+    def __init__(self, rate):
+        self.rate = float(rate)
+
+    def write(self, data):
+        '''Waits for the data to be printed'''
+        time.sleep(len(data) / self.rate)
+
+def pipeline_jobs():
+    '''Returns a queue of compressed raster jobs as (job_id, payload_format,
+    stored)
+    '''
+    jobs = []
+    for job_id in range(PIPELINE_JOBS):
+        data = os.urandom(16 * 1024) + b'\0' * (48 * 1024)
+        jobs.append((job_id, payload.FORMAT_ZLIB,
+                     payload.encode(data, payload.FORMAT_ZLIB)))
+    return jobs
+
+def simulated_fetch(latency):
+    '''Returns a fetch stage that reads each job in PIPELINE_PIECES pieces,
+    each taking latency seconds.
+    '''
+    def fetch_stage(jobs):
+        '''Generates the pieces of each job as fetch.fetch_jobs() does'''
+        for (job_id, payload_format, stored) in jobs:
+            size = len(stored) // PIPELINE_PIECES + 1
+            for start in range(0, len(stored), size):
+                time.sleep(latency)
+                yield (job_id, payload_format, stored[start:start + size])
+    return fetch_stage
+
+def drain(items, printer):
+    '''Writes the decoded jobs to the printer'''
+    for (dummy, data) in items:
+        if data is not None:
+            printer.write(data)
+
+def pipeline_benchmark(args):
+    '''Drains a queue of jobs sequentially and pipelined'''
+    jobs = pipeline_jobs()
+    printer = SlowPrinter(args.rate * 1024)
+    fetch_stage = simulated_fetch(args.latency / 1000.0)
+
+    row = '{:<10} {:>6} {:>9} {:>7} {:>7} {:>7}  {}'
+    print(row.format('mode', 'depth', 'drain/s', 'fetch', 'decode', 'write',
+                     'bottleneck'))
+
+    start = time.time()
+    drain(fetch.decode_jobs(fetch_stage(jobs)), printer)
+    print(row.format('sequential', '', '{:.2f}'.format(time.time() - start),
+                     '', '', '', ''))
+
+    for depth in PIPELINE_DEPTHS:
+        stages = pipeline.Pipeline([('fetch', fetch_stage),
+                                    ('decode', fetch.decode_jobs)], depth)
+        start = time.time()
+        drain(stages.run(jobs), printer)
+        print(row.format('pipelined', depth,
+                         '{:.2f}'.format(time.time() - start),
+                         *(['{:.0%}'.format(stats.utilisation())
+                            for stats in stages.stats] +
+                           [stages.bottleneck()])))
+
+def schedule_workload():
+    '''Returns a mixed queue of jobs as a list of (arrival time, kind,
+    priority, share, size) in the order they arrive.
+    '''
+    rng = random.Random(SCHEDULE_SEED)
+    jobs = [(0.0, 'bulk', 0, 'bulk', 2 * 1024) for dummy in range(300)]
+    jobs += [(rng.uniform(0, SCHEDULE_PERIOD), 'single', 0,
+              'person{}'.format(person), rng.randint(4, 32) * 1024)
+             for person in range(40)]
+    jobs += [(rng.uniform(0, SCHEDULE_PERIOD), 'certificate', 0,
+              'teacher{}'.format(teacher), 200 * 1024)
+             for teacher in range(5)]
+    jobs += [(rng.uniform(0, SCHEDULE_PERIOD), 'urgent', 1, 'office',
+              8 * 1024) for dummy in range(5)]
+    return sorted(jobs, key=lambda job: job[0])
+
+def simulate_schedule(policy, workload):
+    '''Prints the workload with the scheduling policy and returns the waits
+    (seconds from arriving to starting to print) of each kind of job.
+    '''
+    job_scheduler = scheduler.Scheduler(policy)
+    waits = collections.defaultdict(list)
+    waiting = []
+    clock = 0.0
+    arrived = 0
+    while arrived < len(workload) or waiting:
+        while arrived < len(workload) and workload[arrived][0] <= clock:
+            (dummy, dummy, priority, share, size) = workload[arrived]
+            waiting.append(scheduler.Job(arrived, priority, share, size,
+                                         arrived))
+            arrived += 1
+
+        if not waiting:
+            clock = workload[arrived][0]
+            continue
+
+        job = job_scheduler.select(waiting)
+        waiting.remove(job)
+        (arrival, kind, dummy, dummy, dummy) = workload[job.job_id]
+        waits[kind].append(clock - arrival)
+        waits['all'].append(clock - arrival)
+        clock += job.size / float(SCHEDULE_PRINTER_RATE)
+    return waits
+
+def percentile(values, percent):
+    '''Returns the nearest rank percentile of the values'''
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank - 1, 0)]
+
+def schedule_benchmark(dummy_args):
+    '''Compares the wait of each kind of job under each policy'''
+    workload = schedule_workload()
+    kinds = ['bulk', 'single', 'certificate', 'urgent', 'all']
+
+    row = '{:<6} {:<12} {:>5}' + ' {:>8}' * len(SCHEDULE_PERCENTILES)
+    print(row.format('policy', 'jobs', 'count',
+                     *['p{}/s'.format(p) for p in SCHEDULE_PERCENTILES]))
+    for policy in scheduler.POLICIES:
+        waits = simulate_schedule(policy, workload)
+        for kind in kinds:
+            print(row.format(policy, kind, len(waits[kind]),
+                             *['{:.1f}'.format(percentile(waits[kind], p))
+                               for p in SCHEDULE_PERCENTILES]))
+
+def queue_phase(label, jobs, function):
+    '''Runs a phase of the queue benchmark and prints its rate'''
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    print('{:<9} {:>6} {:>9.2f} {:>9.0f}'.format(label, jobs, elapsed,
+                                                  jobs / elapsed))
+
+def queue_benchmark(args):
+    '''Submits, spools, prints and acknowledges jobs on an SQLite queue'''
+    work_dir = tempfile.mkdtemp()
+    try:
+        job_queue = backend.SQLiteBackend(
+            args.sqlite or os.path.join(work_dir, 'print_jobs.db'))
+        printer_ids = ['printer{}'.format(printer)
+                       for printer in range(args.printers)]
+        data = os.urandom(QUEUE_JOB_SIZE // 4) + b'\0' * (
+            QUEUE_JOB_SIZE - QUEUE_JOB_SIZE // 4)
+        spools = dict((printer_id, spool.Spool(
+            os.path.join(work_dir, printer_id + '.db')))
+                      for printer_id in printer_ids)
+        printer = NullPrinter()
+
+        def submit_jobs():
+            '''Queues the jobs as WebSendMany.py does'''
+            for dummy in range(args.jobs):
+                job_queue.submit(io.BytesIO(data), printer_ids,
+                                 payload_format=payload.FORMAT_ZLIB)
+
+        def spool_jobs():
+            '''Claims each printers outstanding jobs and copies them into
+            its spool
+            '''
+            for printer_id in printer_ids:
+                for (job_id, payload_format, chunked, priority, group_id,
+                     dummy) in job_queue.outstanding_jobs(
+                         printer_id, None, spools[printer_id].token):
+                    spools[printer_id].add(
+                        job_id, payload_format,
+                        job_queue.job_pieces(job_id, chunked), priority,
+                        str(group_id))
+
+        def print_jobs():
+            '''Prints each spooled job, as the printer thread does'''
+            for printer_id in printer_ids:
+                job_spool = spools[printer_id]
+                job = job_spool.next_job()
+                while job is not None:
+                    job_spool.start_printing(job[0])
+                    payload.write_stream(printer, job_spool.pieces(job[0]),
+                                         job[1])
+                    job_spool.mark_printed(job[0])
+                    job = job_spool.next_job()
+
+        def acknowledge_jobs():
+            '''Marks the printed jobs printed in the queue'''
+            for printer_id in printer_ids:
+                spools[printer_id].acknowledge(
+                    functools.partial(job_queue.mark_printed, printer_id))
+
+        deliveries = args.jobs * args.printers
+        print('{:<9} {:>6} {:>9} {:>9}'.format('phase', 'jobs', 'time/s',
+                                               'jobs/s'))
+        queue_phase('submit', args.jobs, submit_jobs)
+        queue_phase('spool', deliveries, spool_jobs)
+        queue_phase('print', deliveries, print_jobs)
+        queue_phase('ack', deliveries, acknowledge_jobs)
+        job_queue.pool.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+class FixedPoller(object):
+    '''Polls every period, as the examples did before the adaptive poller'''
+    def __init__(self, period):
+        self.interval = period
+
+    def record(self, dummy_found_work):
+        '''The period does not change'''
+        pass
+
+    def reset(self):
+        '''The period does not change'''
+        pass
+
+    def next_wait(self):
+        '''Returns the period'''
+        return self.interval
+
+def poll_workload(rng):
+    '''Returns the jobs of a day for one printer, in bursts of one to ten
+    jobs a second apart during the working day, as a sorted list of
+    (arrival time, True if its notification arrived).
+    '''
+    jobs = []
+    for dummy in range(POLL_BURSTS):
+        start = rng.uniform(8 * 60 * 60, 18 * 60 * 60)
+        jobs += [(start + job, rng.random() >= POLL_LOST_NOTIFICATIONS)
+                 for job in range(rng.randint(1, 10))]
+    return sorted(jobs)
+
+def simulate_polling(job_poller, jobs):
+    '''Polls through the jobs, printing each as it is found, and returns
+    the time of each poll and the delay before each job was picked up.  A
+    notification wakes the printer once it has finished printing.
+    '''
+    notifications = [arrival for arrival, notified in jobs if notified]
+    polls = []
+    delays = []
+    clock = 0.0
+    taken = 0
+    notified = 0
+    while clock < POLL_DAY:
+        polls.append(clock)
+        found = 0
+        while taken < len(jobs) and jobs[taken][0] <= clock:
+            delays.append(clock - jobs[taken][0])
+            taken += 1
+            found += 1
+        job_poller.record(found)
+
+        while notified < len(notifications) and \
+                notifications[notified] <= clock:
+            notified += 1
+        printed = clock + found * POLL_PRINT_TIME
+        clock = printed + job_poller.next_wait()
+        if notified < len(notifications) and \
+                notifications[notified] < clock:
+            clock = max(notifications[notified], printed)
+            job_poller.reset()
+    return (polls, delays)
+
+def poll_benchmark(dummy_args):
+    '''Compares fixed polling with the adaptive poller across a fleet'''
+    pollers = [
+        ('fixed 3s', lambda rng: FixedPoller(POLL_PERIOD)),
+        ('fixed 30s', lambda rng: FixedPoller(POLL_FALLBACK_PERIOD)),
+        ('adaptive', lambda rng: poller.AdaptivePoller(
+            POLL_PERIOD, POLL_MAX_PERIOD, jitter=0, rng=rng)),
+        ('jittered', lambda rng: poller.AdaptivePoller(
+            POLL_PERIOD, POLL_MAX_PERIOD, rng=rng)),
+    ]
+
+    row = '{:<9} {:>12} {:>9} {:>9} {:>12}'
+    print(row.format('poller', 'polls/hour', 'p50/s', 'p95/s',
+                     'peak polls/s'))
+    for label, make_poller in pollers:
+        rng = random.Random(SCHEDULE_SEED)
+        all_polls = collections.Counter()
+        all_delays = []
+        for dummy in range(POLL_PRINTERS):
+            (polls, delays) = simulate_polling(make_poller(rng),
+                                               poll_workload(rng))
+            all_polls.update(int(poll) for poll in polls)
+            all_delays += delays
+
+        # The printers all poll as they start, so the peak is taken from
+        # once they have settled
+        peak = max(count for second, count in all_polls.items()
+                   if second >= POLL_SETTLE_TIME)
+        print(row.format(label, '{:.0f}'.format(
+            sum(all_polls.values()) / float(POLL_PRINTERS) /
+            (POLL_DAY / 3600.0)),
+                         '{:.1f}'.format(percentile(all_delays, 50)),
+                         '{:.1f}'.format(percentile(all_delays, 95)),
+                         peak))
+
+def render_benchmark(args):
+    '''Renders each type of job and reports the cost against decoding it'''
+    jobs = [(render.TYPE_QR, lambda: io.BytesIO(RENDER_QR_DATA)),
+            (render.TYPE_IMAGE,
+             lambda: open(os.path.join(EXAMPLES_DIR, RENDER_IMAGE), 'rb'))]
+    if os.path.isfile(args.font):
+        jobs.insert(0, (render.TYPE_BANNER, lambda: io.BytesIO(BANNER_TEXT)))
+    else:
+        print('Font {} not found, the banner job is skipped'.format(args.font))
+
+    row = '{:<8} {:>9} {:>9} {:>10} {:>10}'
+    print(row.format('job', 'bytes', 'stored', 'render/ms', 'decode/ms'))
+    for job_type, open_job in jobs:
+        start = time.time()
+        for dummy in range(RENDER_REPEATS):
+            with open_job() as job_file:
+                data = render.render(job_type, job_file, font=args.font)
+        render_time = (time.time() - start) / RENDER_REPEATS
+
+        stored = payload.encode(data, payload.FORMAT_ZLIB)
+        print(row.format(job_type, len(data), len(stored),
+                         '{:.1f}'.format(render_time * 1000),
+                         '{:.1f}'.format(
+                             decode_time(stored, payload.FORMAT_ZLIB) *
+                             1000)))
+
+def send_jobs(address, requests, latencies):
+    '''Sends the (path, content type, body) requests to the job service over
+    one connection, appending the time taken by each to latencies.
+    '''
+    conn = httplib.HTTPConnection(*address)
+    try:
+        for (path, content_type, body) in requests:
+            start = time.time()
+            conn.request('POST', path, body, {'Content-Type': content_type})
+            response = conn.getresponse()
+            answer = response.read()
+            if response.status != 201:
+                raise IOError('The job service answered {} {}'.format(
+                    response.status, answer))
+            latencies.append(time.time() - start)
+    finally:
+        conn.close()
+
+def service_phase(label, address, clients, requests, jobs):
+    '''Sends the requests shared between the clients, each on its own
+    thread, and prints the rate jobs were queued at.
+    '''
+    latencies = []
+    threads = [threading.Thread(target=send_jobs,
+                                args=(address, requests[client::clients],
+                                      latencies))
+               for client in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    print('{:<9} {:>6} {:>9.0f} {:>9.1f} {:>9.1f}'.format(
+        label, jobs, jobs / elapsed, percentile(latencies, 50) * 1000,
+        percentile(latencies, 95) * 1000))
+
+def service_benchmark(args):
+    '''Sends jobs to the job service singly and in bulk, and compares them
+    with queueing each job from a new process.
+    '''
+    data = b'\0' * SERVICE_JOB_SIZE
+    single = ('{}?printer={}'.format(service.JOBS_PATH, SERVICE_PRINTER_ID),
+              'application/octet-stream', data)
+    bulk = (service.JOBS_PATH, service.JSON_TYPE, json.dumps(
+        [{'printer': SERVICE_PRINTER_ID, 'data': base64.b64encode(data)}] *
+        args.bulk))
+
+    work_dir = tempfile.mkdtemp()
+    server = None
+    try:
+        if args.url:
+            url = urlparse.urlparse(args.url)
+            address = (url.hostname, url.port or service.DEFAULT_PORT)
+        else:
+            path = os.path.join(work_dir, 'print_jobs.db')
+            server = service.JobServer(
+                ('localhost', 0), backend.SQLiteBackend(path, args.clients),
+                notify=False, quiet=True)
+            threading.Thread(target=server.serve_forever).start()
+            address = server.server_address
+
+        print('{:<9} {:>6} {:>9} {:>9} {:>9}'.format('requests', 'jobs',
+                                                     'jobs/s', 'p50/ms',
+                                                     'p95/ms'))
+        service_phase('single', address, args.clients,
+                      [single] * args.jobs, args.jobs)
+        batches = max(args.jobs // args.bulk, 1)
+        service_phase('bulk', address, args.clients, [bulk] * batches,
+                      batches * args.bulk)
+
+        if server and args.processes:
+            latencies = []
+            start = time.time()
+            for dummy in range(args.processes):
+                job_start = time.time()
+                subprocess.check_call(
+                    [sys.executable, '-c', SUBMIT_SCRIPT, path,
+                     str(SERVICE_JOB_SIZE), SERVICE_PRINTER_ID],
+                    cwd=os.path.join(os.path.dirname(
+                        os.path.realpath(__file__)), os.pardir, os.pardir))
+                latencies.append(time.time() - job_start)
+            print('{:<9} {:>6} {:>9.0f} {:>9.1f} {:>9.1f}'.format(
+                'process', args.processes,
+                args.processes / (time.time() - start),
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000))
+
+        if server:
+            print(server.stats())
+            print(server.job_queue.pool.stats())
+    finally:
+        if server:
+            server.shutdown()
+            server.job_queue.pool.close()
+        shutil.rmtree(work_dir)
+
+def main():
+    '''Runs the benchmark named on the command line'''
+    args = parse_arguments()
+    if args.benchmark == 'payload':
+        payload_benchmark(args)
+    elif args.benchmark == 'schema':
+        schema_benchmark(args)
+    elif args.benchmark == 'stream':
+        stream_benchmark(args)
+    elif args.benchmark == 'pipeline':
+        pipeline_benchmark(args)
+    elif args.benchmark == 'schedule':
+        schedule_benchmark(args)
+    elif args.benchmark == 'queue':
+        queue_benchmark(args)
+    elif args.benchmark == 'poll':
+        poll_benchmark(args)
+    elif args.benchmark == 'render':
+        render_benchmark(args)
+    else:
+        service_benchmark(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# claims.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Print tokens, which let a web print client claim its jobs in the print job
+database so that each job is printed once, even across a crash.
+
+Each job a client prints goes through three states -
+
+    claimed     the client has written its print token, and when the claim
+                expires, into the jobs row in the database.  The client only
+                prints jobs it has claimed, and renews its claims each time
+                it polls.  The claims of a client that has gone for good
+                expire after the lease, and the jobs can then be claimed by
+                another.
+
+    printing    the client has recorded locally (in its journal or spool,
+                synced to disk) that it is about to write the job to the
+                printer.
+
+    printed     the client has recorded locally that the whole job has been
+                written, and later marks it printed (or deletes it) in the
+                database.
+
+The token is kept on disk with the clients journal or spool, so a client
+that restarts after a crash still holds the claims it made before.  When
+it starts it reconciles its local record with the database: printed jobs
+are marked printed in the database rather than printed again, and a job
+left 'printing' was cut off part way through, which is reported and, unless
+the client was asked to reprint such jobs, treated as printed.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import os
+import uuid
+
+# Seconds a claim lasts unless it is renewed, this must be longer than the
+# longest wait between polls
+DEFAULT_LEASE = 15 * 60
+
+
+def new_token():
+    '''Returns a new print token, 32 hex digits'''
+    return uuid.uuid4().hex
+
+def load_token(path):
+    '''Returns the print token kept in the file, creating the file with a new
+    token first if need be.
+    '''
+    if os.path.isfile(path):
+        with open(path) as token_file:
+            token = token_file.read().strip()
+        if token:
+            return token
+
+    token = new_token()
+    with open(path, 'w') as token_file:
+        token_file.write(token + '\n')
+        token_file.flush()
+        os.fsync(token_file.fileno())
+    return token
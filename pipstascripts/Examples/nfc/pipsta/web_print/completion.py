@@ -0,0 +1,152 @@
+# completion.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Marks printed jobs as complete in the print job database in batches,
+rather than with one round trip to the database per job.
+
+Each job id is appended to a local journal file (and the file synced to
+disk) as soon as the job has been printed, the ids are then written to the
+database with a single 'job_id IN (...)' statement once enough of them have
+built up or the oldest has waited long enough, and at the end of each drain
+of the queue.  The journal is only emptied once the database has committed
+the batch, so if the process dies (or the database cannot be reached) the
+ids are read back from the journal on the next start and written then.
+
+Until they are written the ids are 'pending', the clients skip any job that
+is pending so a job is not printed twice while its completion is waiting to
+be written.
+
+Before the first byte of a job is written to the printer a 'printing' line
+for it is journalled too.  A job that is still printing when the journal is
+read back was cut off part way through by a crash, it is listed in
+interrupted until resolve_interrupted() either treats it as printed or lets
+it be printed again (see claims.py).
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import os
+import time
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_MAX_DELAY = 1.0
+
+# Journal lines for jobs being printed start with this, the lines for
+# printed jobs are just the job id
+PRINTING = 'printing'
+
+
+class CompletionRecorder(object):
+    '''Records printed jobs and marks them complete in batches.  The
+    statement must contain a '{}' where the list of job id placeholders
+    goes, args are the parameters that come before the list, for example -
+
+        CompletionRecorder(POOL, 'DELETE FROM printdata '
+                                 'WHERE job_id IN ({})', (), 'jobs.journal')
+    '''
+    def __init__(self, pool, statement, args, journal_path,
+                 batch_size=DEFAULT_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY):
+        self.__pool = pool
+        self.__statement = statement
+        self.__args = tuple(args)
+        self.__journal_path = journal_path
+        self.__batch_size = batch_size
+        self.__max_delay = max_delay
+        self.__oldest = None
+        self.pending = []
+        self.batches = 0
+        self.jobs = 0
+
+        # Recover any ids left over from a previous run, they are written to
+        # the database on the first flush.
+        printing = []
+        if os.path.isfile(journal_path):
+            with open(journal_path) as journal:
+                for line in journal:
+                    fields = line.split()
+                    if len(fields) == 2 and fields[0] == PRINTING:
+                        printing.append(int(fields[1]))
+                    elif fields:
+                        self.pending.append(int(fields[0]))
+            if self.pending:
+                self.__oldest = time.time()
+        self.interrupted = [job_id for job_id in printing
+                            if job_id not in self.pending]
+
+    def start(self, job_id):
+        '''Journals a job as printing, before any of it is written to the
+        printer.
+        '''
+        self.__journal('{} {}'.format(PRINTING, job_id))
+
+    def resolve_interrupted(self, reprint=False):
+        '''Settles the jobs interrupted by a crash, and returns their ids.
+        They are treated as printed (and marked complete on the next flush)
+        or, if reprint is set, forgotten so they are printed again.
+        '''
+        interrupted = self.interrupted
+        self.interrupted = []
+        if not reprint:
+            self.pending.extend(interrupted)
+            if self.pending and self.__oldest is None:
+                self.__oldest = time.time()
+
+        with open(self.__journal_path, 'w') as journal:
+            journal.writelines('{}\n'.format(job_id)
+                               for job_id in self.pending)
+            journal.flush()
+            os.fsync(journal.fileno())
+        return interrupted
+
+    def record(self, job_id):
+        '''Journals a job as printed and writes the batch to the database if
+        it is big enough or has been waiting long enough.
+        '''
+        self.__journal(job_id)
+
+        self.pending.append(job_id)
+        if self.__oldest is None:
+            self.__oldest = time.time()
+
+        if len(self.pending) >= self.__batch_size or \
+           time.time() - self.__oldest >= self.__max_delay:
+            self.flush()
+
+    def is_pending(self, job_id):
+        '''Returns True if the job has been printed but is not yet marked
+        complete in the database.
+        '''
+        return job_id in self.pending
+
+    def flush(self):
+        '''Marks every pending job complete in a single statement and
+        transaction, and then empties the journal.  Database errors are
+        left to the caller, the jobs stay pending and are retried on the
+        next flush.
+        '''
+        if not self.pending:
+            return
+
+        placeholders = ','.join(['%s'] * len(self.pending))
+        with self.__pool.connection() as conn:
+            cursor = conn.cursor()
+            self.__pool.execute(cursor, self.__statement.format(placeholders),
+                                self.__args + tuple(self.pending))
+            cursor.close()
+
+        open(self.__journal_path, 'w').close()
+        self.batches += 1
+        self.jobs += len(self.pending)
+        self.pending = []
+        self.__oldest = None
+
+    def __journal(self, line):
+        '''Appends a line to the journal and syncs it to disk'''
+        with open(self.__journal_path, 'a') as journal:
+            journal.write('{}\n'.format(line))
+            journal.flush()
+            os.fsync(journal.fileno())
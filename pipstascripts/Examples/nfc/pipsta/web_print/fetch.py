@@ -0,0 +1,99 @@
+# fetch.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Streams print jobs out of the print job database and on to the printer.
+
+The printers' job queries only return the id, payload format and chunked
+flag of each outstanding job, the payload of each job is then read on its
+own as it is printed.  With a server side cursor (MySQLdb.cursors.SSCursor)
+the chunk rows of a chunked job are read from the network one at a time
+and each is written to the printer as it arrives, so the printer starts
+on a job as soon as its first chunk is in and never holds more than a chunk
+of it in memory, however big the job is.  The payload of a job stored in a
+single row (chunked not set) is read in one piece, as before.
+
+    with POOL.connection() as conn:
+        cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+        fetch.write_job(POOL, cursor, ep_out, 'printdata', job_id,
+                        payload_format, chunked)
+
+A server side cursor must be read to the end (or closed) before anything
+else is run on its connection.
+
+fetch_jobs() and decode_jobs() are the fetch and decode stages of the print
+pipeline (see pipeline.py).
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import itertools
+
+from pipsta.web_print import payload
+
+SELECT_PAYLOAD = '''
+SELECT print_data FROM {} WHERE job_id = %s'''
+SELECT_CHUNKS = '''
+SELECT chunk FROM {}_chunks WHERE job_id = %s ORDER BY seq'''
+
+
+def stored_pieces(pool, cursor, table, job_id, chunked):
+    '''Generates the stored payload of a job in the table, one row at a
+    time: each chunk of a chunked job, or its print_data.
+    '''
+    if chunked:
+        statement = SELECT_CHUNKS
+    else:
+        statement = SELECT_PAYLOAD
+
+    pool.execute(cursor, statement.format(table), (job_id,))
+    for row in iter(cursor.fetchone, None):
+        yield row[0]
+
+def write_job(pool, cursor, ep_out, table, job_id, payload_format, chunked):
+    '''Streams a job from the table to the printers bulk out endpoint,
+    decoding each piece of the stored payload as it is read.  The cursor is
+    closed once the job has been written.
+    '''
+    try:
+        payload.write_stream(ep_out,
+                             stored_pieces(pool, cursor, table, job_id,
+                                           chunked),
+                             payload_format)
+    finally:
+        cursor.close()
+
+def fetch_jobs(pool, cursor_class, table, jobs):
+    '''Generates (job_id, payload_format, piece) for each piece of the
+    stored payload of each of the jobs, given as (job_id, payload_format,
+    chunked), in turn.  A job with nothing stored gives one empty piece.
+    Each job is read with its own cursor of cursor_class.
+    '''
+    for (job_id, payload_format, chunked) in jobs:
+        with pool.connection() as conn:
+            cursor = conn.cursor(cursor_class)
+            try:
+                empty = True
+                for piece in stored_pieces(pool, cursor, table, job_id,
+                                           chunked):
+                    empty = False
+                    yield (job_id, payload_format, piece)
+                if empty:
+                    yield (job_id, payload_format, b'')
+            finally:
+                cursor.close()
+
+def decode_jobs(pieces):
+    '''Takes the pieces generated by fetch_jobs() and generates (job_id,
+    data) for the bytes to send to the printer, followed by (job_id, None)
+    at the end of each job.
+    '''
+    for (job_id, payload_format), job in itertools.groupby(
+            pieces, key=lambda piece: piece[:2]):
+        for data in payload.decode_stream((piece[2] for piece in job),
+                                          payload_format):
+            yield (job_id, data)
+        yield (job_id, None)
@@ -0,0 +1,105 @@
+# notifier.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Wakes the web print clients as soon as a job has been queued for them,
+rather than leaving them to find it on their next poll of the database.
+
+Once a job has been committed the sender broadcasts a small UDP datagram
+naming the target printers (WebSend.py and WebSendMany.py do this).  The
+printers wait on a socket for a datagram naming them and check the
+database as soon as one arrives.  UDP delivery is not guaranteed (and the
+sender may not be on the same network as the printers) so the printers
+still poll the database, but only as a slow fallback.
+
+The datagram is 'PIPSTA-JOB' followed by a space and a comma separated
+list of printer serial numbers.  An empty list wakes every printer.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import select
+import socket
+import time
+
+NOTIFY_PORT = 52101
+NOTIFY_ADDRESS = '<broadcast>'
+NOTIFY_MAGIC = b'PIPSTA-JOB'
+MAX_DATAGRAM_LENGTH = 1024
+
+
+def notify(printer_ids=(), address=NOTIFY_ADDRESS, port=NOTIFY_PORT):
+    '''Tells any listening printers that jobs have been queued for the
+    printer ids (or for every printer if no ids are given).  Returns False
+    if the datagram could not be sent, which is not an error as the
+    printers will find the job on their next poll anyway.
+    '''
+    message = b' '.join([NOTIFY_MAGIC, b','.join(printer_ids)])
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.sendto(message, (address, port))
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+    return True
+
+
+class Listener(object):
+    '''Listens for job notifications.  SO_REUSEADDR is set so that more
+    than one client on the same machine can listen on the port, each of
+    them receives every broadcast.
+    '''
+    def __init__(self, port=NOTIFY_PORT):
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__sock.bind(('', port))
+        self.wakeups = 0
+        self.timeouts = 0
+
+    def wait(self, timeout, printer_id=None):
+        '''Blocks until a notification naming the printer arrives (any
+        notification if printer_id is None) or until timeout seconds have
+        passed.  Returns True if woken by a notification.  Any other
+        notifications already queued are discarded, the database query
+        that follows will pick up their jobs too.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.timeouts += 1
+                return False
+
+            if not select.select([self.__sock], [], [], remaining)[0]:
+                continue
+
+            if self.__matches(self.__sock.recv(MAX_DATAGRAM_LENGTH),
+                              printer_id):
+                self.__discard_pending()
+                self.wakeups += 1
+                return True
+
+    def close(self):
+        '''Stops listening for notifications'''
+        self.__sock.close()
+
+    @staticmethod
+    def __matches(message, printer_id):
+        '''Returns True if the datagram is a notification for the printer'''
+        fields = message.split(b' ', 1)
+        if fields[0] != NOTIFY_MAGIC:
+            return False
+        if printer_id is None or len(fields) < 2 or not fields[1]:
+            return True
+        return printer_id in fields[1].split(b',')
+
+    def __discard_pending(self):
+        '''Reads (and drops) any datagrams already waiting on the socket'''
+        while select.select([self.__sock], [], [], 0)[0]:
+            self.__sock.recv(MAX_DATAGRAM_LENGTH)
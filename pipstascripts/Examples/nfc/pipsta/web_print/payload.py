@@ -0,0 +1,171 @@
+# payload.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+The format of the print job payloads stored in the print job database.
+
+The original examples stored each job as hex text, which doubles the size
+of every job in the database and on the network, and costs the printer a
+decode pass before anything is printed.  Jobs are now stored as binary in
+a BLOB column, with a payload_format column saying how each row is stored
+so that rows queued before the change are still printed correctly -
+
+    FORMAT_HEX  0   hex text, as written by the original examples
+    FORMAT_RAW  1   the bytes to send to the printer
+    FORMAT_ZLIB 2   the bytes to send to the printer, zlib compressed
+
+Raster jobs are mostly long runs of blank bytes so compress very well.  Jobs
+are encoded from a file a chunk at a time with encode_stream(), and the
+printers write a job to the USB endpoint with write(), which decodes the
+stored payload a bounded chunk at a time, so a compressed job is never held
+in memory alongside the whole of its decompressed bytes.
+
+A payload may also be stored in pieces, as the ordered chunk rows of a job
+(see submit.py), in which case the pieces joined together are the payload.
+decode_stream() and write_stream() decode the pieces as they arrive, a zlib
+stream or a hex digit pair may be split across two pieces.
+
+MIGRATION_STATEMENTS converts an existing database.  The print_data columns
+become LONGBLOB (existing hex text is kept byte for byte) and the new
+payload_format column defaults to FORMAT_HEX, so existing rows are marked
+as hex.  It is applied by the schema upgrade in schema.py.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import binascii
+import zlib
+
+FORMAT_HEX = 0
+FORMAT_RAW = 1
+FORMAT_ZLIB = 2
+FORMATS = [FORMAT_HEX, FORMAT_RAW, FORMAT_ZLIB]
+
+ZLIB_LEVEL = 6
+WRITE_CHUNK_SIZE = 4096
+READ_CHUNK_SIZE = 256 * 1024
+
+MIGRATION_STATEMENTS = [
+    'ALTER TABLE printdata MODIFY print_data LONGBLOB NOT NULL, '
+    'ADD COLUMN payload_format TINYINT NOT NULL DEFAULT 0',
+    'ALTER TABLE printdata_v2 MODIFY print_data LONGBLOB NOT NULL, '
+    'ADD COLUMN payload_format TINYINT NOT NULL DEFAULT 0',
+]
+
+
+def encode(data, payload_format=FORMAT_RAW):
+    '''Returns the job data as it should be stored for the format'''
+    if payload_format == FORMAT_RAW:
+        return data
+    elif payload_format == FORMAT_HEX:
+        return binascii.hexlify(data)
+    elif payload_format == FORMAT_ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    raise ValueError('Unknown payload format: {}'.format(payload_format))
+
+def encode_stream(stream, payload_format=FORMAT_RAW,
+                  chunk_size=READ_CHUNK_SIZE):
+    '''Reads the job data from a file a chunk at a time and generates it
+    encoded for the format, so a job of any size can be stored without
+    holding all of it in memory.
+    '''
+    if payload_format not in FORMATS:
+        raise ValueError('Unknown payload format: {}'.format(payload_format))
+
+    compressor = zlib.compressobj(ZLIB_LEVEL)
+    for data in iter(lambda: stream.read(chunk_size), b''):
+        if payload_format == FORMAT_ZLIB:
+            data = compressor.compress(data)
+        elif payload_format == FORMAT_HEX:
+            data = binascii.hexlify(data)
+        if data:
+            yield data
+
+    if payload_format == FORMAT_ZLIB:
+        yield compressor.flush()
+
+def decode(payload, payload_format):
+    '''Returns the bytes to send to the printer for a stored payload'''
+    return b''.join(chunks(payload, payload_format))
+
+def chunks(payload, payload_format, chunk_size=WRITE_CHUNK_SIZE):
+    '''Generates the bytes to send to the printer for a stored payload, no
+    more than chunk_size bytes at a time.
+    '''
+    return decode_stream([payload], payload_format, chunk_size)
+
+def decode_stream(pieces, payload_format, chunk_size=WRITE_CHUNK_SIZE):
+    '''Generates the bytes to send to the printer for a payload stored in
+    pieces, no more than chunk_size bytes at a time.  Each piece is decoded
+    as soon as it is taken from the iterable.
+    '''
+    if payload_format == FORMAT_RAW:
+        for piece in pieces:
+            for start in range(0, len(piece), chunk_size):
+                yield bytes(piece[start:start + chunk_size])
+    elif payload_format == FORMAT_HEX:
+        for data in unhexlify(pieces, chunk_size):
+            yield data
+    elif payload_format == FORMAT_ZLIB:
+        for data in inflate(pieces, chunk_size):
+            yield data
+    else:
+        raise ValueError('Unknown payload format: {}'.format(payload_format))
+
+def unhexlify(pieces, chunk_size=WRITE_CHUNK_SIZE):
+    '''Decodes hex text a chunk at a time, carrying a digit left over at the
+    end of one piece on to the next.
+    '''
+    carry = b''
+    for piece in pieces:
+        for start in range(0, len(piece), chunk_size * 2):
+            data = carry + bytes(piece[start:start + chunk_size * 2])
+            end = len(data) - len(data) % 2
+            carry = data[end:]
+            if end:
+                yield binascii.unhexlify(data[:end])
+
+    if carry:
+        # An odd number of digits, let binascii report it
+        yield binascii.unhexlify(carry)
+
+def inflate(pieces, chunk_size=WRITE_CHUNK_SIZE):
+    '''Decompresses a zlib payload a chunk at a time.  The compressed data
+    is fed in chunk_size slices too, as each call leaves any input it did
+    not get to in unconsumed_tail, which is a copy.
+    '''
+    inflater = zlib.decompressobj()
+    for piece in pieces:
+        for start in range(0, len(piece), chunk_size):
+            data = piece[start:start + chunk_size]
+            while data:
+                output = inflater.decompress(data, chunk_size)
+                if output:
+                    yield output
+                data = inflater.unconsumed_tail
+
+    output = inflater.flush()
+    if output:
+        yield output
+
+def write(ep_out, payload, payload_format, chunk_size=WRITE_CHUNK_SIZE):
+    '''Decodes a stored payload and writes it to the printers bulk out
+    endpoint as it goes.
+    '''
+    write_stream(ep_out, [payload], payload_format, chunk_size)
+
+def write_stream(ep_out, pieces, payload_format, chunk_size=WRITE_CHUNK_SIZE):
+    '''Decodes a payload stored in pieces and writes it to the printers bulk
+    out endpoint as each piece arrives.
+    '''
+    for data in decode_stream(pieces, payload_format, chunk_size):
+        ep_out.write(data)
+
+def migrate(cursor):
+    '''Converts the print job tables to binary payloads'''
+    for statement in MIGRATION_STATEMENTS:
+        cursor.execute(statement)
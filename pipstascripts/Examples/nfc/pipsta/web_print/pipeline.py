@@ -0,0 +1,180 @@
+# pipeline.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Runs the stages of printing a queue of jobs (fetching each job from the
+database, decoding it and writing it to the printer) at the same time,
+rather than one after another, so the next job is already fetched and
+decoded when the printer finishes the last one.
+
+Each stage is a generator function that takes an iterable of items and
+generates the items for the next stage.  Every stage runs in its own
+thread and hands its items to the next through a queue that holds at most
+'depth' items (the prefetch depth), so a fast stage can only get so far
+ahead of a slow one.  The items of the last stage are generated by run() in
+the callers thread, which is the write stage -
+
+    jobs = pipeline.Pipeline([('fetch', fetch_stage),
+                              ('decode', fetch.decode_jobs)], depth=8)
+    with contextlib.closing(jobs.run(rows)) as items:
+        for (job_id, data) in items:
+            ...
+
+An exception in any stage is raised by run() once the items before it have
+been written, and the stages are stopped if the write stage stops early.
+
+The time each stage spends waiting for its input (starved) or for room in
+the next queue (blocked) is recorded, the rest is the time it was busy.
+The stage with the highest utilisation (busy time over elapsed time) is
+the bottleneck.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import Queue
+import threading
+import time
+
+DEFAULT_DEPTH = 8
+
+# How often a stage waiting on a queue checks whether it has been stopped
+STOP_CHECK_PERIOD = 0.1
+
+
+class StageStats(object):
+    '''The items and time spent by one stage of a pipeline'''
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.elapsed = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    def busy(self):
+        '''Returns the time (seconds) spent doing work'''
+        return max(self.elapsed - self.starved - self.blocked, 0.0)
+
+    def utilisation(self):
+        '''Returns the fraction of the elapsed time spent doing work'''
+        if not self.elapsed:
+            return 0.0
+        return self.busy() / self.elapsed
+
+
+class _Failed(object):
+    '''Carries an exception from a stage to the stage after it'''
+    def __init__(self, error):
+        self.error = error
+
+_END = object()
+
+
+def _send(queue, item, stats, stop):
+    '''Puts an item on the queue, waiting for room, returns False if the
+    pipeline is stopped first.
+    '''
+    start = time.time()
+    try:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=STOP_CHECK_PERIOD)
+                return True
+            except Queue.Full:
+                pass
+        return False
+    finally:
+        stats.blocked += time.time() - start
+
+def _receive(queue, stats, stop):
+    '''Generates the items on the queue until the stage before ends, raising
+    any exception it failed with.
+    '''
+    while not stop.is_set():
+        start = time.time()
+        try:
+            item = queue.get(timeout=STOP_CHECK_PERIOD)
+        except Queue.Empty:
+            continue
+        finally:
+            stats.starved += time.time() - start
+
+        if item is _END:
+            return
+        elif isinstance(item, _Failed):
+            raise item.error
+        yield item
+
+def _run_stage(function, source, queue, stats, stop):
+    '''Runs a stage in its thread, sending its items to the queue'''
+    start = time.time()
+    items = function(source)
+    try:
+        for item in items:
+            stats.items += 1
+            if not _send(queue, item, stats, stop):
+                return
+        _send(queue, _END, stats, stop)
+    except Exception as err: # pylint: disable=W0703
+        _send(queue, _Failed(err), stats, stop)
+    finally:
+        items.close()
+        stats.elapsed += time.time() - start
+
+
+class Pipeline(object):
+    '''Runs a list of (name, stage) in threads connected by bounded queues.
+    The stats of each stage, and of the callers write stage (sink), are
+    kept across runs.
+    '''
+    def __init__(self, stages, depth=DEFAULT_DEPTH, sink='write'):
+        self.__stages = stages
+        self.__depth = depth
+        self.stats = [StageStats(name) for name, dummy in stages]
+        self.stats.append(StageStats(sink))
+
+    def run(self, items):
+        '''Starts the stages on the items and generates the items of the
+        last stage.  The stages are stopped, and their threads joined, once
+        every item has been generated or the generator is closed.
+        '''
+        stop = threading.Event()
+        queues = [Queue.Queue(self.__depth) for dummy in self.__stages]
+        inputs = [iter(items)]
+        for queue, stats in zip(queues, self.stats[1:]):
+            inputs.append(_receive(queue, stats, stop))
+
+        threads = []
+        for (dummy, function), source, queue, stats in zip(
+                self.__stages, inputs, queues, self.stats):
+            thread = threading.Thread(target=_run_stage,
+                                      args=(function, source, queue, stats,
+                                            stop))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        sink = self.stats[-1]
+        start = time.time()
+        try:
+            for item in inputs[-1]:
+                sink.items += 1
+                yield item
+        finally:
+            sink.elapsed += time.time() - start
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def bottleneck(self):
+        '''Returns the name of the stage with the highest utilisation'''
+        return max(self.stats, key=lambda stats: stats.utilisation()).name
+
+    def report(self):
+        '''Returns a one line summary of the utilisation of each stage'''
+        return 'pipeline depth={} '.format(self.__depth) + ' '.join(
+            '{}={:.0%}'.format(stats.name, stats.utilisation())
+            for stats in self.stats) + \
+            ' bottleneck={}'.format(self.bottleneck())
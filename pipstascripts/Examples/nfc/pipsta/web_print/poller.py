@@ -0,0 +1,114 @@
+# poller.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Decides how long a client waits before it next polls for work.
+
+Polling at a fixed period is a poor fit both ways: a client that has just
+printed a batch of jobs sleeps for the full period although more jobs are
+likely to be waiting, and a client left idle overnight keeps polling just
+as often as it does when busy.  The adaptive poller instead -
+
+    polls again straight away after a poll that found work,
+
+    waits the base period after the first poll that finds nothing, and
+
+    doubles the wait after each further empty poll, up to the ceiling.
+
+Each wait is spread by up to +/- jitter (a fraction of the wait) at random,
+so a fleet of printers started together (after a power cut, say) do not
+all poll the database at the same moment for ever after.
+
+    job_poller = poller.AdaptivePoller(PRINT_JOB_POLL_PERIOD, 300)
+    while True:
+        job_poller.wait(listener, printer_id)
+        job_poller.record(process_print_jobs(...))
+
+The current interval (without jitter) is kept in job_poller.interval, and
+stats() gives a one line summary for the clients to report.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import random
+import time
+
+DEFAULT_BACKOFF = 2.0
+DEFAULT_JITTER = 0.2
+
+
+class AdaptivePoller(object):
+    '''Works out the wait before each poll from the polls before it.
+    Periods are in seconds.
+    '''
+    def __init__(self, period, max_period, backoff=DEFAULT_BACKOFF,
+                 jitter=DEFAULT_JITTER, rng=None):
+        if not 0 < period <= max_period:
+            raise ValueError('The poll period must be more than 0 and no '
+                             'more than the maximum poll period')
+        self.__period = period
+        self.__max_period = max_period
+        self.__backoff = backoff
+        self.__jitter = jitter
+        self.__random = rng or random.Random()
+
+        self.interval = 0
+        self.polls = 0
+        self.busy_polls = 0
+        self.wakeups = 0
+
+    def record(self, found_work):
+        '''Records the result of a poll, anything true if it found work, and
+        works out the interval before the next.
+        '''
+        self.polls += 1
+        if found_work:
+            self.busy_polls += 1
+            self.interval = 0
+        elif self.interval < self.__period:
+            self.interval = self.__period
+        else:
+            self.interval = min(self.interval * self.__backoff,
+                                self.__max_period)
+
+    def reset(self):
+        '''Returns to the base period, for example when the client has been
+        told there is work on the way.
+        '''
+        self.interval = min(self.interval, self.__period)
+
+    def next_wait(self, limit=None):
+        '''Returns the seconds to wait before the next poll, the interval
+        with jitter added, and no more than limit if one is given.
+        '''
+        wait = self.interval * (1 + self.__random.uniform(-self.__jitter,
+                                                          self.__jitter))
+        wait = min(wait, self.__max_period)
+        if limit is not None:
+            wait = min(wait, limit)
+        return max(wait, 0)
+
+    def wait(self, listener=None, printer_id=None, limit=None):
+        '''Waits until the next poll is due, or until the listener (see
+        notifier.py) is told of a job for the printer.  Returns True if
+        woken by a notification.
+        '''
+        wait = self.next_wait(limit)
+        if listener is None:
+            if wait:
+                time.sleep(wait)
+            return False
+
+        if listener.wait(wait, printer_id):
+            self.wakeups += 1
+            self.reset()
+            return True
+        return False
+
+    def stats(self):
+        '''Returns a one line summary of the poller metrics'''
+        return 'poller interval={:.1f}s polls={} busy={} woken={}'.format(
+            self.interval, self.polls, self.busy_polls, self.wakeups)
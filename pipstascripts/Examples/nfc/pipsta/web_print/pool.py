@@ -0,0 +1,195 @@
+# pool.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+A small pool of database connections for the web print clients.  Opening a
+connection to a remote MySQL server costs several round trips (TCP, the
+handshake and authentication) so rather than connect for every poll, or
+worse for every job, the clients borrow a connection from the pool and
+hand it back when they are done.
+
+Connections that have sat idle for longer than the keepalive period are
+checked with a cheap query before they are handed out, and any connection
+that fails because it has lost the server (MySQL errors 2006 'server has
+gone away' and 2013 'lost connection') is thrown away so the next caller
+gets a fresh one.  Other errors, such as a lock wait timeout or a deadlock,
+leave the connection good, so its transaction is rolled back and it goes
+back in the pool.  The pool keeps simple metrics on how often
+connections are reused and how long queries take.
+
+The pool works with any DB-API module, it is given a function that opens a
+new connection, for example -
+
+    POOL = pool.ConnectionPool(lambda: MySQLdb.connect(**DB_CONFIG),
+                               lost_errors=(MySQLdb.OperationalError,))
+
+    with POOL.connection() as conn:
+        cursor = conn.cursor()
+        POOL.execute(cursor, SELECT_JOBS, (printer_id,))
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import contextlib
+import threading
+import time
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_KEEPALIVE = 60
+KEEPALIVE_QUERY = 'SELECT 1'
+
+# The MySQL client error codes for a connection that has lost the server
+CR_SERVER_GONE_ERROR = 2006
+CR_SERVER_LOST = 2013
+LOST_CONNECTION_CODES = (CR_SERVER_GONE_ERROR, CR_SERVER_LOST)
+
+
+class ConnectionPool(object):
+    '''A thread safe pool of up to size idle database connections.  An
+    error of one of the lost_errors types means the connection is lost if
+    its code (its first argument) is one of lost_codes, or whatever its
+    code if lost_codes is None.  The metrics count connections opened,
+    reused and discarded as lost (healthy connections closed because the
+    pool is full, or by close(), are not counted).
+    '''
+    def __init__(self, connect, size=DEFAULT_POOL_SIZE,
+                 keepalive=DEFAULT_KEEPALIVE, lost_errors=(),
+                 lost_codes=LOST_CONNECTION_CODES):
+        self.__connect = connect
+        self.__size = size
+        self.__keepalive = keepalive
+        self.__lost_errors = tuple(lost_errors)
+        self.__lost_codes = lost_codes
+        self.__idle = []
+        self.__lock = threading.Lock()
+
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+        self.queries = 0
+        self.query_time = 0.0
+        self.max_query_time = 0.0
+
+    def acquire(self):
+        '''Returns an idle connection, checking it is still alive if it has
+        not been used for a while, or opens a new one.
+        '''
+        while True:
+            with self.__lock:
+                if not self.__idle:
+                    break
+                (conn, last_used) = self.__idle.pop()
+
+            if time.time() - last_used < self.__keepalive or \
+               self.__is_alive(conn):
+                with self.__lock:
+                    self.reused += 1
+                return conn
+
+            self.discard(conn)
+
+        conn = self.__connect()
+        with self.__lock:
+            self.opened += 1
+        return conn
+
+    def release(self, conn):
+        '''Returns the connection to the pool, closing it if the pool is
+        already full.
+        '''
+        with self.__lock:
+            if len(self.__idle) < self.__size:
+                self.__idle.append((conn, time.time()))
+                return
+
+        self.__close(conn)
+
+    def discard(self, conn):
+        '''Closes a connection that is broken rather than return it'''
+        with self.__lock:
+            self.discarded += 1
+        self.__close(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''Lends a connection for the duration of a with block.  The
+        transaction is committed if the block completes and rolled back if
+        it raises.  Connections that have been lost are not returned.
+        '''
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as err:
+            if self.__is_lost(err):
+                self.discard(conn)
+                raise
+
+            try:
+                conn.rollback()
+            except self.__lost_errors:
+                # A connection that cannot roll back is no use to the pool
+                self.discard(conn)
+                raise
+            self.release(conn)
+            raise
+
+        self.release(conn)
+
+    def execute(self, cursor, statement, args=()):
+        '''Executes the statement on the cursor, timing the query'''
+        start = time.time()
+        try:
+            return cursor.execute(statement, args)
+        finally:
+            elapsed = time.time() - start
+            with self.__lock:
+                self.queries += 1
+                self.query_time += elapsed
+                self.max_query_time = max(self.max_query_time, elapsed)
+
+    def close(self):
+        '''Closes every idle connection'''
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = []
+
+        for conn, dummy in idle:
+            self.__close(conn)
+
+    def stats(self):
+        '''Returns a one line summary of the pool metrics'''
+        mean = self.query_time / self.queries if self.queries else 0.0
+        return 'connections opened={} reused={} discarded={} ' \
+               'queries={} mean={:.1f}ms max={:.1f}ms'.format(
+                   self.opened, self.reused, self.discarded, self.queries,
+                   mean * 1000, self.max_query_time * 1000)
+
+    def __is_lost(self, err):
+        '''Returns True if the error means the connection has been lost'''
+        if not isinstance(err, self.__lost_errors):
+            return False
+        if self.__lost_codes is None:
+            return True
+        return bool(err.args) and err.args[0] in self.__lost_codes
+
+    def __is_alive(self, conn):
+        '''Runs the keepalive query on the connection'''
+        try:
+            cursor = conn.cursor()
+            cursor.execute(KEEPALIVE_QUERY)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except self.__lost_errors:
+            return False
+
+    def __close(self, conn):
+        '''Closes a connection, ignoring errors from one already lost'''
+        try:
+            conn.close()
+        except self.__lost_errors:
+            pass
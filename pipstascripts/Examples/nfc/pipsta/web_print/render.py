@@ -0,0 +1,124 @@
+# render.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Renders typed print jobs into the bytes the printer is sent, so a job can
+be rendered once by the machine that submits it and the printers only
+stream the stored bytes.  Banners, QR-Codes and images are drawn as the
+print examples draw them and encoded with the shared raster encoder
+(pipsta/graphics/raster.py), images loaded with the image loader
+image_print uses (pipsta/graphics/images.py) -
+
+    TYPE_RAW    the job is already printer bytes and is sent as it is
+    TYPE_TEXT   plain text, printed in the default font
+    TYPE_BANNER text drawn as a banner along the paper (banner_print)
+    TYPE_QR     a QR-Code of the data (qr_print)
+    TYPE_IMAGE  an image file, scaled to the paper width and dithered
+
+    data = render.render(render.TYPE_BANNER, b'Hello', font=FONT)
+
+Stored raster jobs are always encoded as 24 dot bands.  The printer
+scripts print SDL graphics by polling the printer status after every dot
+line, which a job streamed from the database cannot do, whereas the bands
+are spooled by the printer and need no polling.
+
+The banner and QR-Code examples are only imported when a job of their type
+is rendered, so qrcode (and pyusb, which the examples import to print) is
+not needed to submit other jobs.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+from pipsta.graphics import images, raster
+
+TYPE_RAW = 'raw'
+TYPE_TEXT = 'text'
+TYPE_BANNER = 'banner'
+TYPE_QR = 'qr'
+TYPE_IMAGE = 'image'
+TYPES = [TYPE_RAW, TYPE_TEXT, TYPE_BANNER, TYPE_QR, TYPE_IMAGE]
+
+# The types rendered as raster graphics, which compress well
+RASTER_TYPES = [TYPE_BANNER, TYPE_QR, TYPE_IMAGE]
+
+# Printer commands
+SELECT_DEFAULT_FONT = b'\x1b!\x00'
+SET_DARKNESS_LIGHT = b'\x1bX\x42\x50'
+RESTORE_DARKNESS = b'\x1bX\x42\x55'
+FEED_PAST_TEARBAR = b'\n' * 5
+
+# The graphics mode stored raster jobs are encoded in, see above
+STREAM_MODE = raster.MODE_BAND24
+
+MAX_INPUT_PIXELS = images.MAX_INPUT_PIXELS
+
+
+def raster_bytes(data, trim=raster.TRIM_NONE):
+    '''Trims the packed raster as requested and returns the printer bytes
+    that print it.
+    '''
+    trimmed = raster.trim_margins(data, raster.BYTES_PER_DOT_LINE, trim)
+    job = raster.encode(trimmed.data, raster.BYTES_PER_DOT_LINE, STREAM_MODE)
+    return b''.join(chunk for chunk, dummy in job.transfers)
+
+def render_text(text):
+    '''Returns the printer bytes for plain text'''
+    return b''.join([SELECT_DEFAULT_FONT, text, FEED_PAST_TEARBAR])
+
+def render_banner(text, font=None, trim=raster.TRIM_NONE):
+    '''Returns the printer bytes for the text drawn as a banner, printed
+    lighter as banner_print does.
+    '''
+    from pipsta.banner_print import banner
+
+    image = banner.create_banner_image(font or banner.DEFAULT_FONT,
+                                       text.strip())
+    return b''.join([SET_DARKNESS_LIGHT,
+                     raster_bytes(banner.convert_image(image), trim),
+                     RESTORE_DARKNESS, FEED_PAST_TEARBAR])
+
+def render_qr(data, max_height=None):
+    '''Returns the printer bytes for a QR-Code of the data, no more than
+    max_height dot lines high if given.  A ValueError is raised if the data
+    will not fit in a QR-Code.
+    '''
+    from pipsta.qr_print import qr
+    from qrcode.exceptions import DataOverflowError
+
+    try:
+        packed = qr.qr_raster(data, max_height)
+    except DataOverflowError:
+        raise ValueError('{} bytes is too much data for a QR-Code'.format(
+            len(data)))
+    return raster_bytes(packed) + FEED_PAST_TEARBAR
+
+def render_image(image_file, trim=raster.TRIM_NONE,
+                 max_pixels=MAX_INPUT_PIXELS):
+    '''Returns the printer bytes for the image in the file (a path or file
+    object), scaled to the paper width and dithered as image_print does.
+    '''
+    image = images.load_image(image_file, raster.DOTS_PER_LINE, max_pixels)
+    return raster_bytes(images.to_raster(image), trim) + FEED_PAST_TEARBAR
+
+def render(job_type, job_file, font=None, trim=raster.TRIM_NONE,
+           max_height=None, max_pixels=MAX_INPUT_PIXELS):
+    '''Returns the printer bytes for a job of the type, read from the open
+    (binary) file.  Options that do not apply to the type are ignored.
+    '''
+    if job_type == TYPE_IMAGE:
+        return render_image(job_file, trim, max_pixels)
+
+    data = job_file.read()
+    if job_type == TYPE_RAW:
+        return data
+    elif job_type == TYPE_TEXT:
+        return render_text(data)
+    elif job_type == TYPE_BANNER:
+        return render_banner(data, font, trim)
+    elif job_type == TYPE_QR:
+        return render_qr(data, max_height)
+
+    raise ValueError('Unknown job type: {}'.format(job_type))
@@ -0,0 +1,144 @@
+# retention.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Moves the print jobs every printer has printed out of the live tables used
+by WebPrintMany.py (printdata_v2, its chunks and printer_jobs) and into the
+archive tables created by schema.py, so the tables the printers query every poll
+only hold outstanding work.
+
+Job groups are archived a batch at a time, each batch in its own short
+transaction with a pause between batches, so the printers are never
+locked out of the live tables for long.  A group is archived once every
+printer it was sent to has printed it, and the printers' claims on it
+(see claims.py) are deleted rather than archived.  (WebPrint.py deletes its
+jobs as it prints them, so printdata needs no archiving.)
+
+Run it from cron, or leave it running with --every, from the 'nfc' folder -
+
+    python -m pipsta.web_print.retention --host HOST --user USER \\
+        --passwd PASSWORD --db DATABASE --every 3600
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import argparse
+import time
+
+from pipsta.web_print import schema
+
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_BATCH_PAUSE = 0.1
+
+# The index on printer_jobs (group_id) lets this stop as soon as it has
+# found enough groups, rather than grouping the whole table.
+SELECT_PRINTED_GROUPS = '''
+SELECT group_id
+FROM printer_jobs
+GROUP BY group_id
+HAVING MIN(printed) = TRUE
+LIMIT %s'''
+
+ARCHIVE_STATEMENTS = [
+    '''
+INSERT INTO printdata_v2_archive
+    (job_id, print_data, print_group_id, payload_format, chunked, priority)
+SELECT job_id, print_data, print_group_id, payload_format, chunked, priority
+FROM printdata_v2
+WHERE print_group_id IN ({})''',
+    '''
+INSERT INTO printdata_v2_chunks_archive (job_id, seq, chunk)
+SELECT c.job_id, c.seq, c.chunk
+FROM printdata_v2_chunks AS c
+INNER JOIN printdata_v2 AS d ON c.job_id = d.job_id
+WHERE d.print_group_id IN ({})''',
+    '''
+INSERT INTO printer_jobs_archive
+    (group_id, printer_id, printed, credentials)
+SELECT group_id, printer_id, printed, credentials
+FROM printer_jobs
+WHERE group_id IN ({})''',
+    '''
+DELETE c FROM printdata_v2_chunks AS c
+INNER JOIN printdata_v2 AS d ON c.job_id = d.job_id
+WHERE d.print_group_id IN ({})''',
+    '''
+DELETE FROM printdata_v2 WHERE print_group_id IN ({})''',
+    '''
+DELETE FROM printer_job_claims WHERE group_id IN ({})''',
+    '''
+DELETE FROM printer_jobs WHERE group_id IN ({})''',
+]
+
+
+def archive_batch(conn, batch_size=ARCHIVE_BATCH_SIZE):
+    '''Archives up to batch_size printed job groups in one transaction and
+    returns the number archived.
+    '''
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SELECT_PRINTED_GROUPS, (batch_size,))
+        groups = tuple(row[0] for row in cursor.fetchall())
+        if not groups:
+            conn.commit()
+            return 0
+
+        placeholders = ','.join(['%s'] * len(groups))
+        for statement in ARCHIVE_STATEMENTS:
+            cursor.execute(statement.format(placeholders), groups)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return len(groups)
+
+def archive(conn, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_BATCH_PAUSE):
+    '''Archives every printed job group, a batch at a time, and returns the
+    number archived.
+    '''
+    archived = 0
+    while True:
+        count = archive_batch(conn, batch_size)
+        archived += count
+        if count < batch_size:
+            return archived
+        time.sleep(pause)
+
+def parse_arguments():
+    '''Parse the database connection details and the schedule'''
+    parser = argparse.ArgumentParser(
+        description='Archives the print jobs every printer has printed')
+    schema.add_connection_arguments(parser)
+    parser.add_argument('--batch', type=int, default=ARCHIVE_BATCH_SIZE,
+                        help='job groups to archive in each transaction')
+    parser.add_argument('--every', type=int, default=0,
+                        help='archive every so many seconds rather than once')
+    return parser.parse_args()
+
+def main():
+    '''Archives the printed jobs once, or on a schedule'''
+    args = parse_arguments()
+    while True:
+        # Connect for each run, the server would drop a connection left idle
+        # between runs.
+        conn = schema.connect(args)
+        try:
+            start = time.time()
+            archived = archive(conn, args.batch)
+            print('Archived {} job groups in {:.1f}s'.format(
+                archived, time.time() - start))
+        finally:
+            conn.close()
+
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# scheduler.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Chooses which of the jobs waiting for a printer to print next.
+
+Jobs with a higher priority are always printed first.  Amongst the jobs of
+the same priority the order depends on the policy -
+
+    fifo    in the order they arrived, as the original examples did.
+
+    drr     fair shares, by deficit round robin.  Each job belongs to a
+            share (the credentials it was sent with, or its job group) and
+            the shares take turns.  Each turn a share is given a quantum of
+            bytes to print and prints its jobs, oldest first, for as long as
+            it has enough left, what it does not use is kept for its next
+            turn.  Someone who queues 300 tickets then only holds up the
+            next persons job by about a quantum, rather than 300 tickets.
+
+    sjf     shortest job first, the smallest waiting job is printed next.
+            This gives the lowest average wait but a large job may wait for
+            as long as smaller jobs keep arriving.
+
+The scheduler does not hold the jobs itself, select() is given every job
+that is waiting each time and chooses one, so a job that fails to print is
+simply chosen again.  Only the state of the round robin is kept between
+calls.
+
+    jobs = [scheduler.Job(job_id, priority, share, size, arrival), ...]
+    job = scheduler.Scheduler(scheduler.POLICY_DRR).select(jobs)
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import collections
+
+POLICY_FIFO = 'fifo'
+POLICY_DRR = 'drr'
+POLICY_SJF = 'sjf'
+POLICIES = [POLICY_FIFO, POLICY_DRR, POLICY_SJF]
+
+# Bytes each share may print each turn
+DEFAULT_QUANTUM = 16 * 1024
+
+# A job waiting to print, arrival orders the jobs (lower arrived first) and
+# size is in bytes.
+Job = collections.namedtuple('Job', 'job_id priority share size arrival')
+
+
+class Scheduler(object):
+    '''Chooses the next job to print by priority and then by the policy'''
+    def __init__(self, policy=POLICY_DRR, quantum=DEFAULT_QUANTUM):
+        if policy not in POLICIES:
+            raise ValueError('Unknown scheduling policy: {}'.format(policy))
+        self.policy = policy
+        self.__quantum = quantum
+        self.__rotation = []
+        self.__deficits = {}
+        self.__current = None
+
+    def select(self, jobs):
+        '''Returns the job to print next from the list of waiting jobs, or
+        None if there are none.
+        '''
+        if not jobs:
+            return None
+
+        top = max(job.priority for job in jobs)
+        jobs = sorted((job for job in jobs if job.priority == top),
+                      key=lambda job: job.arrival)
+
+        if self.policy == POLICY_FIFO:
+            return jobs[0]
+        elif self.policy == POLICY_SJF:
+            return min(jobs, key=lambda job: (job.size, job.arrival))
+        return self.__round_robin(jobs)
+
+    def __round_robin(self, jobs):
+        '''Deficit round robin between the shares of the jobs, which are in
+        the order they arrived.
+        '''
+        queues = collections.OrderedDict()
+        for job in jobs:
+            queues.setdefault(job.share, []).append(job)
+
+        # A share with nothing waiting loses its turn and any deficit, new
+        # shares join the end of the rotation.
+        self.__rotation = [share for share in self.__rotation
+                           if share in queues] + \
+                          [share for share in queues
+                           if share not in self.__rotation]
+        self.__deficits = dict((share, deficit) for share, deficit in
+                               self.__deficits.items() if share in queues)
+        if self.__current not in queues:
+            self.__current = None
+
+        while True:
+            share = self.__rotation[0]
+            if self.__current != share:
+                # The start of this shares turn
+                self.__deficits[share] = self.__deficits.get(share, 0) + \
+                                         self.__quantum
+                self.__current = share
+
+            job = queues[share][0]
+            if job.size <= self.__deficits[share]:
+                self.__deficits[share] -= job.size
+                if len(queues[share]) == 1:
+                    # The share has run out of jobs, so its turn ends
+                    self.__rotation.pop(0)
+                    del self.__deficits[share]
+                    self.__current = None
+                return job
+
+            self.__rotation.append(self.__rotation.pop(0))
+            self.__current = None
@@ -0,0 +1,384 @@
+# schema.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Creates and upgrades the tables of the print job database used by the web
+print examples, and checks the database can answer the printers' queries
+without scanning whole tables.
+
+The tables are -
+
+    printdata       jobs for WebPrint.py, one row per job and printer
+    printdata_v2    jobs for WebPrintMany.py, one row per job
+    printer_jobs    the printers (and credentials) each printdata_v2 job
+                    group is for, and whether each printer has printed it
+    printer_job_claims
+                    the print token of the printer that has claimed each
+                    printer_jobs row, and when the claim expires
+    printer_credentials
+                    the credentials each WebPrintMany.py printer holds, one
+                    row per credential, which the job query joins to
+                    printer_jobs
+    printdata_chunks, printdata_v2_chunks
+                    the payloads of the jobs stored in ordered chunks (those
+                    with chunked set), so the printers can stream them
+
+printdata_v2 jobs have a priority, the printers print the jobs with the
+highest priority first (see scheduler.py).
+
+The printers claim the jobs they are going to print with their print token
+(see claims.py), WebPrint.py in the claim_token and claim_expires columns of
+printdata and WebPrintMany.py in printer_job_claims, one row per printer_jobs
+row it has claimed.
+
+print_group_seq, a single row holding the last printdata_v2 group id
+handed out (WebSendMany.py takes the next one with LAST_INSERT_ID()), and
+printdata_v2_archive and printer_jobs_archive, which hold the job
+groups every printer has printed once retention.py has moved them out of
+the live tables (with printdata_v2_chunks_archive for their chunks).
+
+Every printer runs its job query every poll, so printer_jobs is indexed on
+(printer_id, printed, credentials) to find a printers outstanding jobs and
+the joins are indexed on the group id.
+
+The schema is versioned, each change is a numbered migration recorded in
+the schema_version table, and upgrade() applies any that are missing.  A
+database created by hand for the original examples is upgraded in place.
+MySQL commits each ALTER TABLE as it runs, so a migration that fails part
+way through cannot be rolled back.  Each step checks whether it has
+already been made, so running upgrade again finishes such a migration.
+From the 'nfc' folder run -
+
+    python -m pipsta.web_print.schema --host HOST --user USER \\
+        --passwd PASSWORD --db DATABASE upgrade
+
+and 'check' rather than 'upgrade' to EXPLAIN the printers' queries.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import argparse
+
+from pipsta.web_print import payload
+
+CREATE_SCHEMA_VERSION = '''
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT NOT NULL PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB'''
+
+# The tables as the original examples expect them, the column order of
+# printer_jobs matters as WebSendMany.py inserts into it by position.
+CREATE_TABLES = [
+    '''
+CREATE TABLE IF NOT EXISTS printdata (
+    job_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    print_data LONGTEXT NOT NULL,
+    printer_id VARCHAR(10) NOT NULL
+) ENGINE=InnoDB''',
+    '''
+CREATE TABLE IF NOT EXISTS printer_jobs (
+    group_id INT NOT NULL,
+    printer_id VARCHAR(10) NOT NULL,
+    printed BOOLEAN NOT NULL DEFAULT FALSE,
+    credentials VARCHAR(255) NULL
+) ENGINE=InnoDB''',
+    '''
+CREATE TABLE IF NOT EXISTS printdata_v2 (
+    job_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    print_data LONGTEXT NOT NULL,
+    print_group_id INT NOT NULL
+) ENGINE=InnoDB''',
+]
+
+# (name, table, columns) of each index
+INDEXES = [
+    ('printer_jobs_outstanding', 'printer_jobs',
+     'printer_id, printed, credentials'),
+    ('printer_jobs_group', 'printer_jobs', 'group_id'),
+    ('printdata_v2_group', 'printdata_v2', 'print_group_id'),
+    ('printdata_printer', 'printdata', 'printer_id'),
+]
+
+CREATE_CHUNKS = '''
+CREATE TABLE IF NOT EXISTS {}_chunks (
+    job_id INT NOT NULL,
+    seq INT NOT NULL,
+    chunk MEDIUMBLOB NOT NULL,
+    PRIMARY KEY (job_id, seq)
+) ENGINE=InnoDB'''
+
+# The job tables whose payloads may be stored in chunks
+CHUNKED_TABLES = ['printdata', 'printdata_v2']
+
+# The job tables converted to binary payloads, in the order of
+# payload.MIGRATION_STATEMENTS
+PAYLOAD_TABLES = ['printdata', 'printdata_v2']
+
+CREATE_GROUP_SEQUENCE = '''
+CREATE TABLE IF NOT EXISTS print_group_seq (
+    group_id INT NOT NULL
+) ENGINE=InnoDB'''
+
+CREATE_PRINTER_CREDENTIALS = '''
+CREATE TABLE IF NOT EXISTS printer_credentials (
+    printer_id VARCHAR(10) NOT NULL,
+    credential VARCHAR(255) NOT NULL,
+    PRIMARY KEY (printer_id, credential)
+) ENGINE=InnoDB'''
+
+CREATE_PRINTER_JOB_CLAIMS = '''
+CREATE TABLE IF NOT EXISTS printer_job_claims (
+    group_id INT NOT NULL,
+    printer_id VARCHAR(10) NOT NULL,
+    claim_token CHAR(32) NOT NULL,
+    claim_expires DATETIME NOT NULL,
+    PRIMARY KEY (group_id, printer_id)
+) ENGINE=InnoDB'''
+
+# The tables retention.py archives printed jobs from
+ARCHIVED_TABLES = ['printdata_v2', 'printer_jobs']
+
+# The printers' queries, with typical parameters, for check_plans()
+PRINTER_QUERIES = [
+    ('WebPrint jobs', '''
+SELECT job_id, payload_format, chunked
+FROM printdata
+WHERE printer_id = %s AND claim_token = %s''', ('000000001', '0' * 32)),
+    ('WebPrintMany jobs', '''
+SELECT job_id, payload_format, chunked, priority, print_group_id, credentials
+FROM printdata_v2 AS d
+INNER JOIN printer_jobs AS j ON d.print_group_id = j.group_id
+INNER JOIN printer_job_claims AS c
+    ON c.group_id = j.group_id AND c.printer_id = j.printer_id
+LEFT JOIN printer_credentials AS pc
+    ON pc.printer_id = j.printer_id AND pc.credential = j.credentials
+WHERE j.printer_id = %s AND printed = FALSE AND claim_token = %s
+    AND (pc.credential IS NOT NULL
+    OR (j.credentials IS NULL AND NOT EXISTS (
+        SELECT * FROM printer_credentials AS held
+        WHERE held.printer_id = j.printer_id)))''',
+     ('000000001', '0' * 32)),
+    ('WebPrintMany job chunks', '''
+SELECT chunk
+FROM printdata_v2_chunks
+WHERE job_id = %s
+ORDER BY seq''', (1,)),
+]
+
+# The EXPLAIN access types that read every row of a table or an index
+FULL_SCANS = ['ALL', 'index']
+
+
+def has_column(cursor, table, column):
+    '''Returns True if the table has the column'''
+    cursor.execute('SHOW COLUMNS FROM {} LIKE %s'.format(table), (column,))
+    return cursor.fetchone() is not None
+
+def has_index(cursor, table, name):
+    '''Returns True if the table has the index'''
+    cursor.execute('SHOW INDEX FROM {} WHERE Key_name = %s'.format(table),
+                   (name,))
+    return cursor.fetchone() is not None
+
+def add_column(cursor, table, column, definition):
+    '''Adds the column to the table unless it is already there'''
+    if not has_column(cursor, table, column):
+        cursor.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+            table, column, definition))
+
+def create_tables(cursor):
+    '''Creates any of the original tables that are missing'''
+    for statement in CREATE_TABLES:
+        cursor.execute(statement)
+
+def binary_payloads(cursor):
+    '''Stores payloads as binary (see payload.py), converting each table
+    unless that has already been done, by hand with payload.migrate() or
+    by an earlier upgrade.
+    '''
+    for table, statement in zip(PAYLOAD_TABLES,
+                                payload.MIGRATION_STATEMENTS):
+        if not has_column(cursor, table, 'payload_format'):
+            cursor.execute(statement)
+
+def create_indexes(cursor):
+    '''Indexes the columns the printers' queries search on'''
+    for name, table, columns in INDEXES:
+        if not has_index(cursor, table, name):
+            cursor.execute('CREATE INDEX {} ON {} ({})'.format(name, table,
+                                                               columns))
+
+def create_archive_tables(cursor):
+    '''Creates the archive tables retention.py moves printed jobs to, they
+    have the same columns as the live tables plus the time each row was
+    archived.
+    '''
+    for table in ARCHIVED_TABLES:
+        cursor.execute('CREATE TABLE IF NOT EXISTS {0}_archive LIKE {0}'.format(
+            table))
+        add_column(cursor, table + '_archive', 'archived',
+                   'TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP')
+
+def create_group_sequence(cursor):
+    '''Creates the print_group_seq sequence, starting it after the highest
+    group id already used (live or archived).
+    '''
+    cursor.execute(CREATE_GROUP_SEQUENCE)
+    cursor.execute('''
+INSERT INTO print_group_seq (group_id)
+SELECT GREATEST(COALESCE((SELECT MAX(group_id) FROM printer_jobs), 0),
+                COALESCE((SELECT MAX(group_id) FROM printer_jobs_archive), 0))
+FROM DUAL
+WHERE NOT EXISTS (SELECT * FROM print_group_seq)''')
+
+def create_chunk_tables(cursor):
+    '''Creates the tables job payloads are stored in chunks in, and the
+    chunked column that says which jobs use them.  The archive gets the
+    same so retention.py can archive chunked jobs.
+    '''
+    for table in CHUNKED_TABLES:
+        cursor.execute(CREATE_CHUNKS.format(table))
+        add_column(cursor, table, 'chunked', 'BOOLEAN NOT NULL DEFAULT FALSE')
+
+    add_column(cursor, 'printdata_v2_archive', 'chunked',
+               'BOOLEAN NOT NULL DEFAULT FALSE')
+    cursor.execute('CREATE TABLE IF NOT EXISTS printdata_v2_chunks_archive '
+                   'LIKE printdata_v2_chunks')
+    add_column(cursor, 'printdata_v2_chunks_archive', 'archived',
+               'TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP')
+
+def job_priorities(cursor):
+    '''Adds the priority column to printdata_v2 (and its archive), existing
+    jobs get the default priority of 0.
+    '''
+    for table in ['printdata_v2', 'printdata_v2_archive']:
+        add_column(cursor, table, 'priority', 'TINYINT NOT NULL DEFAULT 0')
+
+def print_claims(cursor):
+    '''Adds the print token claim columns to printdata, and the
+    printer_job_claims table, which keeps the claims on printer_jobs rows
+    apart as the original examples insert into printer_jobs by position.
+    Existing jobs are unclaimed.
+    '''
+    add_column(cursor, 'printdata', 'claim_token', 'CHAR(32) NULL')
+    add_column(cursor, 'printdata', 'claim_expires', 'DATETIME NULL')
+    cursor.execute(CREATE_PRINTER_JOB_CLAIMS)
+
+def printer_credentials(cursor):
+    '''Creates the printer_credentials table, which the printers fill in
+    with the credentials they hold when they next poll.
+    '''
+    cursor.execute(CREATE_PRINTER_CREDENTIALS)
+
+def drop_indexes(cursor):
+    '''Drops the indexes created by create_indexes()'''
+    for name, table, dummy in INDEXES:
+        cursor.execute('DROP INDEX {} ON {}'.format(name, table))
+
+# The migrations in the order they are applied, the version of each is its
+# position in the list (counting from 1).
+MIGRATIONS = [
+    ('original tables', create_tables),
+    ('binary payloads', binary_payloads),
+    ('printer query indexes', create_indexes),
+    ('archive tables', create_archive_tables),
+    ('print group sequence', create_group_sequence),
+    ('payload chunks', create_chunk_tables),
+    ('job priorities', job_priorities),
+    ('print claims', print_claims),
+    ('printer credentials', printer_credentials),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def current_version(cursor):
+    '''Returns the version of the schema, 0 for a new database'''
+    cursor.execute(CREATE_SCHEMA_VERSION)
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+def upgrade(conn):
+    '''Applies any migrations the database is missing, committing after
+    each one, and returns the list of those applied.
+    '''
+    cursor = conn.cursor()
+    applied = []
+    for version in range(current_version(cursor) + 1, SCHEMA_VERSION + 1):
+        (description, migration) = MIGRATIONS[version - 1]
+        migration(cursor)
+        cursor.execute('INSERT INTO schema_version (version, description) '
+                       'VALUES (%s, %s)', (version, description))
+        conn.commit()
+        applied.append(description)
+
+    cursor.close()
+    return applied
+
+def explain(cursor, statement, args):
+    '''Returns the rows of the EXPLAIN of a query as dictionaries'''
+    cursor.execute('EXPLAIN ' + statement, args)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def check_plans(cursor):
+    '''EXPLAINs each of the printers' queries and returns a list of the
+    problems found, that is any table (or index) read from end to end.  An
+    empty list means every query looks its rows up through an index.
+    '''
+    problems = []
+    for name, statement, args in PRINTER_QUERIES:
+        for step in explain(cursor, statement, args):
+            if step['type'] in FULL_SCANS:
+                problems.append('{}: {} scanned ({} rows)'.format(
+                    name, step['table'], step['rows']))
+    return problems
+
+def add_connection_arguments(parser):
+    '''Adds the MySQL connection details to an argument parser'''
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--passwd', default='')
+    parser.add_argument('--db', required=True)
+
+def connect(args):
+    '''Connects to MySQL with the details parsed from the arguments.
+    MySQLdb is imported here so the rest of the module can be used with
+    other databases.
+    '''
+    import MySQLdb
+    return MySQLdb.connect(host=args.host, port=args.port, user=args.user,
+                           passwd=args.passwd, db=args.db)
+
+def parse_arguments():
+    '''Parse the database connection details and the command'''
+    parser = argparse.ArgumentParser(
+        description='Manages the print job database schema')
+    add_connection_arguments(parser)
+    parser.add_argument('command', choices=['upgrade', 'check'])
+    return parser.parse_args()
+
+def main():
+    '''Upgrades the schema or checks the query plans'''
+    args = parse_arguments()
+    conn = connect(args)
+    try:
+        if args.command == 'upgrade':
+            for description in upgrade(conn):
+                print('Applied: ' + description)
+            print('Schema is at version {}'.format(SCHEMA_VERSION))
+        else:
+            problems = check_plans(conn.cursor())
+            for problem in problems:
+                print(problem)
+            print('{} problem(s) found'.format(len(problems)))
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+# service.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+A small HTTP service that queues print jobs, so a program sending many jobs
+does not have to start WebSendMany.py (a new python process and a new
+database connection) for each one.  The service keeps a print job queue
+(see backend.py) with its pool of connections open, and serves each client
+connection on its own thread.  Connections are kept open between requests
+(HTTP/1.1), so a client can send job after job over one connection.
+
+    POST /jobs?printer=ID[,ID...][&credentials=C][&priority=N]
+               [&format=raw|zlib|hex][&type=raw|text|banner|qr|image]
+
+        Queues the request body as a job.  The body is streamed into the
+        queue a chunk at a time as it arrives, so jobs of any size are
+        queued in constant memory.  Jobs of any type but raw are rendered
+        first (see render.py), which takes the whole body, so their body is
+        limited to MAX_RENDER_BODY bytes.  The font, trim and height options
+        are as WebSendMany.py.  Answers 201 with {"group_id": N}.
+
+    POST /jobs  (Content-Type: application/json)
+
+        Queues a batch of jobs in one transaction.  The body is a list of
+        jobs, each an object with the options above as keys ("printer" a
+        list or comma separated ids) and the job base64 encoded in "data".
+        Answers 201 with {"group_ids": [N, ...]}, in the order given.
+
+    GET /jobs/N
+
+        Answers 200 with the state of job group N on each of its printers,
+        {"group_id": N, "printers": [{"printer_id": ID, "state": S}, ...]}
+        where S is 'waiting', 'claimed' (a printer is fetching or printing
+        it) or 'printed'.
+
+Bad requests, including jobs that cannot be rendered, are answered 400,
+unknown paths and groups 404, database errors 503 and anything unexpected
+500 (its traceback printed), each with {"error": message}.  Once a job is
+committed a job notification is broadcast (see notifier.py), as
+WebSendMany.py does.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import base64
+import BaseHTTPServer
+import io
+import json
+import SocketServer
+import threading
+import traceback
+import urlparse
+
+from pipsta.graphics import raster
+from pipsta.web_print import notifier, payload, render
+
+DEFAULT_PORT = 8631
+JOBS_PATH = '/jobs'
+JSON_TYPE = 'application/json'
+
+# The largest bulk request body accepted (bulk jobs are decoded in memory)
+MAX_BULK_BODY = 16 * 1024 * 1024
+# The largest body accepted for a job that must be rendered, which is read
+# into memory to render it
+MAX_RENDER_BODY = 16 * 1024 * 1024
+
+FORMATS = {
+    'hex': payload.FORMAT_HEX,
+    'raw': payload.FORMAT_RAW,
+    'zlib': payload.FORMAT_ZLIB,
+}
+
+STATE_WAITING = 'waiting'
+STATE_CLAIMED = 'claimed'
+STATE_PRINTED = 'printed'
+
+
+class HTTPError(Exception):
+    '''A request that is answered with an error status'''
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class BodyReader(object):
+    '''Reads no more than length bytes from the file, so the request body
+    can be read like a file without reading into the next request.
+    '''
+    def __init__(self, rfile, length):
+        self.__rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        '''Reads up to size bytes of the body, or the rest of it'''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.__rfile.read(size) if size else b''
+        if len(data) < size:
+            raise HTTPError(400, 'The request body was cut short')
+        self.remaining -= len(data)
+        return data
+
+
+def job_arguments(options, job_file):
+    '''Returns the arguments to backend.submit() for a job from the request
+    options (a dict of strings, or of the values in a bulk job).  Jobs of
+    a type other than raw are rendered from the file first.
+    '''
+    printer_ids = options.get('printer')
+    if isinstance(printer_ids, basestring):
+        printer_ids = printer_ids.split(',')
+    printer_ids = [str(printer_id) for printer_id in printer_ids or ()
+                   if printer_id]
+    if not printer_ids:
+        raise HTTPError(400, 'No printer given')
+
+    credentials = options.get('credentials')
+    if credentials is not None:
+        credentials = str(credentials)
+
+    job_type = options.get('type', render.TYPE_RAW)
+    if job_type not in render.TYPES:
+        raise HTTPError(400, 'Unknown job type: {}'.format(job_type))
+
+    if job_type in render.RASTER_TYPES:
+        default_format = 'zlib'
+    else:
+        default_format = 'raw'
+    payload_format = FORMATS.get(options.get('format', default_format))
+    if payload_format is None:
+        raise HTTPError(400, 'Unknown format: {}'.format(options['format']))
+
+    try:
+        priority = int(options.get('priority', 0))
+        height = options.get('height')
+        if height is not None:
+            height = int(height)
+    except (TypeError, ValueError):
+        raise HTTPError(400, 'priority and height must be whole numbers')
+
+    if job_type != render.TYPE_RAW:
+        trim = options.get('trim', raster.TRIM_NONE)
+        if trim not in raster.TRIM_MODES:
+            raise HTTPError(400, 'Unknown trim: {}'.format(trim))
+        try:
+            job_file = io.BytesIO(render.render(
+                job_type, io.BytesIO(job_file.read()), options.get('font'),
+                trim, height))
+        except (IOError, ValueError) as err:
+            raise HTTPError(400, 'The job could not be rendered: {}'.format(
+                err))
+
+    return (job_file, printer_ids, credentials, payload_format, priority)
+
+
+class JobRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Answers the requests on one client connection'''
+    protocol_version = 'HTTP/1.1'
+    # Each answer is written in one piece when the request is done, rather
+    # than a header at a time, which would leave the client waiting on a
+    # delayed ACK for the rest of it
+    wbufsize = -1
+
+    def do_POST(self):
+        '''Queues the job, or batch of jobs, in the request body'''
+        self.__handle(self.__post)
+
+    def do_GET(self):
+        '''Answers the status of a job group'''
+        self.__handle(self.__get)
+
+    def log_message(self, *args):
+        '''Logs each request unless the server is quiet'''
+        if not self.server.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, *args)
+
+    def __handle(self, method):
+        '''Calls the method for the request and sends its answer, a status
+        and an object sent as JSON.
+        '''
+        url = urlparse.urlparse(self.path)
+        try:
+            (status, answer) = method(url)
+        except HTTPError as err:
+            (status, answer) = (err.status, {'error': str(err)})
+        except self.server.job_queue.errors as err:
+            (status, answer) = (503, {'error': str(err)})
+        except Exception: # pylint: disable=W0703
+            # The client is still answered, rather than left with a dropped
+            # connection
+            traceback.print_exc()
+            (status, answer) = (500, {'error': 'Internal server error'})
+        self.server.count(status)
+
+        # Anything left of a request that failed is not read, so the
+        # connection cannot be used for another request
+        if status >= 400:
+            self.close_connection = 1
+
+        body = json.dumps(answer)
+        self.send_response(status)
+        self.send_header('Content-Type', JSON_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __post(self, url):
+        '''Queues the jobs in the request'''
+        if url.path.rstrip('/') != JOBS_PATH:
+            raise HTTPError(404, 'Unknown path: {}'.format(url.path))
+
+        length = self.headers.getheader('Content-Length')
+        if length is None or not length.isdigit():
+            raise HTTPError(411, 'A Content-Length is required')
+        body = BodyReader(self.rfile, int(length))
+
+        content_type = self.headers.getheader('Content-Type', '')
+        if content_type.split(';')[0].strip() == JSON_TYPE:
+            if body.remaining > MAX_BULK_BODY:
+                raise HTTPError(413, 'Bulk requests are limited to {} '
+                                'bytes'.format(MAX_BULK_BODY))
+            try:
+                bulk = json.loads(body.read())
+            except ValueError as err:
+                raise HTTPError(400, 'Bad bulk request: {}'.format(err))
+            if not isinstance(bulk, list) or \
+                    not all(isinstance(job, dict) for job in bulk):
+                raise HTTPError(400, 'Bad bulk request: the body must be a '
+                                'list of job objects')
+
+            jobs = []
+            for job in bulk:
+                try:
+                    data = base64.b64decode(job.get('data', ''))
+                except (TypeError, ValueError) as err:
+                    raise HTTPError(400, 'Bad bulk request: "data" must be '
+                                    'base64: {}'.format(err))
+                jobs.append(job_arguments(job, io.BytesIO(data)))
+
+            group_ids = self.server.job_queue.submit_many(jobs)
+            self.server.queued(jobs)
+            return (201, {'group_ids': group_ids})
+
+        options = dict(urlparse.parse_qsl(url.query))
+        if options.get('type', render.TYPE_RAW) != render.TYPE_RAW and \
+                body.remaining > MAX_RENDER_BODY:
+            raise HTTPError(413, 'Jobs to be rendered are limited to {} '
+                            'bytes'.format(MAX_RENDER_BODY))
+        job = job_arguments(options, body)
+        group_id = self.server.job_queue.submit(*job)
+        self.server.queued([job])
+        return (201, {'group_id': group_id})
+
+    def __get(self, url):
+        '''Answers the state of the job group named in the path'''
+        (path, dummy, group_id) = url.path.rstrip('/').rpartition('/')
+        if path != JOBS_PATH or not group_id.isdigit():
+            raise HTTPError(404, 'Unknown path: {}'.format(url.path))
+
+        printers = []
+        for (printer_id, printed, claimed) in \
+                self.server.job_queue.job_status(int(group_id)):
+            if printed:
+                state = STATE_PRINTED
+            elif claimed:
+                state = STATE_CLAIMED
+            else:
+                state = STATE_WAITING
+            printers.append({'printer_id': printer_id, 'state': state})
+
+        if not printers:
+            raise HTTPError(404, 'No job group {}'.format(group_id))
+        return (200, {'group_id': int(group_id), 'printers': printers})
+
+
+class JobServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''Serves the job requests, each client connection on its own thread,
+    queueing the jobs in job_queue (a backend.Backend).  If notify is set a
+    job notification is broadcast for each request that queues jobs.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, job_queue, notify=True, quiet=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, JobRequestHandler)
+        self.job_queue = job_queue
+        self.notify = notify
+        self.quiet = quiet
+        self.__lock = threading.Lock()
+
+        self.requests = 0
+        self.failed = 0
+        self.jobs = 0
+
+    def count(self, status):
+        '''Counts a request answered with the status'''
+        with self.__lock:
+            self.requests += 1
+            if status >= 400:
+                self.failed += 1
+
+    def queued(self, jobs):
+        '''Counts the jobs queued (as lists of submit() arguments) by one
+        request and notifies their printers.
+        '''
+        with self.__lock:
+            self.jobs += len(jobs)
+        if self.notify:
+            printer_ids = set()
+            for job in jobs:
+                printer_ids.update(job[1])
+            notifier.notify(sorted(printer_ids))
+
+    def stats(self):
+        '''Returns a one line summary of the service metrics'''
+        return 'service requests={} failed={} jobs={}'.format(
+            self.requests, self.failed, self.jobs)
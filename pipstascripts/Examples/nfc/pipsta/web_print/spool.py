@@ -0,0 +1,317 @@
+# spool.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+A local spool of print jobs, kept in an SQLite database on the Pi, that sits
+between the print job database and the printer.
+
+A fetcher copies each new job for the printer into the spool and a printer
+thread prints the jobs from the spool, so a slow or broken network only
+delays new jobs reaching the spool and never stops a job part way through
+printing.  The spool is in WAL mode, so the fetcher can add jobs while the
+printer thread reads them, and every change is synced to disk before it is
+committed so the spool survives a crash or power cut.
+
+Jobs are spooled under their job id in the print job database, adding a job
+that is already spooled does nothing, so a job fetched twice is only
+printed once.  A job is spooled a chunk at a time, each chunk committed on
+its own while the job is marked fetching, so a slow fetch never holds the
+spool locked against the printer thread.  The job is only printed once its
+last chunk is in, and a job left fetching by a failed fetch or a crash is
+removed so it is fetched again.
+
+Printed jobs stay in the spool (marked printed) until acknowledge() has
+marked them complete in the print job database, which the fetcher does when
+it next reaches the database, and are then removed.
+
+A job is marked printing before the first byte of it is written, so a job
+cut off by a crash is still marked printing when the spool is next opened.
+recover_interrupted() then either treats such jobs as printed or spools
+them to be printed again.  The spool also keeps the print token the
+fetcher claims its jobs with (see claims.py), so the claims outlive a
+restart.
+
+    job_spool = spool.Spool('print_spool.db')
+
+    # The fetcher
+    job_spool.acknowledge(functools.partial(queue.mark_printed, printer_id))
+    if not job_spool.contains(job_id):
+        job_spool.add(job_id, payload_format, pieces)
+
+    # The printer thread
+    (job_id, payload_format) = job_spool.next_job()
+    job_spool.start_printing(job_id)
+    payload.write_stream(ep_out, job_spool.pieces(job_id), payload_format)
+    job_spool.mark_printed(job_id)
+
+Jobs are printed in the order they were spooled, or, if the spool is given a
+scheduler (see scheduler.py), in the order it chooses by their priority,
+share and size (the bytes spooled).
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+import sqlite3
+import threading
+
+from pipsta.web_print import claims
+from pipsta.web_print import scheduler as job_scheduler
+
+STATE_SPOOLED = 0
+STATE_PRINTED = 1
+STATE_PRINTING = 2
+STATE_FETCHING = 3
+
+# Seconds to wait for another thread's transaction before giving up
+BUSY_TIMEOUT = 30
+
+CREATE_TABLES = [
+    '''
+CREATE TABLE IF NOT EXISTS jobs (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL UNIQUE,
+    payload_format INTEGER NOT NULL,
+    state INTEGER NOT NULL DEFAULT 0,
+    priority INTEGER NOT NULL DEFAULT 0,
+    share TEXT NOT NULL DEFAULT '',
+    size INTEGER NOT NULL DEFAULT 0
+)''',
+    '''
+CREATE TABLE IF NOT EXISTS chunks (
+    job_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    chunk BLOB NOT NULL,
+    PRIMARY KEY (job_id, seq)
+)''',
+    '''
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT NOT NULL PRIMARY KEY,
+    value TEXT NOT NULL
+)''',
+]
+
+# Columns added to the jobs table since it was first created
+ADDED_COLUMNS = [
+    ('priority', 'INTEGER NOT NULL DEFAULT 0'),
+    ('share', "TEXT NOT NULL DEFAULT ''"),
+    ('size', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+
+class Spool(object):
+    '''A durable local queue of print jobs, safe to use from several
+    threads.  Each thread gets its own connection to the spool.
+    '''
+    def __init__(self, path, scheduler=None):
+        self.__path = path
+        self.__scheduler = scheduler
+        self.__local = threading.local()
+        self.__added = threading.Event()
+
+        self.spooled = 0
+        self.printed = 0
+        self.acknowledged = 0
+
+        with self.__connection() as conn:
+            for statement in CREATE_TABLES:
+                conn.execute(statement)
+
+            columns = [row[1] for row in
+                       conn.execute('PRAGMA table_info(jobs)')]
+            for name, definition in ADDED_COLUMNS:
+                if name not in columns:
+                    conn.execute('ALTER TABLE jobs ADD COLUMN {} {}'.format(
+                        name, definition))
+
+            # Jobs whose fetch was cut off by a crash are fetched again
+            self.__remove(conn, STATE_FETCHING)
+
+            conn.execute('INSERT OR IGNORE INTO settings (name, value) '
+                         "VALUES ('token', ?)", (claims.new_token(),))
+            (self.token,) = conn.execute(
+                "SELECT value FROM settings WHERE name = 'token'").fetchone()
+
+    def contains(self, job_id):
+        '''Returns True if the job is in the spool, printed or not'''
+        return self.__connection().execute(
+            'SELECT 1 FROM jobs WHERE job_id = ?', (job_id,)).fetchone() \
+            is not None
+
+    def add(self, job_id, payload_format, pieces, priority=0, share=''):
+        '''Spools a job, stored as it was in the print job database, from
+        the pieces of its payload in order.  Each piece is committed as it
+        arrives, and the job is only seen by next_job() once every piece has
+        been spooled.  If reading the pieces fails the job is removed again
+        and the error raised.  Returns False if the job was already in the
+        spool.
+        '''
+        conn = self.__connection()
+        with conn:
+            added = conn.execute(
+                'INSERT OR IGNORE INTO jobs (job_id, payload_format, state, '
+                'priority, share) VALUES (?, ?, ?, ?, ?)',
+                (job_id, payload_format, STATE_FETCHING, priority,
+                 share)).rowcount
+        if not added:
+            return False
+
+        try:
+            size = 0
+            for seq, piece in enumerate(pieces):
+                with conn:
+                    conn.execute('INSERT INTO chunks (job_id, seq, chunk) '
+                                 'VALUES (?, ?, ?)',
+                                 (job_id, seq, sqlite3.Binary(piece)))
+                size += len(piece)
+            with conn:
+                conn.execute('UPDATE jobs SET state = ?, size = ? '
+                             'WHERE job_id = ?',
+                             (STATE_SPOOLED, size, job_id))
+        except Exception:
+            with conn:
+                self.__remove(conn, STATE_FETCHING, job_id)
+            raise
+
+        self.spooled += 1
+        self.__added.set()
+        return True
+
+    def next_job(self):
+        '''Returns the (job_id, payload_format) of the next job to print,
+        the oldest or the one the scheduler chooses, or None if there is
+        none.
+        '''
+        if self.__scheduler is None:
+            return self.__connection().execute(
+                'SELECT job_id, payload_format FROM jobs WHERE state = ? '
+                'ORDER BY position LIMIT 1', (STATE_SPOOLED,)).fetchone()
+
+        formats = {}
+        jobs = []
+        for (job_id, payload_format, priority, share, size, position) in \
+                self.__connection().execute(
+                    'SELECT job_id, payload_format, priority, share, size, '
+                    'position FROM jobs WHERE state = ?', (STATE_SPOOLED,)):
+            formats[job_id] = payload_format
+            jobs.append(job_scheduler.Job(job_id, priority, share, size,
+                                          position))
+
+        job = self.__scheduler.select(jobs)
+        if job is None:
+            return None
+        return (job.job_id, formats[job.job_id])
+
+    def pieces(self, job_id):
+        '''Generates the stored payload of a spooled job a piece at a time'''
+        cursor = self.__connection().execute(
+            'SELECT chunk FROM chunks WHERE job_id = ? ORDER BY seq',
+            (job_id,))
+        for row in cursor:
+            yield bytes(row[0])
+
+    def start_printing(self, job_id):
+        '''Records that a job is about to be written to the printer'''
+        with self.__connection() as conn:
+            conn.execute('UPDATE jobs SET state = ? WHERE job_id = ?',
+                         (STATE_PRINTING, job_id))
+
+    def retry(self, job_id):
+        '''Spools a job that failed to print to be printed again'''
+        with self.__connection() as conn:
+            conn.execute('UPDATE jobs SET state = ? WHERE job_id = ?',
+                         (STATE_SPOOLED, job_id))
+
+    def recover_interrupted(self, reprint=False):
+        '''Settles the jobs left printing by a crash, and returns their ids.
+        They are treated as printed or, if reprint is set, spooled to be
+        printed again.
+        '''
+        with self.__connection() as conn:
+            job_ids = [row[0] for row in conn.execute(
+                'SELECT job_id FROM jobs WHERE state = ? ORDER BY position',
+                (STATE_PRINTING,))]
+            conn.execute('UPDATE jobs SET state = ? WHERE state = ?',
+                         (STATE_SPOOLED if reprint else STATE_PRINTED,
+                          STATE_PRINTING))
+        return job_ids
+
+    def mark_printed(self, job_id):
+        '''Records that a job has been printed'''
+        with self.__connection() as conn:
+            conn.execute('UPDATE jobs SET state = ? WHERE job_id = ?',
+                         (STATE_PRINTED, job_id))
+        self.printed += 1
+
+    def printed_jobs(self):
+        '''Returns the ids of the printed jobs not yet acknowledged'''
+        return [row[0] for row in self.__connection().execute(
+            'SELECT job_id FROM jobs WHERE state = ? ORDER BY position',
+            (STATE_PRINTED,))]
+
+    def acknowledge(self, mark_printed):
+        '''Passes the ids of every printed job to mark_printed(), which
+        marks them complete in the print job database (for example
+        backend.mark_printed() with the printer id bound), and removes the
+        jobs from the spool once it returns.  Database errors are left to
+        the caller, the jobs are acknowledged again next time.  Returns the
+        number of jobs acknowledged.
+        '''
+        job_ids = self.printed_jobs()
+        if not job_ids:
+            return 0
+
+        mark_printed(job_ids)
+
+        with self.__connection() as conn:
+            for job_id in job_ids:
+                conn.execute('DELETE FROM chunks WHERE job_id = ?', (job_id,))
+                conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+
+        self.acknowledged += len(job_ids)
+        return len(job_ids)
+
+    def wait(self, timeout):
+        '''Waits for up to timeout seconds for a job to be added'''
+        self.__added.wait(timeout)
+        self.__added.clear()
+
+    def depth(self):
+        '''Returns the number of spooled jobs still to print'''
+        return self.__connection().execute(
+            'SELECT COUNT(*) FROM jobs WHERE state = ?',
+            (STATE_SPOOLED,)).fetchone()[0]
+
+    def stats(self):
+        '''Returns a one line summary of the spool metrics'''
+        return 'spool jobs spooled={} printed={} acknowledged={} ' \
+               'waiting={}'.format(self.spooled, self.printed,
+                                   self.acknowledged, self.depth())
+
+    @staticmethod
+    def __remove(conn, state, job_id=None):
+        '''Removes the jobs in the state, or only the job if one is given,
+        and their chunks.
+        '''
+        where = 'state = ?'
+        args = (state,)
+        if job_id is not None:
+            where += ' AND job_id = ?'
+            args += (job_id,)
+        conn.execute('DELETE FROM chunks WHERE job_id IN (SELECT job_id '
+                     'FROM jobs WHERE {})'.format(where), args)
+        conn.execute('DELETE FROM jobs WHERE {}'.format(where), args)
+
+    def __connection(self):
+        '''Returns this threads connection to the spool, opening it first
+        if need be.
+        '''
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.__path, timeout=BUSY_TIMEOUT)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self.__local.conn = conn
+        return conn
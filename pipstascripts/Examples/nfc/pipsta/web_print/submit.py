@@ -0,0 +1,94 @@
+# submit.py
+# $Rev$
+# Copyright (c) 2015 Able Systems Limited. All rights reserved.
+'''This simple code example is provided as-is, and is for demonstration
+purposes only. Able Systems takes no responsibility for any system
+implementations based on this code.
+
+Stores the payload of a print job in the print job database straight from
+the file it is read from.
+
+The job row is inserted with an empty payload and the file is then read
+and encoded a chunk at a time, so the sender never holds more than a chunk
+of the job in memory (nor has to build a statement as big as the job, which
+the server may refuse as larger than its max_allowed_packet).  Each chunk
+is either -
+
+    stored as a row of the job tables chunk table (store_chunks()), the
+    job row has chunked set and the printers stream the chunks back one
+    row at a time, or
+
+    appended to the print_data of the job row (append_payload()), which is
+    what printers still running the original examples read.
+
+The inserts are part of the callers transaction, the printers do not see
+the job until it is committed.  A payload kept in the job row is still
+limited to the servers max_allowed_packet, which applies to the value as it
+is read back as well as to each statement, chunk rows have no such limit.
+
+The statements are written for MySQL.  A caller using another database
+(see backend.py) passes its own statement in their place, and may pass the
+function that executes them.
+
+Copyright (c) 2015, Able Systems Ltd. All rights reserved.
+'''
+
+from pipsta.web_print import payload
+
+APPEND_PAYLOAD = '''
+UPDATE {} SET print_data = CONCAT(print_data, %s) WHERE job_id = %s'''
+INSERT_CHUNK = '''
+INSERT INTO {}_chunks (job_id, seq, chunk) VALUES (%s, %s, %s)'''
+
+
+def execute_statement(cursor, statement, args):
+    '''Executes the statement on the cursor'''
+    return cursor.execute(statement, args)
+
+def append_payload(cursor, table, job_id, stream,
+                   payload_format=payload.FORMAT_RAW, binary=bytes,
+                   execute=execute_statement, statement=None):
+    '''Appends the file to the print_data of a job in the table, encoded
+    for the format, a chunk at a time.  binary wraps each chunk for the
+    database module (MySQLdb.Binary for MySQL).  statement replaces
+    APPEND_PAYLOAD for the table if given, and execute(cursor, statement,
+    args) runs it.  Returns the number of bytes stored.
+    '''
+    stored = 0
+    statement = statement or APPEND_PAYLOAD.format(table)
+    for data in payload.encode_stream(stream, payload_format):
+        execute(cursor, statement, (binary(data), job_id))
+        stored += len(data)
+
+    return stored
+
+def store_chunks(cursor, table, job_id, stream,
+                 payload_format=payload.FORMAT_RAW, binary=bytes,
+                 execute=execute_statement, statement=None):
+    '''Stores the file as the chunk rows of a job in the table, encoded for
+    the format, one row per chunk.  binary wraps each chunk for the
+    database module.  statement replaces INSERT_CHUNK for the table if
+    given, and execute(cursor, statement, args) runs it.  Returns the
+    number of bytes stored.
+    '''
+    stored = 0
+    statement = statement or INSERT_CHUNK.format(table)
+    for seq, data in enumerate(payload.encode_stream(stream, payload_format)):
+        execute(cursor, statement, (job_id, seq, binary(data)))
+        stored += len(data)
+
+    return stored
+
+def store_payload(cursor, table, job_id, stream, chunked,
+                  payload_format=payload.FORMAT_RAW, binary=bytes,
+                  execute=execute_statement, statement=None):
+    '''Stores the file as the payload of a job in the table, in chunk rows
+    if chunked is set or in the print_data of the job otherwise.  statement
+    and execute are as store_chunks() and append_payload().  Returns the
+    number of bytes stored.
+    '''
+    if chunked:
+        return store_chunks(cursor, table, job_id, stream, payload_format,
+                            binary, execute, statement)
+    return append_payload(cursor, table, job_id, stream, payload_format,
+                          binary, execute, statement)